@@ -0,0 +1,296 @@
+import os
+import json
+import shutil
+import hashlib
+from uuid import uuid4
+from threading import Lock, Event
+from contextlib import contextmanager
+from typing import Sequence
+
+
+class FakeMinio:
+    """
+    Stand-in for the minio client, keeping objects in a local directory, so StorageManager itself is exercised
+    """
+    root = "objects"
+
+    def __init__(self, *args, **kwargs):
+        os.makedirs(FakeMinio.root, exist_ok=True)
+
+
+    def bucket_exists(self, bucket: str) -> bool:
+        return True
+
+
+    def get_presigned_url(self, method: str, bucket: str, object_name: str, **kwargs) -> str:
+        return f"file://{self._path(object_name)}"
+
+
+    def stat_object(self, bucket: str, object_name: str):
+        from minio.error import S3Error
+
+        if not os.path.exists(self._path(object_name)):
+            raise S3Error("NoSuchKey", "Object does not exist", object_name, None, None, None)
+
+        return os.stat(self._path(object_name))
+
+
+    def get_object(self, bucket: str, object_name: str):
+        return FakeResponse(self._path(object_name))
+
+
+    def fput_object(self, bucket: str, object_name: str, file_path: str, **kwargs):
+        shutil.copyfile(file_path, self._path(object_name))
+
+
+    def put_object(self, bucket: str, object_name: str, data, length: int, **kwargs):
+        with open(self._path(object_name), "wb") as f:
+            shutil.copyfileobj(data, f)
+
+
+    @classmethod
+    def put(cls, object_name: str, local_path: str):
+        os.makedirs(cls.root, exist_ok=True)
+        shutil.copyfile(local_path, os.path.join(cls.root, object_name))
+
+
+    def _path(self, object_name: str) -> str:
+        return os.path.join(FakeMinio.root, object_name)
+
+
+class FakeResponse:
+    def __init__(self, path: str):
+        self._f = open(path, "rb")
+
+
+    def stream(self, amt: int):
+        while True:
+            data = self._f.read(amt)
+            if not data:
+                return
+            yield data
+
+
+    def close(self):
+        self._f.close()
+
+
+    def release_conn(self):
+        pass
+
+
+class FakeLockManager:
+    """
+    Single process stand-in for the Redis locks, nothing is ever contended
+    """
+    def __init__(self):
+        pass
+
+
+    @contextmanager
+    def wait_for_lock(self, lock_name: str, data: str = "TAKEN", expiration: int | None = 3600):
+        yield True
+
+
+    @contextmanager
+    def semaphore(self, name: str, units: int = 1, capacity: int = 1, priority: int = 0, lease: int = 60,
+                  timeout: float | None = None):
+        from veridash_backend.commons.mutex import Lease
+        yield Lease(name, str(uuid4()), 1)
+
+
+    def wait_stats(self) -> dict:
+        return {}
+
+
+class FakeJobTracker:
+    """
+    Records job updates instead of publishing them
+    """
+    def __init__(self):
+        self.published: list[tuple[str, str, dict | None]] = []
+
+
+    def publish(self, task_id: str, state: str, data: dict | None = None):
+        self.published.append((task_id, state, data))
+
+
+    def count_progress(self, task_id: str, parts: int, expiration: int = 3600) -> int:
+        done = sum(1 for x in self.published if x[0] == task_id and x[1] == "PROGRESS") + 1
+        self.publish(task_id, "PROGRESS", {"progress": done / parts, "partsDone": done, "parts": parts})
+        return done
+
+
+    def claim(self, key: str, task_id: str, expiration: int = 3600) -> str:
+        return task_id
+
+
+    def release(self, task_id: str):
+        pass
+
+
+    def renew(self, task_id: str, expiration: int, extend_only: bool = False) -> bool:
+        return True
+
+
+    def keep_alive(self, task_id: str, expiration: int = 60) -> Event:
+        stop = Event()
+        stop.set()
+        return stop
+
+
+class FakeDatabase:
+    """
+    In-memory stand-in for Database, covering what the worker uses. Videos only share results with themselves.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.videos: dict[str, dict] = {}
+        self.results: dict[tuple[str, str, str | None], dict] = {}
+        self.keyframes: dict[str, list[tuple[str, float | None]]] = {}
+        self.detections: dict[str, list[tuple[str, int, str, float]]] = {}
+        self.translations: dict[tuple[str, str], str] = {}
+
+
+    def add_video(self, object_name: str, blob_name: str | None = None):
+        self.videos[object_name] = {"blob_name": blob_name or object_name, "hash": None}
+
+
+    def reset(self, object_name: str):
+        """
+        Forget everything computed for a video, so the next run computes it again
+        """
+        with self._lock:
+            self.keyframes.pop(object_name, None)
+            self.detections.pop(object_name, None)
+            for key in [k for k in self.results if k[0] == object_name]:
+                del self.results[key]
+
+
+    def get_blob_name(self, object_name: str) -> str | None:
+        video = self.videos.get(object_name)
+        return None if video is None else video["blob_name"]
+
+
+    def has_verified_hash(self, object_name: str) -> bool:
+        return self.videos[object_name]["hash"] is not None
+
+
+    def set_video_hash(self, object_name: str, digest: str):
+        self.videos[object_name]["hash"] = digest
+
+
+    def add_video_hash_if_not_exists(self, object_name: str, local_path: str):
+        video = self.videos[object_name]
+        if video["hash"] is not None:
+            return
+
+        hasher = hashlib.sha256()
+        with open(local_path, "rb") as f:
+            while data := f.read(1_000_000):
+                hasher.update(data)
+
+        video["hash"] = hasher.hexdigest()
+
+
+    def add_video_fingerprint(self, object_name: str, frame_hashes: list[int], *args) -> str | None:
+        return None
+
+
+    def get_cached_results(self, object_name: str, job_type: str, job_key: str | None = None) -> dict | None:
+        return self.results.get((object_name, job_type, job_key))
+
+
+    def store_job_result(self, object_name: str, job_type: str, job_result: dict, job_key: str | None = None):
+        # as stored in postgres
+        self.results[(object_name, job_type, job_key)] = json.loads(json.dumps(job_result))
+
+
+    def add_video_keyframes(self, video_name: str, image_names: list[str],
+                            timestamps: list[float | None] | None = None,
+                            embeddings: list[Sequence[float]] | None = None) -> list[str]:
+        timestamps = timestamps or [None] * len(image_names)
+        names = [str(uuid4()) + os.path.splitext(x)[1] for x in image_names]
+
+        self.keyframes[video_name] = list(zip(names, timestamps))
+        self.detections.pop(video_name, None)
+        return names
+
+
+    def get_keyframes_by_video_name(self, video_name: str) -> list[tuple[str, float | None]]:
+        return list(self.keyframes.get(video_name, []))
+
+
+    def get_images_by_video_name(self, video_name: str) -> list[str]:
+        return [x[0] for x in self.get_keyframes_by_video_name(video_name)]
+
+
+    def get_keyframe_run(self, video_name: str) -> tuple[int, list[str]] | None:
+        names = self.get_images_by_video_name(video_name)
+        return None if len(names) == 0 else (id(self.keyframes[video_name]), names)
+
+
+    def add_detected_objects(self, video_name: str, keyframe_run: int,
+                             detections: list[tuple[int, int, str, float, tuple]],
+                             embeddings: list[Sequence[float]] | None = None,
+                             object_names: list[str] | None = None) -> list[str]:
+        names = object_names or [str(uuid4()) + ".jpg" for _ in detections]
+
+        self.detections[video_name] = [(n, x[0], x[2], x[3]) for n, x in zip(names, detections)]
+        return names
+
+
+    def get_detections_by_video_name(self, video_name: str) -> list[tuple[str, int, str, float]] | None:
+        detections = self.detections.get(video_name)
+        return None if detections is None else list(detections)
+
+
+    def get_translations(self, source_hashes: list[str], source_language: str) -> dict[str, str]:
+        return {h: self.translations[(h, source_language)] for h in source_hashes
+                if (h, source_language) in self.translations}
+
+
+    def add_translations(self, translations: dict[str, str], source_language: str):
+        for h, x in translations.items():
+            self.translations[(h, source_language)] = x
+
+
+def install(objects_dir: str):
+    """
+    Swap the service clients for the fakes. Must run before veridash_backend.worker.app is imported,
+    as it creates its clients at import.
+    :param objects_dir: Where the fake object storage keeps objects
+    """
+    from veridash_backend.commons import db, jobs, mutex, storage
+
+    FakeMinio.root = objects_dir
+
+    storage.Minio = FakeMinio
+    mutex.LockManager = FakeLockManager
+    jobs.JobTracker = FakeJobTracker
+    db.Database = FakeDatabase
+
+
+def configure(work_dir: str):
+    """
+    Defaults for everything the worker needs from its environment, anything set already is kept
+    """
+    defaults = {
+        "TEMP_STORAGE_DIR": os.path.join(work_dir, "tmp"),
+        "POSTGRES_CONN_STR": "unused",
+        "REDIS_HOST": "unused",
+        "REDIS_PORT": "6379",
+        "REDIS_DB": "0",
+        "MINIO_HOST": "unused",
+        "MINIO_SECURE": "false",
+        "MINIO_USER": "unused",
+        "MINIO_PASS": "unused",
+        "MINIO_BUCKET": "bench",
+        "WHISPER_MODEL": "tiny",
+        "YOLO_WEIGHTS": "yolov8n.pt",
+        "CUDA_VISIBLE_DEVICES": "",
+    }
+    for k, v in defaults.items():
+        os.environ.setdefault(k, v)
+
+    install(os.path.join(work_dir, "objects"))
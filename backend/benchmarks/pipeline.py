@@ -0,0 +1,246 @@
+"""
+Per-task latency, throughput and peak memory of the worker pipeline, without redis, postgres or minio.
+Tasks run in-process against local stand-ins (see fakes.py) on synthetic videos, with small cpu models by default.
+Results are written as json, to compare commits, e.g.
+
+    python -m benchmarks.pipeline --durations 30 120 --repeat 3 --output pipeline-$(git rev-parse --short HEAD).json
+
+The first run of each task is cold (empty caches, models not loaded), the others are warm: computed results are
+forgotten between runs, but downloads, decoded frames and loaded models are kept, as in a long-running worker.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+from time import perf_counter, sleep
+from threading import Thread, Event
+
+from benchmarks import fakes
+from benchmarks.videos import synthetic_video
+
+
+TASKS = ["metadata", "keyframes", "objects", "transcription", "stitch"]
+# tasks which need others to have run first, for the same video
+DEPENDS = {"objects": "keyframes", "stitch": "keyframes"}
+
+
+class PeakMemory:
+    """
+    Peak resident memory while in the context, sampled, as ru_maxrss only ever covers the whole process
+    """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._page = os.sysconf("SC_PAGE_SIZE")
+        self._done = Event()
+        self._thread = Thread(target=self._sample, daemon=True)
+
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+    def _rss(self) -> int:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * self._page
+
+
+    def _sample(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, self._rss())
+            sleep(self.interval)
+
+
+def git_commit() -> dict:
+    def git(*args) -> str:
+        return subprocess.run(["git", *args], capture_output=True, text=True).stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "HEAD") or None,
+        "dirty": git("status", "--porcelain", "--untracked-files=no") != "",
+    }
+
+
+def throughput(task: str, result: dict, duration: float) -> tuple[float | None, str | None]:
+    """
+    :return: Units of work in the result, and what they are
+    """
+    if task in ("keyframes", "stitch"):
+        return len(result.get("urls") or result.get("sourceKeyFrames") or []), "frames"
+    if task == "objects":
+        return len(set(result.get("keyFrameNumbers", []))), "frames with objects"
+    if task == "transcription":
+        return duration, "audio seconds"
+
+    return None, None
+
+
+def pan_frames(timestamps: list[float | None], duration: float, count: int = 4) -> list[int]:
+    """
+    :return: 1-based numbers of keyframes from the panning scene, which is the second quarter of a synthetic video
+    """
+    frames = [i + 1 for i, t in enumerate(timestamps) if t is not None and duration / 4 <= t < duration / 2]
+    if len(frames) < 2:
+        frames = list(range(1, len(timestamps) + 1))
+
+    return frames[:count]
+
+
+def run_task(worker, task: str, video: str, args: list) -> dict:
+    """
+    :return: Timing, memory and outcome of one run
+    """
+    fn = getattr(worker, f"get_{task}")
+
+    with PeakMemory() as memory:
+        start = perf_counter()
+        res = fn.apply(args=[video, *args])
+        elapsed = perf_counter() - start
+
+    out = {
+        "seconds": elapsed,
+        "peak_rss_mb": memory.peak / 2**20,
+        "status": res.state,
+    }
+
+    value = res.get(propagate=False)
+    if res.failed():
+        out["error"] = repr(value)
+    elif isinstance(value, dict) and "error" in value:
+        out["status"] = "ERROR"
+        out["error"] = value["error"]
+    else:
+        out["result"] = value
+
+    return out
+
+
+def summarise(task: str, runs: list[dict], duration: float) -> dict:
+    warm = [x["seconds"] for x in runs[1:]]
+
+    out = {
+        "status": runs[-1]["status"],
+        "cold_seconds": runs[0]["seconds"],
+        "warm_median_seconds": statistics.median(warm) if warm else None,
+        "warm_seconds": warm,
+        "peak_rss_mb": max(x["peak_rss_mb"] for x in runs),
+    }
+
+    if "error" in runs[-1]:
+        out["error"] = runs[-1]["error"]
+    else:
+        units, unit = throughput(task, runs[-1]["result"], duration)
+        if unit is not None:
+            seconds = out["warm_median_seconds"] or out["cold_seconds"]
+            out["throughput"] = units / max(seconds, 1e-9)
+            out["throughput_unit"] = f"{unit}/s"
+
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--durations", type=float, nargs="+", default=[30.0], help="synthetic video lengths, seconds")
+    parser.add_argument("--videos", nargs="*", default=[], help="real videos to include")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per task, the first being cold")
+    parser.add_argument("--tasks", nargs="+", choices=TASKS, default=TASKS)
+    parser.add_argument("--work-dir", help="kept afterwards if given, a temporary directory otherwise")
+    parser.add_argument("--output", help="json file, stdout if not given")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="veridash-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    fakes.configure(work_dir)
+
+    # imported after the fakes are installed, as it connects to everything on import
+    from veridash_backend.worker import app as worker
+
+    videos = []
+    for i, d in enumerate(args.durations):
+        path = os.path.join(work_dir, f"synthetic-{i}.mp4")
+        synthetic_video(path, d, args.width, args.height)
+        videos.append((path, d))
+
+    for path in args.videos:
+        probe = json.loads(subprocess.run(["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", path],
+                                          capture_output=True, text=True, check=True).stdout)
+        videos.append((path, float(probe["format"]["duration"])))
+
+    results = []
+    try:
+        for i, (path, duration) in enumerate(videos):
+            name = f"bench-{i}{os.path.splitext(path)[1]}"
+            fakes.FakeMinio.put(name, path)
+            worker.db.add_video(name)
+
+            needed = [x for x in TASKS if x in args.tasks or any(DEPENDS.get(y) == x for y in args.tasks)]
+            runs: dict[str, list[dict]] = {x: [] for x in needed}
+
+            for _ in range(args.repeat):
+                worker.db.reset(name)
+
+                timestamps = []
+                for task in needed:
+                    task_args = [pan_frames(timestamps, duration)] if task == "stitch" else []
+
+                    run = run_task(worker, task, name, task_args)
+                    runs[task].append(run)
+
+                    if task == "keyframes" and "result" in run:
+                        timestamps = run["result"]["timestamps"]
+
+                    print(f"{os.path.basename(path)} {task}: {run['seconds']:.2f}s {run['status']}", file=sys.stderr)
+
+            for task in args.tasks:
+                results.append({
+                    "video": os.path.basename(path),
+                    "duration": duration,
+                    "task": task,
+                    **summarise(task, runs[task], duration),
+                })
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        **git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "repeat": args.repeat,
+            "width": args.width,
+            "height": args.height,
+            "whisper_model": worker.settings.WHISPER_MODEL,
+            "yolo_weights": worker.settings.YOLO_WEIGHTS,
+            "keyframe_sampling": worker.settings.KEYFRAME_SAMPLING,
+        },
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Import time and resident memory of the webserver and worker entrypoints, each in a fresh interpreter,
+against the local stand-ins of fakes.py. Also lists which heavy libraries each of them loaded, e.g.
+
+    python -m benchmarks.startup --repeat 5 --output startup-$(git rev-parse --short HEAD).json
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+from benchmarks.pipeline import git_commit
+
+
+ENTRYPOINTS = {
+    "webserver": "veridash_backend.webserver.app",
+    "worker": "veridash_backend.worker.app",
+}
+
+HEAVY = ["torch", "torchvision", "whisper", "ultralytics", "cv2", "numpy", "openai"]
+
+CHILD = """
+import os, sys, json, importlib
+from time import perf_counter
+
+from benchmarks import fakes
+fakes.configure({work_dir!r})
+
+start = perf_counter()
+importlib.import_module({module!r})
+elapsed = perf_counter() - start
+
+with open("/proc/self/statm") as f:
+    rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss / 2**20, "loaded": [x for x in {heavy!r} if x in sys.modules]}}))
+"""
+
+
+def measure(module: str, work_dir: str) -> dict:
+    code = CHILD.format(work_dir=work_dir, module=module, heavy=HEAVY)
+    # from the backend directory, like the entrypoints
+    res = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if res.returncode != 0:
+        return {"error": res.stderr.strip().splitlines()[-1] if res.stderr.strip() else f"exit {res.returncode}"}
+
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per entrypoint")
+    parser.add_argument("--entrypoints", nargs="+", choices=list(ENTRYPOINTS), default=list(ENTRYPOINTS))
+    parser.add_argument("--output", help="json file, stdout if not given")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="veridash-startup-") as work_dir:
+        for name in args.entrypoints:
+            runs = [measure(ENTRYPOINTS[name], work_dir) for _ in range(args.repeat)]
+            ok = [x for x in runs if "error" not in x]
+
+            out = {"entrypoint": name, "module": ENTRYPOINTS[name], "runs": len(runs)}
+            if len(ok) == 0:
+                out["error"] = runs[-1]["error"]
+            else:
+                out.update({
+                    "median_seconds": statistics.median(x["seconds"] for x in ok),
+                    "median_rss_mb": statistics.median(x["rss_mb"] for x in ok),
+                    "loaded": ok[-1]["loaded"],
+                })
+
+            print(f"{name}: {out.get('median_seconds', float('nan')):.2f}s, "
+                  f"{out.get('median_rss_mb', float('nan')):.0f} MB", file=sys.stderr)
+            results.append(out)
+
+    report = {
+        **git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
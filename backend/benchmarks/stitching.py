@@ -0,0 +1,97 @@
+"""
+Time stitching of overlapping 720p frames, as cut from a pan, at the registration resolutions to compare.
+The pan is a synthetic scene by default, pass --image for real footage (e.g. a still wider than it is high).
+
+    python benchmarks/stitching.py --resolutions 0.6 0.3 > stitching.json
+"""
+import sys
+import json
+import argparse
+import statistics
+import numpy as np
+import cv2
+from time import perf_counter
+
+sys.path.insert(0, ".")
+
+from veridash_backend.commons.settings import Settings
+
+
+def synthetic_scene(width: int, height: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Textured background with shapes scattered over it, so registration finds features everywhere
+    """
+    noise = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    scene = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+
+    for _ in range(width * height // 20_000):
+        color = tuple(int(x) for x in rng.integers(0, 256, 3))
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        r = int(rng.integers(5, 60))
+        if rng.random() < 0.5:
+            cv2.circle(scene, (x, y), r, color, -1)
+        else:
+            cv2.rectangle(scene, (x, y), (x + r, y + r // 2), color, -1)
+
+    return scene
+
+
+def pan(scene: np.ndarray, count: int, width: int) -> list[np.ndarray]:
+    """
+    :return: count frames of the given width, evenly spread from the left to the right of the scene
+    """
+    step = (scene.shape[1] - width) // (count - 1)
+    return [scene[:, i * step:i * step + width].copy() for i in range(count)]
+
+
+def stitch(frames: list[np.ndarray], registration: float, seam: float, compose: float) -> tuple[float, int, tuple]:
+    """
+    :return: Seconds taken, status, and shape of the panorama
+    """
+    stitcher = cv2.Stitcher_create()
+    stitcher.setRegistrationResol(registration)
+    stitcher.setSeamEstimationResol(seam)
+    stitcher.setCompositingResol(compose)
+
+    start = perf_counter()
+    status, res = stitcher.stitch(frames)
+    elapsed = perf_counter() - start
+
+    return elapsed, status, res.shape if status == 0 else ()
+
+
+def main():
+    settings = Settings()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="Wide image to pan over, instead of a synthetic scene")
+    parser.add_argument("--frames", type=int, default=4, help="Frames stitched, as source keyframes")
+    parser.add_argument("--resolutions", type=float, nargs="+", default=[0.6, settings.STITCH_REGISTRATION_MPX],
+                        help="Registration megapixels to compare, 0.6 being OpenCV's default")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.image:
+        scene = cv2.imread(args.image)
+        scene = cv2.resize(scene, (scene.shape[1] * 720 // scene.shape[0], 720), interpolation=cv2.INTER_AREA)
+    else:
+        scene = synthetic_scene(3 * 1280, 720, np.random.default_rng(0))
+    frames = pan(scene, args.frames, 1280)
+
+    results = []
+    for mpx in args.resolutions:
+        runs = [stitch(frames, mpx, settings.STITCH_SEAM_MPX, settings.STITCH_COMPOSE_MPX) for _ in range(args.repeat)]
+        results.append({
+            "registrationMpx": mpx,
+            "seamMpx": settings.STITCH_SEAM_MPX,
+            "composeMpx": settings.STITCH_COMPOSE_MPX,
+            "medianSeconds": statistics.median(x[0] for x in runs),
+            "statuses": sorted({x[1] for x in runs}),
+            "panorama": list(runs[0][2]),
+        })
+
+    print(json.dumps({"frames": args.frames, "frameSize": [720, 1280], "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Query latency and recall of the pgvector hnsw index used for image embeddings, on synthetic data.
+Measured both unfiltered, and as find_similar_images queries: among the images of one owner, owners having
+Zipf-distributed numbers of images, falling back to an exact search when the index leaves too few.
+Needs a scratch postgres database with pgvector >= 0.7, e.g.
+
+    python benchmarks/vector_index.py --conn "dbname=bench user=postgres" --count 1000000 > vector_index.json
+"""
+import json
+import argparse
+import numpy as np
+import psycopg
+from time import perf_counter
+
+
+TABLE = "bench_vectors"
+
+
+def make_vectors(count: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Clustered unit vectors, closer to real embeddings than uniform noise (which no ann index does well on)
+    """
+    centroids = rng.standard_normal((clusters, dim)).astype(np.float32)
+
+    out = np.empty((count, dim), dtype=np.float16)
+    for i in range(0, count, 100_000):
+        n = min(100_000, count - i)
+        x = centroids[rng.integers(0, clusters, n)] + rng.standard_normal((n, dim)).astype(np.float32) * 0.5
+        out[i:i+n] = x / np.linalg.norm(x, axis=1, keepdims=True)
+
+    return out
+
+
+def make_owners(count: int, owners: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    :return: Owner of every vector, a few owners having most of them, as with real users
+    """
+    p = 1 / np.arange(1, owners + 1)
+    return rng.choice(owners, size=count, p=p / p.sum()).astype(np.int32)
+
+
+def copy_vectors(conn: psycopg.Connection, vectors: np.ndarray, owner_of: np.ndarray):
+    """
+    Bulk load through binary COPY, rows being (id, owner, halfvec)
+    """
+    dim = vectors.shape[1]
+    row = np.dtype([
+        ("fields", ">i2"), ("id_len", ">i4"), ("id", ">i4"), ("owner_len", ">i4"), ("owner", ">i4"),
+        ("vec_len", ">i4"), ("dim", ">i2"), ("unused", ">i2"), ("vec", ">f2", (dim, )),
+    ])
+
+    with conn.cursor().copy(f"COPY {TABLE} (id, owner, embedding) FROM STDIN WITH (FORMAT BINARY)") as copy:
+        copy.write(b"PGCOPY\n\xff\r\n\x00" + bytes(8))
+
+        for i in range(0, len(vectors), 50_000):
+            chunk = vectors[i:i+50_000]
+
+            rows = np.zeros(len(chunk), dtype=row)
+            rows["fields"] = 3
+            rows["id_len"] = 4
+            rows["id"] = np.arange(i, i + len(chunk))
+            rows["owner_len"] = 4
+            rows["owner"] = owner_of[i:i+50_000]
+            rows["vec_len"] = 4 + 2 * dim
+            rows["dim"] = dim
+            rows["vec"] = chunk
+
+            copy.write(rows.tobytes())
+
+        copy.write((-1).to_bytes(2, "big", signed=True))
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """
+    :return: Ids of the k nearest vectors by cosine distance, per query
+    """
+    q = queries.astype(np.float32).T
+
+    best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+    best_sims = np.zeros((len(queries), 0), dtype=np.float32)
+    for i in range(0, len(vectors), 100_000):
+        sims = (vectors[i:i+100_000].astype(np.float32) @ q).T
+
+        ids = np.concatenate([best_ids, np.broadcast_to(np.arange(i, i + sims.shape[1]), sims.shape)], axis=1)
+        sims = np.concatenate([best_sims, sims], axis=1)
+
+        top = np.argsort(-sims, axis=1)[:, :k]
+        best_ids = np.take_along_axis(ids, top, axis=1)
+        best_sims = np.take_along_axis(sims, top, axis=1)
+
+    return best_ids
+
+
+def literal(v: np.ndarray) -> str:
+    return "[" + ",".join(f"{float(x):.5g}" for x in v) + "]"
+
+
+def percentiles(latencies: list[float]) -> dict:
+    ms = np.array(latencies) * 1000
+    return {
+        "p50Ms": float(np.percentile(ms, 50)),
+        "p95Ms": float(np.percentile(ms, 95)),
+        "p99Ms": float(np.percentile(ms, 99)),
+    }
+
+
+def filtered_query(conn: psycopg.Connection, q: np.ndarray, owner: int, k: int) -> tuple[list[int], bool]:
+    """
+    As AsyncDatabase.find_similar_images
+    :return: Ids found, and whether the exact fallback ran
+    """
+    res = conn.execute(f"SELECT id FROM {TABLE} WHERE owner = %s ORDER BY embedding <=> %s::halfvec LIMIT %s;",
+                       (owner, literal(q), k), prepare=True).fetchall()
+    if len(res) >= k:
+        return [x[0] for x in res], False
+
+    res = conn.execute(f"""
+        WITH owned AS MATERIALIZED (SELECT id, embedding FROM {TABLE} WHERE owner = %s)
+        SELECT id FROM owned ORDER BY embedding <=> %s::halfvec LIMIT %s;
+    """, (owner, literal(q), k), prepare=True).fetchall()
+    return [x[0] for x in res], True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conn", required=True, help="postgres connection string of a scratch database")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--owners", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200])
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=64)
+    parser.add_argument("--keep", action="store_true", help="keep the table for later runs")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = make_vectors(args.count, args.dim, args.clusters, rng)
+
+    # queries resemble, but are not, stored vectors
+    queries = vectors[rng.integers(0, args.count, args.queries)].astype(np.float32)
+    queries += rng.standard_normal(queries.shape).astype(np.float32) * 0.05
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    truth = exact_neighbours(vectors, queries, args.k)
+
+    # filtered queries go to owners uniformly, so mostly to owners with few images, near one of their images
+    owner_of = make_owners(args.count, args.owners, rng)
+    query_owners = rng.choice(np.unique(owner_of), args.queries)
+    owned = {int(o): np.flatnonzero(owner_of == o) for o in query_owners}
+    owner_queries = np.stack([vectors[rng.choice(owned[int(o)])] for o in query_owners]).astype(np.float32)
+    owner_queries += rng.standard_normal(owner_queries.shape).astype(np.float32) * 0.05
+    owner_queries /= np.linalg.norm(owner_queries, axis=1, keepdims=True)
+    owner_truth = [owned[int(o)][exact_neighbours(vectors[owned[int(o)]], q[None], args.k)[0]]
+                   for o, q in zip(query_owners, owner_queries)]
+
+    report = {"count": args.count, "dim": args.dim, "k": args.k, "m": args.m, "efConstruction": args.ef_construction,
+              "owners": args.owners}
+
+    with psycopg.connect(args.conn, autocommit=True) as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        conn.execute(f"DROP TABLE IF EXISTS {TABLE};")
+        conn.execute(f"""
+            CREATE TABLE {TABLE} (id integer not null, owner integer not null, embedding halfvec({args.dim}) not null);
+        """)
+
+        start = perf_counter()
+        copy_vectors(conn, vectors, owner_of)
+        report["loadSeconds"] = perf_counter() - start
+        conn.execute(f"CREATE INDEX ON {TABLE} (owner);")
+
+        conn.execute("SET maintenance_work_mem = '4GB';")
+        start = perf_counter()
+        conn.execute(f"""
+            CREATE INDEX ON {TABLE} USING hnsw (embedding halfvec_cosine_ops)
+            WITH (m = {args.m}, ef_construction = {args.ef_construction});
+        """)
+        report["indexSeconds"] = perf_counter() - start
+        report["tableBytes"] = conn.execute(f"SELECT pg_table_size('{TABLE}');").fetchone()[0]
+        report["indexBytes"] = conn.execute(f"SELECT pg_indexes_size('{TABLE}');").fetchone()[0]
+
+        report["runs"] = []
+        for ef in args.ef_search:
+            conn.execute(f"SET hnsw.ef_search = {ef};")
+
+            latencies = []
+            hits = 0
+            for q, expected in zip(queries, truth):
+                start = perf_counter()
+                res = conn.execute(f"SELECT id FROM {TABLE} ORDER BY embedding <=> %s::halfvec LIMIT %s;",
+                                   (literal(q), args.k), prepare=True).fetchall()
+                latencies.append(perf_counter() - start)
+
+                hits += len({x[0] for x in res} & set(expected.tolist()))
+
+            # owners might have fewer than k images
+            filtered_latencies = []
+            filtered_hits, filtered_expected, fallbacks = 0, 0, 0
+            for owner, q, expected in zip(query_owners, owner_queries, owner_truth):
+                start = perf_counter()
+                ids, fallback = filtered_query(conn, q, int(owner), args.k)
+                filtered_latencies.append(perf_counter() - start)
+
+                filtered_hits += len(set(ids) & set(expected.tolist()))
+                filtered_expected += len(expected)
+                fallbacks += fallback
+
+            report["runs"].append({
+                "efSearch": ef,
+                "recall": hits / (len(queries) * args.k),
+                **percentiles(latencies),
+                "filtered": {
+                    "recall": filtered_hits / filtered_expected,
+                    "exactFallbackRate": fallbacks / len(query_owners),
+                    **percentiles(filtered_latencies),
+                },
+            })
+
+        if not args.keep:
+            conn.execute(f"DROP TABLE {TABLE};")
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
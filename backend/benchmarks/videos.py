@@ -0,0 +1,31 @@
+import ffmpeg
+
+
+def synthetic_video(path: str, duration: float, width: int = 1280, height: int = 720, fps: int = 30):
+    """
+    Four scenes of test patterns, one of them panning across a wider pattern, with a tone as audio.
+    Gives scene detection, hashing, detection and stitching something to work on, without shipping footage.
+    :param path: Output mp4 path
+    :param duration: Length in seconds
+    """
+    scene = duration / 4
+    size = f"{width}x{height}"
+
+    pan = (ffmpeg.input(f"testsrc2=size={3 * width}x{height}:rate={fps}:duration={scene}", f="lavfi")
+        .filter("crop", width, height, f"t*{2 * width / scene}", 0))
+
+    scenes = [
+        ffmpeg.input(f"testsrc2=size={size}:rate={fps}:duration={scene}", f="lavfi"),
+        pan,
+        ffmpeg.input(f"smptehdbars=size={size}:rate={fps}:duration={scene}", f="lavfi"),
+        ffmpeg.input(f"mandelbrot=size={size}:rate={fps}", f="lavfi").trim(duration=scene),
+    ]
+    scenes = [x.filter("setsar", 1).filter("format", "yuv420p").setpts("PTS-STARTPTS") for x in scenes]
+
+    audio = ffmpeg.input(f"sine=frequency=440:duration={duration}", f="lavfi")
+
+    (ffmpeg
+        .output(ffmpeg.concat(*scenes, v=1, a=0), audio, path, vcodec="libx264", preset="veryfast", acodec="aac",
+                r=fps)
+        .overwrite_output()
+        .run(quiet=True))
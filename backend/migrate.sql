@@ -0,0 +1,125 @@
+-- (Migration for postgresql, with pgvector >= 0.7)
+-- Brings a database created from an earlier schema.sql up to date, and is safe to run again.
+-- New databases only need schema.sql.
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- videos
+
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS blob_name text;
+-- uploads used to be stored under their own object name
+UPDATE videos SET blob_name = object_name WHERE blob_name IS NULL;
+ALTER TABLE videos ALTER COLUMN blob_name SET NOT NULL;
+
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS hash_verified boolean not null default false;
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS fingerprinted boolean not null default false;
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS near_duplicate_of integer default null;
+ALTER TABLE videos ADD COLUMN IF NOT EXISTS duration_seconds double precision default null;
+
+DO $$ BEGIN
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_near_duplicate' AND conrelid = 'videos'::regclass) THEN
+		ALTER TABLE videos ADD CONSTRAINT fk_near_duplicate FOREIGN KEY(near_duplicate_of) REFERENCES videos(id);
+	END IF;
+END $$;
+
+-- keyframes
+
+CREATE TABLE IF NOT EXISTS keyframe_runs (
+	id serial primary key,
+	video_id integer not null,
+	created_at timestamp with time zone default now(),
+
+	CONSTRAINT fk_video
+	FOREIGN KEY(video_id)
+	REFERENCES videos(id)
+);
+
+ALTER TABLE images ADD COLUMN IF NOT EXISTS run_id integer;
+ALTER TABLE images ADD COLUMN IF NOT EXISTS timestamp_seconds real;
+ALTER TABLE images ADD COLUMN IF NOT EXISTS embedding halfvec(512);
+
+-- the keyframes a video already has become one run
+WITH runs AS (
+	INSERT INTO keyframe_runs (video_id)
+	SELECT DISTINCT video_id FROM images WHERE run_id IS NULL
+	RETURNING id, video_id
+)
+UPDATE images i SET run_id = r.id FROM runs r WHERE i.video_id = r.video_id AND i.run_id IS NULL;
+ALTER TABLE images ALTER COLUMN run_id SET NOT NULL;
+
+DO $$ BEGIN
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_run' AND conrelid = 'images'::regclass) THEN
+		ALTER TABLE images ADD CONSTRAINT fk_run FOREIGN KEY(run_id) REFERENCES keyframe_runs(id);
+	END IF;
+END $$;
+
+ALTER TABLE job_results ADD COLUMN IF NOT EXISTS job_key text default null;
+
+-- object detection
+
+CREATE TABLE IF NOT EXISTS detection_runs (
+	id serial primary key,
+	keyframe_run_id integer not null,
+	created_at timestamp with time zone default now(),
+
+	CONSTRAINT fk_keyframe_run
+	FOREIGN KEY(keyframe_run_id)
+	REFERENCES keyframe_runs(id)
+);
+
+ALTER TABLE detected_objects ADD COLUMN IF NOT EXISTS run_id integer;
+ALTER TABLE detected_objects ADD COLUMN IF NOT EXISTS source_frame integer;
+ALTER TABLE detected_objects ADD COLUMN IF NOT EXISTS class_id integer;
+ALTER TABLE detected_objects ADD COLUMN IF NOT EXISTS class_name text;
+ALTER TABLE detected_objects ADD COLUMN IF NOT EXISTS confidence real;
+ALTER TABLE detected_objects ADD COLUMN IF NOT EXISTS box real[];
+ALTER TABLE detected_objects ADD COLUMN IF NOT EXISTS embedding halfvec(512);
+
+-- earlier detections have no source frame, class or embedding, objects are detected again when next requested
+DELETE FROM detected_objects WHERE run_id IS NULL;
+ALTER TABLE detected_objects ALTER COLUMN run_id SET NOT NULL;
+
+DO $$ BEGIN
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_run' AND conrelid = 'detected_objects'::regclass) THEN
+		ALTER TABLE detected_objects ADD CONSTRAINT fk_run FOREIGN KEY(run_id) REFERENCES detection_runs(id);
+	END IF;
+END $$;
+
+-- new tables
+
+CREATE TABLE IF NOT EXISTS video_fingerprints (
+	video_id integer not null,
+	phash bigint not null,
+	band_key integer not null,
+
+	CONSTRAINT fk_video
+	FOREIGN KEY(video_id)
+	REFERENCES videos(id)
+);
+
+CREATE TABLE IF NOT EXISTS translations (
+	source_hash text not null,
+	source_language text not null,
+	translation text not null,
+	created_at timestamp with time zone default now(),
+
+	PRIMARY KEY (source_hash, source_language)
+);
+
+-- indexes, as in schema.sql
+
+CREATE INDEX IF NOT EXISTS videos_hash_sha256_idx ON videos (hash_sha256);
+CREATE INDEX IF NOT EXISTS videos_owner_id_idx ON videos (owner_id);
+CREATE INDEX IF NOT EXISTS images_video_id_idx ON images (video_id);
+CREATE INDEX IF NOT EXISTS detected_objects_video_id_idx ON detected_objects (video_id);
+CREATE INDEX IF NOT EXISTS keyframe_runs_video_id_idx ON keyframe_runs (video_id);
+CREATE INDEX IF NOT EXISTS images_run_id_idx ON images (run_id);
+CREATE INDEX IF NOT EXISTS detection_runs_keyframe_run_id_idx ON detection_runs (keyframe_run_id);
+CREATE INDEX IF NOT EXISTS detected_objects_run_id_idx ON detected_objects (run_id);
+CREATE INDEX IF NOT EXISTS videos_near_duplicate_of_idx ON videos (near_duplicate_of);
+CREATE INDEX IF NOT EXISTS video_fingerprints_band_key_idx ON video_fingerprints (band_key) INCLUDE (video_id, phash);
+CREATE INDEX IF NOT EXISTS images_embedding_idx ON images USING hnsw (embedding halfvec_cosine_ops);
+CREATE INDEX IF NOT EXISTS detected_objects_embedding_idx ON detected_objects USING hnsw (embedding halfvec_cosine_ops);
+
+COMMIT;
@@ -1,4 +1,7 @@
--- (Schema for postgresql)
+-- (Schema for postgresql, with pgvector >= 0.7)
+-- changes to existing tables also need an idempotent step in migrate.sql
+CREATE EXTENSION IF NOT EXISTS vector;
+
 CREATE TABLE IF NOT EXISTS users (
 	id serial primary key,
 	email text not null,
@@ -12,26 +15,60 @@ CREATE TABLE IF NOT EXISTS videos (
 	owner_id integer not null,
 	filename text not null,
 	object_name text unique not null,
+	-- object in storage holding the bytes, shared between byte-identical uploads
+	blob_name text not null,
 	hash_sha256 text,
+	-- whether hash_sha256 was computed server-side, rather than provided by the client
+	hash_verified boolean not null default false,
+	-- perceptual fingerprint stored in video_fingerprints
+	fingerprinted boolean not null default false,
+	-- earlier upload of the same footage, e.g. before a social platform re-encoded it
+	near_duplicate_of integer default null,
+	-- from the probe, near-duplicates must last about as long
+	duration_seconds double precision default null,
 	created_at timestamp with time zone default now(),
 
 	CONSTRAINT fk_user
 	FOREIGN KEY(owner_id)
-	REFERENCES users(id)
+	REFERENCES users(id),
+
+	CONSTRAINT fk_near_duplicate
+	FOREIGN KEY(near_duplicate_of)
+	REFERENCES videos(id)
+);
+
+-- every keyframe extraction of a video, replacing the keyframes of earlier ones
+CREATE TABLE IF NOT EXISTS keyframe_runs (
+	id serial primary key,
+	video_id integer not null,
+	created_at timestamp with time zone default now(),
+
+	CONSTRAINT fk_video
+	FOREIGN KEY(video_id)
+	REFERENCES videos(id)
 );
 
 CREATE TABLE IF NOT EXISTS images (
 	id serial primary key,
 	video_id integer not null,
+	run_id integer not null,
 	object_name text unique not null,
 	-- 1-based, thus inclusive of total_frames
 	frame_number integer not null,
 	total_frames integer not null,
+	-- position in the video, keyframes are not necessarily evenly spaced
+	timestamp_seconds real,
+	-- L2-normalised image embedding, compared by cosine distance
+	embedding halfvec(512),
 	created_at timestamp with time zone default now(),
 
 	CONSTRAINT fk_video
 	FOREIGN KEY(video_id)
-	REFERENCES videos(id)
+	REFERENCES videos(id),
+
+	CONSTRAINT fk_run
+	FOREIGN KEY(run_id)
+	REFERENCES keyframe_runs(id)
 );
 
 CREATE TABLE IF NOT EXISTS job_results (
@@ -40,6 +77,8 @@ CREATE TABLE IF NOT EXISTS job_results (
 	-- most jobs consider themselves with the whole video
 	image_id integer default null,
 	job_type text not null,
+	-- parameters the job ran with, for jobs depending on more than the video (e.g. stitched frames)
+	job_key text default null,
 	-- job_result is schemaless and structure will vary by job_type
 	job_result jsonb not null,
 	created_at timestamp with time zone default now(),
@@ -53,16 +92,78 @@ CREATE TABLE IF NOT EXISTS job_results (
 	REFERENCES images(id)
 );
 
+-- every object detection over a keyframe run, also the ones finding nothing
+CREATE TABLE IF NOT EXISTS detection_runs (
+	id serial primary key,
+	-- source frames of the detections are numbers of these keyframes
+	keyframe_run_id integer not null,
+	created_at timestamp with time zone default now(),
+
+	CONSTRAINT fk_keyframe_run
+	FOREIGN KEY(keyframe_run_id)
+	REFERENCES keyframe_runs(id)
+);
+
 CREATE TABLE IF NOT EXISTS detected_objects (
 	id serial primary key,
 	video_id integer not null,
+	run_id integer not null,
 	object_name text unique not null,
 	-- 1-based, thus inclusive of total_frames
 	frame_number integer not null,
 	total_frames integer not null,
+	-- 1-based keyframe number the object was cropped from
+	source_frame integer,
+	class_id integer,
+	class_name text,
+	confidence real,
+	-- x1, y1, x2, y2 in source frame pixels
+	box real[],
+	-- L2-normalised embedding of the crop, compared by cosine distance
+	embedding halfvec(512),
 	created_at timestamp with time zone default now(),
 
+	CONSTRAINT fk_video
+	FOREIGN KEY(video_id)
+	REFERENCES videos(id),
+
+	CONSTRAINT fk_run
+	FOREIGN KEY(run_id)
+	REFERENCES detection_runs(id)
+);
+
+CREATE TABLE IF NOT EXISTS video_fingerprints (
+	video_id integer not null,
+	-- 64-bit perceptual hash of a keyframe, as a signed integer
+	phash bigint not null,
+	-- (band number << 16) | band bits, see commons/fingerprint.py
+	band_key integer not null,
+
 	CONSTRAINT fk_video
 	FOREIGN KEY(video_id)
 	REFERENCES videos(id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS translations (
+	-- sha256 of the source text
+	source_hash text not null,
+	-- of the source text, translations are always to english
+	source_language text not null,
+	translation text not null,
+	created_at timestamp with time zone default now(),
+
+	PRIMARY KEY (source_hash, source_language)
+);
+
+CREATE INDEX IF NOT EXISTS videos_hash_sha256_idx ON videos (hash_sha256);
+CREATE INDEX IF NOT EXISTS videos_owner_id_idx ON videos (owner_id);
+CREATE INDEX IF NOT EXISTS images_video_id_idx ON images (video_id);
+CREATE INDEX IF NOT EXISTS detected_objects_video_id_idx ON detected_objects (video_id);
+CREATE INDEX IF NOT EXISTS keyframe_runs_video_id_idx ON keyframe_runs (video_id);
+CREATE INDEX IF NOT EXISTS images_run_id_idx ON images (run_id);
+CREATE INDEX IF NOT EXISTS detection_runs_keyframe_run_id_idx ON detection_runs (keyframe_run_id);
+CREATE INDEX IF NOT EXISTS detected_objects_run_id_idx ON detected_objects (run_id);
+CREATE INDEX IF NOT EXISTS videos_near_duplicate_of_idx ON videos (near_duplicate_of);
+CREATE INDEX IF NOT EXISTS video_fingerprints_band_key_idx ON video_fingerprints (band_key) INCLUDE (video_id, phash);
+CREATE INDEX IF NOT EXISTS images_embedding_idx ON images USING hnsw (embedding halfvec_cosine_ops);
+CREATE INDEX IF NOT EXISTS detected_objects_embedding_idx ON detected_objects USING hnsw (embedding halfvec_cosine_ops);
@@ -0,0 +1,106 @@
+import os
+from time import time
+from veridash_backend.commons.cache import LocalCache, ExpiringCache
+
+
+def write(size: int):
+    def fill(path: str):
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+    return fill
+
+
+def age(cache: LocalCache, key: str, seconds: float):
+    t = time() - seconds
+    os.utime(cache.path(key), (t, t))
+
+
+def test_fills_on_miss_only(tmp_path):
+    cache = LocalCache(str(tmp_path), 0)
+    fills = []
+
+    def fill(path: str):
+        fills.append(path)
+        write(10)(path)
+
+    with cache.get("a", fill) as p:
+        assert os.path.getsize(p) == 10
+    with cache.get("a", fill) as p:
+        assert p == cache.path("a")
+
+    assert len(fills) == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    # the temporary name is gone once filled
+    assert os.listdir(cache.tmp_dir) == []
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = LocalCache(str(tmp_path), 250)
+
+    for key in ("a", "b"):
+        with cache.get(key, write(100)):
+            pass
+    age(cache, "a", 20)
+    age(cache, "b", 10)
+
+    # a is used again, so b is the least recently used
+    with cache.get("a", write(100)):
+        pass
+    with cache.get("c", write(100)):
+        pass
+
+    assert sorted(x for x in os.listdir(tmp_path) if x != ".tmp") == ["a", "c"]
+    assert cache.stats()["evictions"] == 1 and cache.stats()["evicted_bytes"] == 100
+
+
+def test_never_evicts_pinned_entries(tmp_path):
+    cache = LocalCache(str(tmp_path), 150)
+
+    with cache.get("a", write(100)) as p:
+        age(cache, "a", 60)
+
+        # a is the oldest, but in use, so the cache stays over budget instead
+        with cache.get("b", write(100)):
+            pass
+
+        assert os.path.exists(p)
+        assert os.path.exists(cache.path("b"))
+
+    # the entry just filled is never the one evicted
+    with cache.get("c", write(100)):
+        pass
+
+    assert sorted(x for x in os.listdir(tmp_path) if x != ".tmp") == ["c"]
+
+
+def test_sizes_directories(tmp_path):
+    cache = LocalCache(str(tmp_path), 150)
+
+    def fill_dir(path: str):
+        os.makedirs(path)
+        for i in range(2):
+            write(50)(os.path.join(path, str(i)))
+
+    with cache.get("frames", fill_dir) as p:
+        assert sorted(os.listdir(p)) == ["0", "1"]
+    age(cache, "frames", 10)
+
+    with cache.get("audio", write(100)):
+        pass
+
+    assert not os.path.exists(cache.path("frames"))
+
+
+def test_expiring_cache_bounds_entries():
+    cache = ExpiringCache(max_entries=2)
+
+    cache.put("a", 1, 60)
+    cache.put("b", 2, 60)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    cache.put("d", 4, -1)
+    assert cache.get("d") is None
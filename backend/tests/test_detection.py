@@ -0,0 +1,52 @@
+import os
+import pytest
+import threading
+from time import monotonic
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+from veridash_backend.worker.detection import read_frames
+
+
+@pytest.fixture
+def frames(tmp_path) -> list[str]:
+    names = []
+    for i in range(20):
+        name = os.path.join(tmp_path, f"{i:04d}.jpg")
+        cv2.imwrite(name, np.full((8, 8, 3), i, np.uint8))
+        names.append(name)
+
+    return names
+
+
+def decoders() -> int:
+    return sum(1 for t in threading.enumerate() if t.name == "read-frames")
+
+
+def test_reads_every_frame_in_order(frames):
+    assert [i for i, _ in read_frames(frames + ["missing.jpg"], max_pending=2)] == list(range(20))
+
+
+def test_stops_decoding_when_closed_early(frames):
+    before = decoders()
+
+    it = read_frames(frames, max_pending=2)
+    next(it)
+    # the decoder is blocked on the full queue by now
+    deadline = monotonic() + 5
+    while decoders() == before and monotonic() < deadline:
+        pass
+    it.close()
+
+    assert decoders() == before
+
+
+def test_stops_decoding_when_the_consumer_raises(frames):
+    before = decoders()
+
+    with pytest.raises(RuntimeError):
+        for _ in read_frames(frames, max_pending=2):
+            raise RuntimeError("lease lost")
+
+    assert decoders() == before
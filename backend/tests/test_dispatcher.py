@@ -0,0 +1,71 @@
+import json
+import asyncio
+import pytest
+
+pytest.importorskip("celery")
+
+from veridash_backend.webserver.dispatcher import JobDispatcher
+
+
+class FakePubSub:
+    """
+    Replays the messages of one connection, raising where a message is an exception
+    """
+    def __init__(self, messages: list):
+        self.messages = messages
+        self.closed = False
+
+    async def subscribe(self, channel: str):
+        pass
+
+    async def listen(self):
+        for m in self.messages:
+            if isinstance(m, BaseException):
+                raise m
+            yield {"type": "message", "data": m}
+        # stay subscribed, as a live connection would
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeRedis:
+    def __init__(self, connections: list[list]):
+        self.pubsubs = [FakePubSub(x) for x in connections]
+        self.opened = 0
+
+    def pubsub(self, **kwargs) -> FakePubSub:
+        self.opened += 1
+        return self.pubsubs[self.opened - 1]
+
+
+def update(task_id: str, state: str) -> str:
+    return json.dumps({"taskId": task_id, "state": state, "data": {"progress": state}})
+
+
+def test_listener_survives_bad_updates_and_failures(monkeypatch):
+    # nothing finished while reconnecting
+    monkeypatch.setattr("veridash_backend.webserver.dispatcher.AsyncResult",
+                        lambda task_id, app: type("Pending", (), {"ready": lambda self: False})())
+
+    async def run():
+        dispatcher = JobDispatcher()
+        dispatcher.redis_client = FakeRedis([
+            ["not json", json.dumps({"state": "PROGRESS"}), update("a", "STARTED"), RuntimeError("boom")],
+            [update("a", "PROGRESS")],
+        ])
+        queue = asyncio.Queue()
+        dispatcher._subscribers["a"] = {queue}
+
+        listener = asyncio.create_task(dispatcher._listen())
+        received = [await asyncio.wait_for(queue.get(), 5) for _ in range(2)]
+        listener.cancel()
+
+        return dispatcher, received
+
+    dispatcher, received = asyncio.run(run())
+
+    assert [x[1] for x in received] == ["STARTED", "PROGRESS"]
+    assert dispatcher.redis_client.opened == 2
+    assert dispatcher.redis_client.pubsubs[0].closed
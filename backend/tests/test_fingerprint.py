@@ -0,0 +1,112 @@
+import random
+from veridash_backend.commons.fingerprint import BANDS, MAX_DISTANCE, band_keys, select_frames, informative, \
+    to_signed, to_unsigned, match_count, best_match
+from veridash_backend.commons.db import Database
+
+
+def flip(phash: int, bits: list[int]) -> int:
+    for b in bits:
+        phash ^= 1 << b
+    return phash
+
+
+def test_close_hashes_share_a_band():
+    rng = random.Random(0)
+    for _ in range(2000):
+        a = rng.getrandbits(64)
+        b = flip(a, rng.sample(range(64), rng.randint(0, MAX_DISTANCE)))
+
+        assert set(band_keys(a)) & set(band_keys(b))
+
+
+def test_band_keys_differ_by_band():
+    # the same 16 bits in different positions are different keys
+    keys = band_keys(0x0001_0001_0001_0001)
+
+    assert len(keys) == BANDS
+    assert len(set(keys)) == BANDS
+
+
+def test_uniform_frames_are_left_out():
+    assert not informative(0)
+    assert not informative(1)
+    assert not informative((1 << 64) - 1)
+    assert informative(0x00FF_00FF_00FF_00FF)
+
+    assert select_frames([0, 0x00FF_00FF_00FF_00FF, 1], 64) == [0x00FF_00FF_00FF_00FF]
+
+
+def test_selected_frames_are_spread_evenly():
+    hashes = [0x00FF_00FF_00FF_0000 | i for i in range(100)]
+
+    selected = select_frames(hashes, 4)
+
+    assert selected == [hashes[0], hashes[25], hashes[50], hashes[75]]
+
+
+def test_signed_round_trip():
+    for x in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        assert -(1 << 63) <= to_signed(x) < 1 << 63
+        assert to_unsigned(to_signed(x)) == x
+
+
+def test_match_count():
+    a, b = 0x00FF_00FF_00FF_00FF, 0x0F0F_0F0F_0F0F_0F0F
+    candidate = {flip(a, [0, 1, 2])}
+
+    assert match_count([a, b], candidate, 3) == 1
+    assert match_count([a, b], candidate, 2) == 0
+
+
+def test_best_match_needs_enough_frames():
+    rng = random.Random(1)
+    query = [rng.getrandbits(64) for _ in range(10)]
+    candidates = {
+        1: {flip(x, [5]) for x in query[:4]},
+        2: {flip(x, [7, 9]) for x in query[:7]},
+        3: {rng.getrandbits(64) for _ in range(10)},
+    }
+
+    assert best_match(query, candidates, 3, 0.6, 5) == 2
+    # 7 of 10 frames
+    assert best_match(query, candidates, 3, 0.8, 5) is None
+    assert best_match(query, candidates, 3, 0.6, 8) is None
+    assert best_match(query, {}, 3, 0.6, 5) is None
+
+
+class FakeConnection:
+    """
+    Answers the candidate query of Database._find_near_duplicate with rows of (video id, signed phash, root id)
+    """
+    def __init__(self, rows: list[tuple[int, int, int]]):
+        self.rows = rows
+        self.params = None
+
+    def execute(self, query: str, params: tuple, prepare: bool = False):
+        self.params = params
+        return self
+
+    def fetchall(self) -> list[tuple[int, int, int]]:
+        return self.rows
+
+
+def test_near_duplicates_point_at_the_first_upload():
+    rng = random.Random(2)
+    query = [rng.getrandbits(64) for _ in range(10)]
+    # video 7 is itself a near-duplicate of video 3, its hashes are stored signed
+    conn = FakeConnection([(7, to_signed(flip(x, [1, 2, 3])), 3) for x in query[:8]])
+
+    res = Database()._find_near_duplicate(conn, query, "hash", 1, 60.0, 3, 0.6, 5, 0.05)
+
+    assert res == 3
+    keys, owner_id, content_hash, *_ = conn.params
+    assert keys == sorted({k for x in query for k in band_keys(x)})
+    assert (owner_id, content_hash) == (1, "hash")
+
+
+def test_near_duplicates_need_a_duration():
+    query = [random.Random(3).getrandbits(64) for _ in range(10)]
+    conn = FakeConnection([(7, to_signed(x), 7) for x in query])
+
+    assert Database()._find_near_duplicate(conn, query, "hash", 1, None, 3, 0.6, 5, 0.05) is None
+    assert conn.params is None
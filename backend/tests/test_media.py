@@ -0,0 +1,28 @@
+import pytest
+import ffmpeg
+from veridash_backend.worker.media import FrameSampling, MediaArtefacts
+
+
+def select_expr(sampling: FrameSampling) -> str:
+    stream = MediaArtefacts("video.mp4", "/nonexistent", sampling)._sample_frames(ffmpeg.input("video.mp4"))
+    args = stream.output("out").compile()
+    # commas within filter arguments are escaped in the graph
+    return args[args.index("-filter_complex") + 1].replace("\\,", ",")
+
+
+def test_min_fps_bounds_the_gap_between_keyframes():
+    assert "gte(t-prev_selected_t,10.0)" in select_expr(FrameSampling(min_fps=0.1))
+
+
+def test_zero_min_fps_only_samples_scene_changes():
+    expr = select_expr(FrameSampling(min_fps=0))
+
+    assert "gte(t-prev_selected_t,1.0)" in expr
+    assert expr.count("gte(") == 1
+
+
+def test_sampling_rates_are_checked():
+    with pytest.raises(ValueError):
+        FrameSampling(max_fps=0)
+    with pytest.raises(ValueError):
+        FrameSampling(min_fps=-1)
@@ -0,0 +1,98 @@
+import pytest
+from threading import Event
+from contextlib import contextmanager
+
+pytest.importorskip("torch")
+
+from veridash_backend.worker.models import ModelCache
+
+
+class FakeLease:
+    def __init__(self):
+        self.lost = Event()
+
+
+class Leases:
+    """
+    Records the device memory held, as a gpu semaphore would
+    """
+    def __init__(self):
+        self.held: list[int] = []
+        self.granted: list[FakeLease] = []
+
+    @contextmanager
+    def __call__(self, units: int):
+        lease = FakeLease()
+        self.held.append(units)
+        self.granted.append(lease)
+        try:
+            yield lease
+        finally:
+            self.held.remove(units)
+
+
+def test_resident_models_keep_their_lease():
+    leases = Leases()
+    cache = ModelCache(device_lease=leases)
+    cache.register("a", object, 100)
+
+    a = cache.get("a")
+    assert cache.get("a") is a
+    assert leases.held == [100]
+    assert cache.stats()["a"]["loads"] == 1
+
+    cache.evict("a")
+    assert leases.held == []
+
+
+def test_budget_is_made_room_for_before_leasing():
+    leases = Leases()
+    cache = ModelCache(vram_budget=150 * 2**20, device_lease=leases)
+    cache.register("a", object, 100)
+    cache.register("b", object, 100)
+
+    cache.get("a")
+    cache.get("b")
+
+    assert leases.held == [100]
+    assert cache.stats()["a"]["evictions"] == 1
+
+
+def test_models_losing_their_lease_are_reloaded():
+    leases = Leases()
+    cache = ModelCache(device_lease=leases)
+    cache.register("a", object, 100)
+
+    a = cache.get("a")
+    leases.granted[0].lost.set()
+
+    assert cache.get("a") is not a
+    assert leases.held == [100]
+
+
+def test_failed_loads_give_back_their_lease():
+    leases = Leases()
+    cache = ModelCache(device_lease=leases)
+
+    def fail():
+        raise RuntimeError("no weights")
+    cache.register("a", fail, 100)
+
+    with pytest.raises(RuntimeError):
+        cache.get("a")
+    assert leases.held == []
+
+
+def test_cache_events_are_exported():
+    from prometheus_client import REGISTRY
+
+    def sample(event: str) -> float:
+        return REGISTRY.get_sample_value("veridash_model_cache_events_total", {"model": "exported", "event": event}) or 0
+
+    cache = ModelCache()
+    cache.register("exported", object)
+    cache.get("exported")
+    cache.get("exported")
+    cache.evict("exported")
+
+    assert [sample(x) for x in ("load", "hit", "eviction")] == [1, 1, 1]
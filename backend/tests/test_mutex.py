@@ -0,0 +1,107 @@
+import pytest
+from uuid import uuid4
+from time import sleep
+from threading import Thread
+from redis.exceptions import ConnectionError as RedisConnectionError
+from veridash_backend.commons.mutex import LockManager, Lease, LeaseLost
+
+
+@pytest.fixture
+def locks():
+    manager = LockManager()
+    try:
+        manager.redis_client.ping()
+    except RedisConnectionError:
+        pytest.skip("No redis reachable at REDIS_HOST:REDIS_PORT")
+
+    return manager
+
+
+@pytest.fixture
+def name():
+    return f"test:{uuid4()}"
+
+
+def test_lease_check():
+    lease = Lease("gpu:node:0", "token", 1)
+    lease.check()
+
+    lease.lost.set()
+    with pytest.raises(LeaseLost):
+        lease.check()
+
+
+def test_semaphore_counts_units(locks, name):
+    with locks.semaphore(name, 2, 3) as a:
+        with locks.semaphore(name, 1, 3) as b:
+            assert b.fence > a.fence
+
+            with pytest.raises(TimeoutError):
+                with locks.semaphore(name, 1, 3, timeout=0.5):
+                    pass
+
+    # everything was released, including the place of the waiter that timed out
+    with locks.semaphore(name, 3, 3, timeout=0.5):
+        pass
+
+
+def test_semaphore_rejects_more_than_capacity(locks, name):
+    with pytest.raises(ValueError):
+        with locks.semaphore(name, 4, 3):
+            pass
+
+
+def test_semaphore_serves_in_order(locks, name):
+    granted = []
+
+    with locks.semaphore(name, 2, 3):
+        def wait_large():
+            with locks.semaphore(name, 2, 3):
+                granted.append("large")
+
+        large = Thread(target=wait_large)
+        large.start()
+        while locks.redis_client.zcard(f"semaphore:{name}:queue") == 0:
+            sleep(0.01)
+
+        # a unit is free, but the larger request came first
+        with pytest.raises(TimeoutError):
+            with locks.semaphore(name, 1, 3, timeout=0.5):
+                pass
+
+    large.join(5)
+    assert granted == ["large"]
+
+
+def test_semaphore_priority(locks, name):
+    order = []
+
+    with locks.semaphore(name, 1, 1):
+        def wait(label: str, priority: int):
+            with locks.semaphore(name, 1, 1, priority=priority):
+                order.append(label)
+
+        low = Thread(target=wait, args=("low", 0))
+        low.start()
+        while locks.redis_client.zcard(f"semaphore:{name}:queue") < 1:
+            sleep(0.01)
+
+        high = Thread(target=wait, args=("high", 1))
+        high.start()
+        while locks.redis_client.zcard(f"semaphore:{name}:queue") < 2:
+            sleep(0.01)
+
+    low.join(5)
+    high.join(5)
+    assert order == ["high", "low"]
+
+
+def test_lost_lease_is_flagged(locks, name):
+    with locks.semaphore(name, 1, 1, lease=1) as lease:
+        # as if the lease had expired and been handed out again
+        locks.redis_client.delete(f"semaphore:{name}:holders")
+        sleep(1)
+
+        assert lease.lost.is_set()
+        with pytest.raises(LeaseLost):
+            lease.check()
@@ -0,0 +1,83 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from veridash_backend.worker.media import SAMPLE_RATE
+from veridash_backend.worker.transcription import split_points, transcribe_chunks
+
+
+def noise(seconds: float, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).uniform(-0.5, 0.5, int(seconds * SAMPLE_RATE)).astype(np.float32)
+
+
+def test_short_audio_is_one_chunk():
+    audio = noise(10)
+
+    assert split_points(audio, 30) == [len(audio)]
+    assert split_points(audio[:0], 30) == [0]
+
+
+def test_splits_at_silence():
+    audio = noise(70)
+    # a pause a few seconds before the first chunk would end
+    audio[27 * SAMPLE_RATE:int(27.5 * SAMPLE_RATE)] = 0
+
+    points = split_points(audio, 30)
+
+    assert 27 * SAMPLE_RATE <= points[0] <= 27.5 * SAMPLE_RATE
+    assert points[-1] == len(audio)
+
+
+def test_chunks_never_exceed_the_maximum():
+    audio = noise(200)
+
+    points = split_points(audio, 30)
+
+    assert points == sorted(points)
+    assert all(b - a <= 30 * SAMPLE_RATE for a, b in zip([0] + points, points))
+    # silence is only searched for in the last 5 seconds
+    assert all(b - a >= 25 * SAMPLE_RATE for a, b in zip([0] + points[:-1], points[:-1]))
+
+
+class StubWhisper:
+    """
+    Answers every window with one segment, silent until the given window, in the given languages
+    """
+    def __init__(self, languages: list[str], speech_from: int):
+        self.languages = languages
+        self.speech_from = speech_from
+        self.calls = []
+
+    def transcribe(self, audio, language=None, initial_prompt=None):
+        n = len(self.calls)
+        self.calls.append({"language": language, "prompt": initial_prompt})
+
+        return {
+            "language": self.languages[n],
+            "segments": [{
+                "id": 0,
+                "seek": 0,
+                "start": 0.0,
+                "end": 1.0,
+                "text": f"window {n}",
+                "tokens": [1, 2],
+                "no_speech_prob": 0.1 if n >= self.speech_from else 0.9,
+            }],
+        }
+
+
+def test_language_is_detected_on_speech():
+    model = StubWhisper(["en", "no", "de"], speech_from=1)
+
+    windows = list(transcribe_chunks(model, noise(70), 30))
+
+    assert [x[1] for x in windows] == ["en", "no", "no"]
+    assert [x["language"] for x in model.calls] == [None, None, "no"]
+    assert model.calls[2]["prompt"] == "window 1"
+
+    segments = [s for _, _, chunk in windows for s in chunk]
+    assert [s["id"] for s in segments] == [0, 1]
+    assert "tokens" not in segments[0]
+    # timestamps are relative to the whole audio
+    assert segments[0]["start"] >= 25
+    assert windows[-1][0] == 1.0
@@ -0,0 +1,155 @@
+import json
+import pytest
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+pytest.importorskip("openai")
+
+from veridash_backend.worker.translation import Translator
+
+
+class StubOpenAI:
+    """
+    Local stand-in for the chat completions endpoint. Every request is answered by respond, called with the
+    segments asked for and returning the message content, and recorded.
+    """
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests: list[list[dict]] = []
+        self._lock = Lock()
+
+        stub = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                segments = json.loads(body["messages"][-1]["content"])["segments"]
+                with stub._lock:
+                    stub.requests.append(segments)
+                    content = stub.respond(segments, len(stub.requests))
+
+                payload = json.dumps({
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }],
+                }).encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeTranslationCache:
+    def __init__(self, cached: dict[str, str] | None = None):
+        self.cached = dict(cached or {})
+
+    def get_translations(self, source_hashes: list[str], source_language: str) -> dict[str, str]:
+        return {h: self.cached[h] for h in source_hashes if h in self.cached}
+
+    def add_translations(self, translations: dict[str, str], source_language: str):
+        self.cached.update(translations)
+
+
+def translations(segments: list[dict]) -> str:
+    return json.dumps({"translations": [{"id": x["id"], "text": x["text"].upper()} for x in segments]})
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = StubOpenAI(lambda segments, n: translations(segments))
+
+    monkeypatch.setenv("OPENAI_ORG", "org")
+    monkeypatch.setenv("OPENAI_PROJECT", "project")
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+    monkeypatch.setenv("TRANSLATION_CHUNK_TOKENS", "2000")
+
+    yield server
+    server.close()
+
+
+def test_translations_are_aligned_by_id(stub):
+    # out of order, with an id that was never asked for
+    def respond(segments, n):
+        res = json.loads(translations(segments))["translations"][::-1]
+        return json.dumps({"translations": res + [{"id": 99, "text": "BOGUS"}]})
+    stub.respond = respond
+
+    res = Translator().translate_sentences(["a", "b", "c"])
+
+    assert res == ["A", "B", "C"]
+    assert len(stub.requests) == 1
+
+
+def test_left_out_segments_are_asked_for_again(stub):
+    def respond(segments, n):
+        return translations(segments[:-1] if n == 1 else segments)
+    stub.respond = respond
+
+    res = Translator().translate_sentences(["a", "b", "c"])
+
+    assert res == ["A", "B", "C"]
+    assert [[x["text"] for x in r] for r in stub.requests] == [["a", "b", "c"], ["c"]]
+
+
+def test_segments_left_out_twice_stay_untranslated(stub):
+    stub.respond = lambda segments, n: translations([x for x in segments if x["text"] != "b"])
+
+    res = Translator().translate_sentences(["a", "b", "c"])
+
+    assert res == ["A", None, "C"]
+    assert len(stub.requests) == 2
+
+
+def test_malformed_responses_are_retried(stub):
+    stub.respond = lambda segments, n: "not json" if n == 1 else translations(segments)
+
+    assert Translator().translate_sentences(["a", "b"]) == ["A", "B"]
+    assert len(stub.requests) == 2
+
+
+def test_chunks_keep_within_token_budget(stub, monkeypatch):
+    monkeypatch.setenv("TRANSLATION_CHUNK_TOKENS", "60")
+    sentences = [f"sentence number {i} " * 5 for i in range(20)]
+
+    res = Translator().translate_sentences(sentences)
+
+    assert res == [x.upper() for x in sentences]
+    assert len(stub.requests) > 1
+    # ids are positions in the whole input, never repeated across chunks
+    ids = sorted(x["id"] for r in stub.requests for x in r)
+    assert ids == list(range(len(sentences)))
+    for r in stub.requests:
+        assert len(r) == 1 or sum(len(x["text"]) // 4 + 10 for x in r) <= 60
+
+
+def test_cached_repeated_and_empty_sentences_are_not_sent(stub):
+    cache = FakeTranslationCache()
+    translator = Translator(cache)
+
+    assert translator.translate_sentences(["a", "a", " ", "b"], "no") == ["A", "A", " ", "B"]
+    assert [x["text"] for x in stub.requests[0]] == ["a", "b"]
+
+    assert translator.translate_sentences(["b", "a"], "no") == ["B", "A"]
+    assert len(stub.requests) == 1
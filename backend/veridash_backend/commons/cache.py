@@ -0,0 +1,246 @@
+import os
+import fcntl
+import shutil
+import logging
+from time import time, monotonic
+from uuid import uuid4
+from threading import Lock
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+from veridash_backend.commons.metrics import LOCAL_CACHE_EVENTS, LOCAL_CACHE_EVICTED_BYTES
+
+
+logger = logging.getLogger("veridash")
+
+
+class LocalCache:
+    """
+    Size-bounded cache of files and directories on local disk, shared by all processes on the machine.
+    Entries are filled under a temporary name and moved into place, so partial writes are never visible.
+    Recency is tracked by mtime, and entries are pinned with a shared flock while in use, so eviction skips them.
+    """
+    def __init__(self, root: str, max_bytes: int):
+        """
+        :param root: Directory holding the cache entries
+        :param max_bytes: Size budget, least recently used entries are evicted above this (0 for no limit)
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(root, ".tmp")
+
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0}
+
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+
+    @contextmanager
+    def get(self, key: str, fill: Callable[[str], None]) -> Iterator[str]:
+        """
+        Pin an entry for the duration of the context, filling it first on a miss.
+        :param key: Entry name, must be a valid file name
+        :param fill: Called with a temporary path to create the entry at, as a file or a directory
+        :return: Local path of the entry
+        """
+        final_path = self.path(key)
+        filled = False
+
+        while True:
+            try:
+                fd = os.open(final_path, os.O_RDONLY)
+            except FileNotFoundError:
+                self._fill(final_path, fill)
+                filled = True
+                continue
+
+            fcntl.flock(fd, fcntl.LOCK_SH)
+
+            # the entry might have been evicted between opening and locking it
+            try:
+                if os.fstat(fd).st_ino == os.stat(final_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+
+            os.close(fd)
+
+        self._stats["misses" if filled else "hits"] += 1
+        LOCAL_CACHE_EVENTS.labels("miss" if filled else "hit").inc()
+
+        try:
+            os.utime(final_path)
+            if filled:
+                self.evict(keep=key)
+
+            yield final_path
+        finally:
+            os.close(fd)
+
+
+    def evict(self, keep: str | None = None):
+        """
+        Remove least recently used entries that are not pinned, until the cache is within budget.
+        Also cleans up temporary files left behind by crashed processes.
+        :param keep: Entry that is never evicted
+        """
+        for name in os.listdir(self.tmp_dir):
+            p = os.path.join(self.tmp_dir, name)
+            try:
+                if os.stat(p).st_mtime < time() - 24 * 3600:
+                    LocalCache._remove(p)
+            except FileNotFoundError:
+                pass
+
+        if self.max_bytes == 0:
+            return
+
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if entry.path == self.tmp_dir:
+                continue
+
+            try:
+                size = LocalCache._size(entry.path)
+                entries.append((entry.stat().st_mtime, entry.name, size))
+            except FileNotFoundError:
+                continue
+
+            total += size
+
+        entries.sort()
+        for _, name, size in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+
+            p = self.path(name)
+            try:
+                fd = os.open(p, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # pinned by a running task
+                os.close(fd)
+                continue
+
+            try:
+                LocalCache._remove(p)
+            finally:
+                os.close(fd)
+
+            total -= size
+            self._stats["evictions"] += 1
+            self._stats["evicted_bytes"] += size
+            LOCAL_CACHE_EVENTS.labels("eviction").inc()
+            LOCAL_CACHE_EVICTED_BYTES.inc(size)
+            logger.debug(f"Evicted {name} ({size} bytes) from local cache")
+
+        if total > self.max_bytes:
+            logger.warning(f"Local cache holds {total} bytes, over its {self.max_bytes} byte budget as entries are pinned")
+
+
+    def stats(self) -> dict[str, int]:
+        """
+        :return: Counters for this process: hits, misses, evictions and evicted_bytes
+        """
+        return dict(self._stats)
+
+
+    def _fill(self, final_path: str, fill: Callable[[str], None]):
+        tmp_path = os.path.join(self.tmp_dir, f"{os.path.basename(final_path)}.{uuid4()}")
+
+        try:
+            fill(tmp_path)
+
+            if os.path.isdir(tmp_path):
+                # fails if another process filled the entry first
+                os.rename(tmp_path, final_path)
+            else:
+                # unlike a rename, never replaces an entry someone else might have pinned
+                os.link(tmp_path, final_path)
+        except OSError:
+            if not os.path.exists(final_path):
+                raise
+        finally:
+            LocalCache._remove(tmp_path)
+
+
+    @classmethod
+    def _size(cls, p: str) -> int:
+        if not os.path.isdir(p):
+            return os.stat(p).st_size
+
+        total = 0
+        for dirpath, _, filenames in os.walk(p):
+            for f in filenames:
+                try:
+                    total += os.stat(os.path.join(dirpath, f)).st_size
+                except FileNotFoundError:
+                    pass
+
+        return total
+
+
+    @classmethod
+    def _remove(cls, p: str):
+        if os.path.isdir(p):
+            shutil.rmtree(p, ignore_errors=True)
+        elif os.path.exists(p):
+            os.remove(p)
+
+
+class ExpiringCache:
+    """
+    Thread-safe in-memory cache where every entry has its own time to live, bounded to a number of entries
+    by evicting the least recently used.
+    """
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+
+        self._entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self._lock = Lock()
+
+
+    def get(self, key: str) -> Any | None:
+        """
+        :return: The cached value, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+
+    def put(self, key: str, value: Any, ttl: float):
+        """
+        :param ttl: Seconds until the entry expires
+        """
+        with self._lock:
+            self._entries[key] = (value, monotonic() + ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
@@ -1,45 +1,205 @@
+import os
 import json
 import hashlib
 from os import path
 from uuid import uuid4
-from psycopg_pool import NullConnectionPool
+from threading import Lock
+from typing import Sequence
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+from collections import defaultdict
+from veridash_backend.commons.metrics import stage, traced
 from veridash_backend.commons.settings import Settings
+from veridash_backend.commons.fingerprint import select_frames, band_keys, to_signed, to_unsigned, best_match, \
+    MAX_DISTANCE
+
+
+# queries shared by the sync and async variants
+
+INSERT_VIDEO = """
+    INSERT INTO videos (owner_id, filename, hash_sha256, hash_verified, object_name, blob_name)
+    VALUES (%s, %s, %s, %s, %s, %s);
+"""
+
+SELECT_VERIFIED_BLOB = """
+    SELECT blob_name FROM videos
+    WHERE hash_sha256 = %s AND hash_verified
+    ORDER BY id LIMIT 1;
+"""
+
+# whether the video's hash is verified, adopting the verified hash of a video sharing its blob if there is one
+HAS_VERIFIED_HASH = """
+    WITH adopted AS (
+        UPDATE videos v SET hash_sha256 = o.hash_sha256, hash_verified = true
+        FROM videos o
+        WHERE v.object_name = %(name)s AND NOT v.hash_verified AND o.blob_name = v.blob_name AND o.hash_verified
+        RETURNING v.id
+    )
+    SELECT hash_verified OR EXISTS (SELECT 1 FROM adopted) FROM videos WHERE object_name = %(name)s;
+"""
+
+SELECT_USER_VIDEO = """
+    SELECT blob_name, CASE WHEN hash_verified THEN hash_sha256 END FROM videos WHERE owner_id = %s AND object_name = %s;
+"""
+
+# ids of the videos holding the same footage as the video named by the parameter: itself, the owner's
+# byte-identical uploads and near-duplicates found by fingerprint, and other owners' uploads of the same bytes.
+# looking alike is no proof of holding the same footage, so results only cross owners by verified hash
+SAME_CONTENT = """
+    SELECT s.id FROM videos o
+    LEFT JOIN videos d ON d.id = o.near_duplicate_of
+    INNER JOIN videos s ON s.id = o.id
+        OR (s.owner_id = o.owner_id AND (s.hash_sha256 = o.hash_sha256 OR s.id = d.id
+                                         OR s.near_duplicate_of = o.id OR s.near_duplicate_of = o.near_duplicate_of))
+        OR (s.hash_verified AND ((o.hash_verified AND s.hash_sha256 = o.hash_sha256)
+                                 OR (d.hash_verified AND s.hash_sha256 = d.hash_sha256)))
+    WHERE o.object_name = %s
+"""
+
+SELECT_CACHED_RESULTS = f"""
+    SELECT r.job_result FROM job_results r
+    WHERE r.job_type = %s AND r.job_key IS NOT DISTINCT FROM %s
+    AND r.video_id IN ({SAME_CONTENT})
+    ORDER BY r.id DESC
+    LIMIT 1;
+"""
+
+LATEST_KEYFRAME_RUN = f"""
+    SELECT k.id FROM keyframe_runs k
+    WHERE k.video_id IN ({SAME_CONTENT})
+    ORDER BY k.id DESC
+    LIMIT 1
+"""
+
+# keyframes of the latest keyframe run over the same footage, and the run
+SELECT_KEYFRAMES = f"""
+    SELECT i.object_name, i.timestamp_seconds, i.run_id
+    FROM images i
+    WHERE i.run_id = ({LATEST_KEYFRAME_RUN})
+    ORDER BY i.frame_number;
+"""
+
+# detections of the latest detection run on those keyframes, their source frames being numbers of its keyframes.
+# a finished run without detections is a single row of nulls, no row at all means no run finished
+SELECT_DETECTIONS = f"""
+    SELECT d.object_name, d.source_frame, d.class_name, d.confidence
+    FROM (
+        SELECT r.id FROM detection_runs r
+        WHERE r.keyframe_run_id = ({LATEST_KEYFRAME_RUN})
+        ORDER BY r.id DESC
+        LIMIT 1
+    ) r
+    LEFT JOIN detected_objects d ON d.run_id = r.id
+    ORDER BY d.frame_number;
+"""
+
+
+# nearest neighbours by cosine distance among the owner's images of the same kind, using the hnsw index
+SELECT_SIMILAR_IMAGES = """
+    SELECT i.object_name, v.object_name, i.frame_number, i.embedding <=> %(embedding)s::halfvec AS distance
+    FROM {table} i
+    INNER JOIN videos v ON v.id = i.video_id
+    WHERE v.owner_id = %(owner_id)s AND i.object_name != %(object_name)s AND i.embedding IS NOT NULL
+    ORDER BY i.embedding <=> %(embedding)s::halfvec
+    LIMIT %(limit)s;
+"""
+
+# the same, ranking all of the owner's images exactly. the index is bypassed, as the owner's images are selected first
+SELECT_SIMILAR_IMAGES_EXACT = """
+    WITH owned AS MATERIALIZED (
+        SELECT i.object_name, v.object_name AS video_name, i.frame_number, i.embedding
+        FROM {table} i
+        INNER JOIN videos v ON v.id = i.video_id
+        WHERE v.owner_id = %(owner_id)s AND i.object_name != %(object_name)s AND i.embedding IS NOT NULL
+    )
+    SELECT object_name, video_name, frame_number, embedding <=> %(embedding)s::halfvec AS distance
+    FROM owned
+    ORDER BY distance
+    LIMIT %(limit)s;
+"""
+
+
+def vector_literal(embedding: Sequence[float] | None) -> str | None:
+    """
+    :return: Text representation of the embedding, cast to halfvec in queries
+    """
+    if embedding is None:
+        return None
+
+    return "[" + ",".join(f"{float(x):.5g}" for x in embedding) + "]"
+
+
+def new_object_name(filename: str) -> str:
+    _, ext = path.splitext(filename)
+    return str(uuid4()) + ext
+
 
 class Database:
     def __init__(self):
-        settings = Settings()
-
-        self.pool = NullConnectionPool(settings.POSTGRES_CONN_STR)
-        self.pool.open()
+        self.settings = Settings()
+
+        self._pool: ConnectionPool | None = None
+        self._pool_pid: int | None = None
+        self._pool_lock = Lock()
+
+
+    @property
+    def pool(self) -> ConnectionPool:
+        # pools don't survive forking, so every (celery) process opens its own on first use
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ConnectionPool(self.settings.POSTGRES_CONN_STR,
+                    min_size=self.settings.POSTGRES_POOL_MIN,
+                    max_size=self.settings.POSTGRES_POOL_MAX,
+                    check=ConnectionPool.check_connection,
+                    open=True,
+                )
+                self._pool_pid = os.getpid()
 
+            return self._pool
 
-    def provision_object_name(self, user_id: int, filename: str, file_hash: str | None) -> str:
-        _, ext = path.splitext(filename)
-        obj_name = str(uuid4()) + ext
 
+    @traced("db.get_blob_name")
+    def get_blob_name(self, object_name: str) -> str | None:
+        """
+        :returns: Name of the object in storage holding the video's bytes
+        """
         with self.pool.connection() as conn:
-            conn.execute("INSERT INTO videos (owner_id, filename, hash_sha256, object_name) VALUES (%s, %s, %s, %s);",
-                         (user_id, filename, file_hash, obj_name))
+            res = conn.execute("SELECT blob_name FROM videos WHERE object_name = %s;", (object_name, )).fetchone()
 
-        return obj_name
+        return None if res is None else res[0]
 
 
-    def video_belongs_to_user(self, user_id: int, object_name: str) -> bool:
+    @traced("db.has_verified_hash")
+    def has_verified_hash(self, object_name: str) -> bool:
+        """
+        :returns: Whether the video has a server-side hash, in which case it needs no hashing
+        """
         with self.pool.connection() as conn:
-            res = conn.execute("SELECT id FROM videos WHERE owner_id = %s AND object_name = %s;",
-                               (user_id, object_name)).fetchone()
+            res = conn.execute(HAS_VERIFIED_HASH, {"name": object_name}, prepare=True).fetchone()
 
-        return res is not None
+        return res is not None and res[0]
 
 
-    def add_video_hash_if_not_exists(self, object_name: str, local_path: str):
+    @traced("db.set_video_hash")
+    def set_video_hash(self, object_name: str, digest: str):
+        """
+        Store a server-side hash, replacing any unverified client-provided hash
+        """
         with self.pool.connection() as conn:
-            res = conn.execute("SELECT hash_sha256 FROM videos WHERE object_name = %s;", (object_name, )).fetchone()
-            if res is not None and res[0] != None:
-                return
+            conn.execute("UPDATE videos SET hash_sha256 = %s, hash_verified = true WHERE object_name = %s;",
+                         (digest, object_name))
+
+
+    @traced("db.add_video_hash_if_not_exists")
+    def add_video_hash_if_not_exists(self, object_name: str, local_path: str):
+        """
+        Hash a local copy of the video server-side, unless already hashed. Prefer hashing while downloading.
+        """
+        if self.has_verified_hash(object_name):
+            return
 
         hasher = hashlib.sha256()
-        with open(local_path, 'rb') as f:
+        with stage("hash"), open(local_path, 'rb') as f:
             while True:
                 # reading at 1MB chunks
                 data = f.read(1_000_000)
@@ -48,72 +208,185 @@ class Database:
 
                 hasher.update(data)
 
-        digest = hasher.hexdigest()
-        with self.pool.connection() as conn:
-            conn.execute("UPDATE videos SET hash_sha256 = %s WHERE object_name = %s;", (digest, object_name))
+        self.set_video_hash(object_name, hasher.hexdigest())
 
 
-    def add_video_keyframes(self, video_name: str, image_names: list[str]) -> list[str]:
+    @traced("db.add_video_keyframes")
+    def add_video_keyframes(self, video_name: str, image_names: list[str],
+                            timestamps: list[float | None] | None = None,
+                            embeddings: list[Sequence[float]] | None = None) -> list[str]:
+        """
+        :param timestamps: Optional position of each keyframe in the video, in seconds
+        :param embeddings: Optional image embedding of each keyframe
+        :returns: Provisioned object names for the keyframes, in the same order, replacing earlier keyframes
+        """
+        if timestamps is None:
+            timestamps = [None] * len(image_names)
+        if embeddings is None:
+            embeddings = [None] * len(image_names)
+
+        # one transaction, so a failed task never leaves a partial set of keyframes
         with self.pool.connection() as conn:
             video_id = conn.execute("SELECT id FROM videos WHERE object_name = %s;", (video_name, )).fetchone()
             if video_id is None:
                 return []
             video_id = video_id[0]
 
-        insert_tuples = []
-        frame_count = len(image_names)
-        for i, name in enumerate(image_names):
-            _, ext = path.splitext(name)
-            obj_name = str(uuid4()) + ext
+            run_id = conn.execute("INSERT INTO keyframe_runs (video_id) VALUES (%s) RETURNING id;",
+                                  (video_id, )).fetchone()[0]
 
-            insert_tuples.append((video_id, obj_name, i+1, frame_count))
+            insert_tuples = []
+            frame_count = len(image_names)
+            for i, (name, ts, emb) in enumerate(zip(image_names, timestamps, embeddings)):
+                insert_tuples.append((video_id, new_object_name(name), i+1, frame_count, ts, vector_literal(emb),
+                                      run_id))
 
-        with self.pool.connection() as conn:
             conn.cursor().executemany("""
-                INSERT INTO images (video_id, object_name, frame_number, total_frames)
-                VALUES (%s, %s, %s, %s);
+                INSERT INTO images (video_id, object_name, frame_number, total_frames, timestamp_seconds, embedding,
+                                    run_id)
+                VALUES (%s, %s, %s, %s, %s, %s::halfvec, %s);
             """, insert_tuples)
 
         return [x[1] for x in insert_tuples]
 
 
-    def add_detected_objects(self, video_name: str, image_names: list[str]) -> list[str]:
-        # TODO: rework so we know what image the object is extracted from.
+    @traced("db.add_detected_objects")
+    def add_detected_objects(self, video_name: str, keyframe_run: int,
+                             detections: list[tuple[int, int, str, float, tuple]],
+                             embeddings: list[Sequence[float]] | None = None,
+                             object_names: list[str] | None = None) -> list[str]:
+        """
+        Store a finished detection run, even without detections, so it is not run again
+        :param video_name: Object name of the source video
+        :param keyframe_run: Keyframe run detected on, see get_keyframe_run
+        :param detections: Tuples of (keyframe number in the run, class id, class name, confidence, (x1, y1, x2, y2))
+        :param embeddings: Optional image embedding of each crop
+        :param object_names: Names of crops already uploaded, provisioned here if None
+        :returns: Object names of the crops, in the same order
+        """
+        if embeddings is None:
+            embeddings = [None] * len(detections)
+        if object_names is None:
+            object_names = [new_object_name(".jpg") for _ in detections]
+
         with self.pool.connection() as conn:
             video_id = conn.execute("SELECT id FROM videos WHERE object_name = %s;", (video_name, )).fetchone()
             if video_id is None:
                 return []
             video_id = video_id[0]
 
-        insert_tuples = []
-        frame_count = len(image_names)
-        for i, name in enumerate(image_names):
-            _, ext = path.splitext(name)
-            obj_name = str(uuid4()) + ext
+            run_id = conn.execute("INSERT INTO detection_runs (keyframe_run_id) VALUES (%s) RETURNING id;",
+                                  (keyframe_run, )).fetchone()[0]
 
-            insert_tuples.append((video_id, obj_name, i+1, frame_count))
+            insert_tuples = []
+            object_count = len(detections)
+            for i, ((source_frame, class_id, class_name, confidence, box), emb, name) in \
+                    enumerate(zip(detections, embeddings, object_names)):
+                insert_tuples.append((video_id, name, i+1, object_count, source_frame, class_id,
+                                      class_name, confidence, list(box), vector_literal(emb), run_id))
 
-        with self.pool.connection() as conn:
             conn.cursor().executemany("""
-                INSERT INTO detected_objects (video_id, object_name, frame_number, total_frames)
-                VALUES (%s, %s, %s, %s);
+                INSERT INTO detected_objects (video_id, object_name, frame_number, total_frames,
+                                              source_frame, class_id, class_name, confidence, box, embedding, run_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s::halfvec, %s);
             """, insert_tuples)
 
         return [x[1] for x in insert_tuples]
 
 
-    def get_cached_results(self, object_name: str, job_type: str) -> dict | None:
+    @traced("db.add_video_fingerprint")
+    def add_video_fingerprint(self, object_name: str, frame_hashes: list[int], duration: float | None,
+                              max_frames: int = 64, max_distance: int = 3, min_score: float = 0.6, min_frames: int = 5,
+                              duration_tolerance: float = 0.05) -> str | None:
+        """
+        Fingerprint the video, unless done already, flagging it as a near-duplicate of an earlier video of the same
+        owner when they last as long and enough of their keyframes look alike. Results are shared between
+        near-duplicates from then on.
+        :param frame_hashes: 64-bit perceptual hashes of the keyframes, in order
+        :param duration: Length of the video in seconds, never a near-duplicate if unknown
+        :param max_frames: Keyframes the fingerprint is made of
+        :param max_distance: Hamming distance at which keyframes look alike, at most fingerprint.MAX_DISTANCE
+        :param min_score: Fraction of keyframes that must look alike
+        :param min_frames: Number of keyframes that must look alike
+        :param duration_tolerance: Fraction the lengths may differ by (at least a second)
+        :returns: Object name of the earlier video it is a near-duplicate of, if any
+        """
+        if max_distance > MAX_DISTANCE:
+            raise ValueError(f"Fingerprints only find keyframes within distance {MAX_DISTANCE}, not {max_distance}")
+
         with self.pool.connection() as conn:
-            res = conn.execute("""
-                SELECT r.job_result FROM job_results r
-                INNER JOIN videos v ON v.id = r.video_id
-                WHERE r.job_type = %s
-                AND v.hash_sha256 = (SELECT hash_sha256 FROM videos
-                                     WHERE object_name = %s AND hash_sha256 is not null
-                                     LIMIT 1)
-                ORDER BY r.id DESC
+            res = conn.execute("SELECT id, hash_sha256, owner_id FROM videos WHERE object_name = %s;",
+                               (object_name, )).fetchone()
+            if res is None:
+                return None
+            video_id, content_hash, owner_id = res
+
+            conn.execute("UPDATE videos SET duration_seconds = %s WHERE id = %s;", (duration, video_id))
+
+            # byte-identical uploads of the owner share one fingerprint
+            twin = conn.execute("""
+                SELECT near_duplicate_of FROM videos
+                WHERE hash_sha256 = %s AND owner_id = %s AND fingerprinted AND id != %s
                 LIMIT 1;
-                """, (job_type, object_name)).fetchone()
+            """, (content_hash, owner_id, video_id)).fetchone()
+
+            # locks the row, concurrent tasks wait for the fingerprint instead of computing it again
+            claimed = conn.execute("""
+                UPDATE videos SET fingerprinted = true
+                WHERE id = %s AND NOT fingerprinted
+                RETURNING id;
+            """, (video_id, )).fetchone()
+
+            if claimed is None or twin is not None:
+                duplicate_of = twin[0] if claimed is not None else conn.execute(
+                    "SELECT near_duplicate_of FROM videos WHERE id = %s;", (video_id, )).fetchone()[0]
+            else:
+                hashes = select_frames(frame_hashes, max_frames)
+                duplicate_of = self._find_near_duplicate(conn, hashes, content_hash, owner_id, duration, max_distance,
+                                                         min_score, min_frames, duration_tolerance)
+
+                conn.cursor().executemany("""
+                    INSERT INTO video_fingerprints (video_id, phash, band_key) VALUES (%s, %s, %s);
+                """, [(video_id, to_signed(h), k) for h in hashes for k in band_keys(h)])
+
+            conn.execute("UPDATE videos SET near_duplicate_of = %s WHERE id = %s;", (duplicate_of, video_id))
+            if duplicate_of is None:
+                return None
+
+            return conn.execute("SELECT object_name FROM videos WHERE id = %s;", (duplicate_of, )).fetchone()[0]
+
+
+    def _find_near_duplicate(self, conn, hashes: list[int], content_hash: str | None, owner_id: int,
+                             duration: float | None, max_distance: int, min_score: float, min_frames: int,
+                             duration_tolerance: float) -> int | None:
+        keys = sorted({k for h in hashes for k in band_keys(h)})
+        if len(keys) == 0 or len(hashes) < min_frames or duration is None:
+            return None
+
+        candidates = conn.execute("""
+            SELECT f.video_id, f.phash, coalesce(v.near_duplicate_of, v.id)
+            FROM video_fingerprints f
+            INNER JOIN videos v ON v.id = f.video_id
+            WHERE f.band_key = ANY(%s) AND v.owner_id = %s AND v.hash_sha256 IS DISTINCT FROM %s
+            AND abs(v.duration_seconds - %s) <= greatest(1.0, %s * %s);
+        """, (keys, owner_id, content_hash, duration, duration_tolerance, duration), prepare=True).fetchall()
+
+        by_video = defaultdict(set)
+        roots = {}
+        for video_id, phash, root in candidates:
+            by_video[video_id].add(to_unsigned(phash))
+            roots[video_id] = root
+
+        best = best_match(hashes, by_video, max_distance, min_score, min_frames)
+
+        # near-duplicates point at the first upload of the footage, never at another near-duplicate
+        return None if best is None else roots[best]
+
+
+    @traced("db.get_cached_results")
+    def get_cached_results(self, object_name: str, job_type: str, job_key: str | None = None) -> dict | None:
+        with self.pool.connection() as conn:
+            res = conn.execute(SELECT_CACHED_RESULTS, (job_type, job_key, object_name), prepare=True).fetchone()
 
         if res is None:
             return None
@@ -121,51 +394,211 @@ class Database:
         return res[0]
 
 
-    def store_job_result(self, object_name: str, job_type: str, job_result: dict):
+    @traced("db.store_job_result")
+    def store_job_result(self, object_name: str, job_type: str, job_result: dict, job_key: str | None = None):
+        """
+        :param job_key: Identifies the parameters the job ran with, see commons.jobs.job_key
+        """
         with self.pool.connection() as conn:
             conn.execute("""
-                INSERT INTO job_results (video_id, job_type, job_result)
+                INSERT INTO job_results (video_id, job_type, job_key, job_result)
                 VALUES (
                     (SELECT id FROM videos WHERE object_name = %s),
-                    %s, %s
+                    %s, %s, %s
                 );
-            """, (object_name, job_type, json.dumps(job_result)))
+            """, (object_name, job_type, job_key, json.dumps(job_result)))
 
 
-    def get_images_by_video_name(self, video_name: str) -> list[str]:
+    @traced("db.get_translations")
+    def get_translations(self, source_hashes: list[str], source_language: str) -> dict[str, str]:
+        """
+        :returns: Cached english translations by source text hash, for the hashes found
+        """
         with self.pool.connection() as conn:
             res = conn.execute("""
-                SELECT DISTINCT ON (i.frame_number) i.object_name
-                FROM images i
-                INNER JOIN videos v ON v.id = i.video_id
-                WHERE v.hash_sha256 IN (
-                    SELECT hash_sha256 FROM videos
-                    WHERE object_name = %s AND hash_sha256 is not null
-                )
-                ORDER BY frame_number;
-            """, (video_name, )).fetchall()
+                SELECT source_hash, translation FROM translations
+                WHERE source_hash = ANY(%s) AND source_language = %s;
+            """, (source_hashes, source_language)).fetchall()
 
-        image_names = [row[0] for row in res]
-        return image_names
+        return {row[0]: row[1] for row in res}
 
 
-    # TODO: what keyframe did it come from?
-    def get_detections_by_video_name(self, video_name: str) -> list[str]:
+    @traced("db.add_translations")
+    def add_translations(self, translations: dict[str, str], source_language: str):
+        """
+        :param translations: English translations by source text hash
+        """
         with self.pool.connection() as conn:
-            res = conn.execute("""
-                SELECT DISTINCT ON (i.frame_number) i.object_name
-                FROM detected_objects i
-                INNER JOIN videos v ON v.id = i.video_id
-                WHERE v.hash_sha256 IN (
-                    SELECT hash_sha256 FROM videos
-                    WHERE object_name = %s AND hash_sha256 is not null
-                )
-                ORDER BY frame_number;
-            """, (video_name, )).fetchall()
+            conn.cursor().executemany("""
+                INSERT INTO translations (source_hash, source_language, translation)
+                VALUES (%s, %s, %s)
+                ON CONFLICT DO NOTHING;
+            """, [(h, source_language, x) for h, x in translations.items()])
+
+
+    @traced("db.get_images_by_video_name")
+    def get_images_by_video_name(self, video_name: str) -> list[str]:
+        return [x[0] for x in self.get_keyframes_by_video_name(video_name)]
+
+
+    @traced("db.get_keyframe_run")
+    def get_keyframe_run(self, video_name: str) -> tuple[int, list[str]] | None:
+        """
+        :returns: Id and object names of the keyframes, in frame order, of the latest keyframe run over the same
+                  content. None if there is none
+        """
+        with self.pool.connection() as conn:
+            res = conn.execute(SELECT_KEYFRAMES, (video_name, ), prepare=True).fetchall()
+
+        return None if len(res) == 0 else (res[0][2], [row[0] for row in res])
+
+
+    @traced("db.get_keyframes_by_video_name")
+    def get_keyframes_by_video_name(self, video_name: str) -> list[tuple[str, float | None]]:
+        """
+        :returns: Tuples of (object name, timestamp in seconds), in frame order
+        """
+        with self.pool.connection() as conn:
+            res = conn.execute(SELECT_KEYFRAMES, (video_name, ), prepare=True).fetchall()
+
+        return [(row[0], row[1]) for row in res]
 
-        image_names = [row[0] for row in res]
-        return image_names
 
+    @traced("db.get_detections_by_video_name")
+    def get_detections_by_video_name(self, video_name: str) -> list[tuple[str, int, str, float]] | None:
+        """
+        Detections from the latest detection run on the keyframes of get_keyframes_by_video_name
+        :returns: Tuples of (object name, keyframe number, class name, confidence), in detection order.
+                  None if no detection run finished on those keyframes
+        """
+        with self.pool.connection() as conn:
+            res = conn.execute(SELECT_DETECTIONS, (video_name, ), prepare=True).fetchall()
+
+        if len(res) == 0:
+            return None
+        return [(row[0], row[1], row[2], row[3]) for row in res if row[0] is not None]
+
+
+class AsyncDatabase:
+    """
+    Async variant of Database, for the queries the webserver makes while handling messages
+    """
+    def __init__(self):
+        settings = Settings()
+
+        self.pool = AsyncConnectionPool(settings.POSTGRES_CONN_STR,
+            min_size=min(settings.POSTGRES_POOL_MIN, settings.POSTGRES_WEBSERVER_POOL_MAX),
+            max_size=settings.POSTGRES_WEBSERVER_POOL_MAX,
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+
+
+    async def open(self):
+        await self.pool.open()
+
+
+    async def close(self):
+        await self.pool.close()
+
+
+    async def provision_object_name(self, user_id: int, filename: str, file_hash: str | None,
+                                    blob_name: str | None = None) -> str:
+        """
+        :param blob_name: Existing object holding byte-identical content, in which case nothing needs uploading
+        :returns: Object name identifying the new video
+        """
+        obj_name = new_object_name(filename)
+
+        async with self.pool.connection() as conn:
+            await conn.execute(INSERT_VIDEO,
+                               (user_id, filename, file_hash, blob_name is not None, obj_name, blob_name or obj_name))
+
+        return obj_name
+
+
+    async def find_verified_blob(self, file_hash: str) -> str | None:
+        """
+        :returns: Name of an object whose content has been hashed server-side to file_hash, if any
+        """
+        async with self.pool.connection() as conn:
+            res = await (await conn.execute(SELECT_VERIFIED_BLOB, (file_hash, ), prepare=True)).fetchone()
+
+        return None if res is None else res[0]
 
-if __name__ == "__main__":
-    db = Database()
+
+    async def get_user_video(self, user_id: int, object_name: str) -> tuple[str, str | None] | None:
+        """
+        :returns: Tuple of (blob name, content hash if verified) if the video belongs to the user
+        """
+        async with self.pool.connection() as conn:
+            res = await (await conn.execute(SELECT_USER_VIDEO, (user_id, object_name), prepare=True)).fetchone()
+
+        return None if res is None else (res[0], res[1])
+
+
+    async def get_cached_results(self, object_name: str, job_type: str, job_key: str | None = None) -> dict | None:
+        async with self.pool.connection() as conn:
+            res = await (await conn.execute(SELECT_CACHED_RESULTS, (job_type, job_key, object_name),
+                                            prepare=True)).fetchone()
+
+        return None if res is None else res[0]
+
+
+    async def find_similar_images(self, user_id: int, object_name: str, limit: int = 20,
+                                  ef_search: int = 100) -> list[tuple[str, str, int, float]] | None:
+        """
+        Approximate nearest neighbours of a keyframe among all keyframes of the user, or of an object crop among
+        all crops of the user
+        :param object_name: Object name of the keyframe or crop
+        :param ef_search: Candidates considered by the index, trading speed for recall. If fewer than limit of them
+                          belong to the user, the user's images are searched exactly
+        :returns: Tuples of (object name, video object name, keyframe or detection number, cosine distance),
+                  closest first.
+                  None if the image does not belong to the user or has no embedding
+        """
+        async with self.pool.connection() as conn:
+            for table in ("images", "detected_objects"):
+                res = await (await conn.execute(f"""
+                    SELECT i.embedding::text FROM {table} i
+                    INNER JOIN videos v ON v.id = i.video_id
+                    WHERE i.object_name = %s AND v.owner_id = %s AND i.embedding IS NOT NULL;
+                """, (object_name, user_id))).fetchone()
+
+                if res is not None:
+                    break
+            else:
+                return None
+
+            params = {
+                "embedding": res[0],
+                "owner_id": user_id,
+                "object_name": object_name,
+                "limit": limit,
+            }
+
+            await conn.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)};")
+            rows = await (await conn.execute(SELECT_SIMILAR_IMAGES.format(table=table), params)).fetchall()
+
+            # the index finds candidates among everyone's images, and other owners' are filtered out after, which
+            # leaves few or none for users with few images. those are cheap to rank exactly instead
+            if len(rows) < limit:
+                rows = await (await conn.execute(SELECT_SIMILAR_IMAGES_EXACT.format(table=table), params)).fetchall()
+
+        return [(row[0], row[1], row[2], row[3]) for row in rows]
+
+
+    async def get_keyframes_by_video_name(self, video_name: str) -> list[tuple[str, float | None]]:
+        async with self.pool.connection() as conn:
+            res = await (await conn.execute(SELECT_KEYFRAMES, (video_name, ), prepare=True)).fetchall()
+
+        return [(row[0], row[1]) for row in res]
+
+
+    async def get_detections_by_video_name(self, video_name: str) -> list[tuple[str, int, str, float]] | None:
+        async with self.pool.connection() as conn:
+            res = await (await conn.execute(SELECT_DETECTIONS, (video_name, ), prepare=True)).fetchall()
+
+        if len(res) == 0:
+            return None
+        return [(row[0], row[1], row[2], row[3]) for row in res if row[0] is not None]
@@ -0,0 +1,78 @@
+"""
+Video fingerprints, as the 64-bit perceptual hashes of (up to a number of) keyframes.
+Hashes are indexed by multi-index hashing: split into BANDS bands of 16 bits, any two hashes within
+hamming distance BANDS - 1 share at least one band exactly, so exact lookups on bands find all close hashes.
+More bands would allow larger distances, but narrower bands collide with far more unrelated hashes.
+"""
+
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# the largest distance lookups are guaranteed to find every hash within
+MAX_DISTANCE = BANDS - 1
+
+# hashes with fewer bits set, or fewer bits clear, than this come from (nearly) uniform frames, e.g. black ones,
+# which every video has and which would all share their band keys
+MIN_BITS = 8
+
+
+def informative(phash: int) -> bool:
+    """
+    :return: Whether the hash tells frames apart, unlike those of uniform frames
+    """
+    return MIN_BITS <= phash.bit_count() <= 64 - MIN_BITS
+
+
+def select_frames(hashes: list[int], count: int) -> list[int]:
+    """
+    :return: Up to count informative hashes, evenly spread over the video
+    """
+    hashes = [x for x in hashes if informative(x)]
+    if len(hashes) <= count:
+        return hashes
+
+    return [hashes[i * len(hashes) // count] for i in range(count)]
+
+
+def band_keys(phash: int) -> list[int]:
+    """
+    :return: One key per band, holding both the band number and its bits
+    """
+    mask = (1 << BAND_BITS) - 1
+    return [(i << BAND_BITS) | ((phash >> (i * BAND_BITS)) & mask) for i in range(BANDS)]
+
+
+def to_signed(phash: int) -> int:
+    """
+    Postgres has no unsigned 64-bit integers
+    """
+    return phash - (1 << 64) if phash >= 1 << 63 else phash
+
+
+def to_unsigned(phash: int) -> int:
+    return phash + (1 << 64) if phash < 0 else phash
+
+
+def match_count(query: list[int], candidate: set[int], max_distance: int) -> int:
+    """
+    :return: Number of query hashes within max_distance of some candidate hash
+    """
+    return sum(1 for q in query if any((q ^ c).bit_count() <= max_distance for c in candidate))
+
+
+def best_match(query: list[int], candidates: dict[int, set[int]], max_distance: int, min_score: float,
+               min_frames: int) -> int | None:
+    """
+    :param candidates: Hashes of every candidate video, by video id
+    :return: The candidate matching the most query hashes, if it matches at least min_frames of them,
+             and at least a min_score fraction
+    """
+    best, best_count = None, 0
+    for video_id, candidate in candidates.items():
+        count = match_count(query, candidate, max_distance)
+        if count > best_count:
+            best, best_count = video_id, count
+
+    if best is None or best_count < min_frames or best_count < min_score * len(query):
+        return None
+
+    return best
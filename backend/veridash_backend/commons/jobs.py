@@ -0,0 +1,177 @@
+import json
+import logging
+from threading import Thread, Event
+from redis import Redis
+from veridash_backend.commons.settings import Settings
+
+
+logger = logging.getLogger("veridash")
+
+# pub/sub channel all job state changes are announced on
+JOB_CHANNEL = "veridash:jobs"
+
+# celery queues, and the priorities tasks are queued with. every priority is its own list in redis,
+# named <queue>:<priority>, except 0 which is just <queue>
+QUEUES = ("io", "cpu", "gpu")
+PRIORITY_STEPS = list(range(10))
+
+# returns the id of the task owning the claim, registering ARGV[1] as the owner if unclaimed
+CLAIM_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner then
+    return owner
+end
+
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('SET', KEYS[2], KEYS[1], 'EX', ARGV[2])
+return ARGV[1]
+"""
+
+# removes the claim registered by the task, if it still holds it
+RELEASE_SCRIPT = """
+local key = redis.call('GET', KEYS[1])
+if not key then
+    return 0
+end
+
+redis.call('DEL', KEYS[1])
+if redis.call('GET', key) == ARGV[1] then
+    redis.call('DEL', key)
+end
+return 1
+"""
+
+# sets the expiry of the claim registered by the task, if it still holds it, only ever extending it if ARGV[3] is 1.
+# returns 0 if the claim is gone
+RENEW_SCRIPT = """
+local key = redis.call('GET', KEYS[1])
+if not key or redis.call('GET', key) ~= ARGV[1] then
+    return 0
+end
+if ARGV[3] == '1' and redis.call('TTL', key) >= tonumber(ARGV[2]) then
+    return 1
+end
+
+redis.call('EXPIRE', key, ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def job_key(params: list | None) -> str | None:
+    """
+    :param params: Task arguments following the video name
+    :return: Key identifying the parameters among results of the same job type, None without parameters
+    """
+    return json.dumps(params, sort_keys=True) if params else None
+
+
+class JobTracker:
+    """
+    Redis-based helper class announcing job state changes to the webservers,
+    and keeping track of in-flight jobs so identical requests share one task
+    """
+    def __init__(self):
+        settings = Settings()
+
+        self.redis_client = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+        self._claim = self.redis_client.register_script(CLAIM_SCRIPT)
+        self._release = self.redis_client.register_script(RELEASE_SCRIPT)
+        self._renew = self.redis_client.register_script(RENEW_SCRIPT)
+
+
+    def publish(self, task_id: str, state: str, data: dict | None = None):
+        """
+        :param task_id: Celery task id the update concerns.
+        :param state: Celery task state, e.g. SUCCESS or FAILURE
+        :param data: Optional payload delivered with the update
+        """
+        self.redis_client.publish(JOB_CHANNEL, json.dumps({"taskId": task_id, "state": state, "data": data}))
+
+
+    def claim(self, key: str, task_id: str, expiration: int = 3600) -> str:
+        """
+        Register a task as the one computing key, unless another task already is.
+        :param key: Identifies the work, e.g. video hash, job type and parameters.
+        :param task_id: Id of the task that will be started if the claim succeeds.
+        :param expiration: Claim expiration time in seconds, in case the task is lost.
+        :return: Id of the task computing key, equal to task_id if the claim succeeded
+        """
+        owner = self._claim(keys=[f"inflight:{key}", f"inflight-task:{task_id}"], args=[task_id, expiration])
+        return owner.decode() if isinstance(owner, bytes) else str(owner)
+
+
+    def release(self, task_id: str):
+        """
+        Remove the claim held by a task, letting later requests start new work.
+        :param task_id: Id of the task that made the claim.
+        """
+        self._release(keys=[f"inflight-task:{task_id}"], args=[task_id])
+
+
+    def renew(self, task_id: str, expiration: int, extend_only: bool = False) -> bool:
+        """
+        Set the claim held by a task to expire in expiration seconds from now.
+        :param extend_only: Leave claims expiring later than that as they are
+        :return: False if the task holds no claim (anymore)
+        """
+        return bool(self._renew(keys=[f"inflight-task:{task_id}"], args=[task_id, expiration, int(extend_only)]))
+
+
+    def keep_alive(self, task_id: str, expiration: int = 60) -> Event:
+        """
+        Shorten the claim of a task that started running, and renew it in the background until the returned event
+        is set, so the claim of a task whose worker was killed expires soon instead of after the queueing time.
+        :param expiration: Seconds the claim outlives the last renewal, renewed every third of it
+        :return: Event to set once the task finished
+        """
+        stop = Event()
+        if not self.renew(task_id, expiration):
+            # e.g. started without a claim, or the claim expired while queued
+            stop.set()
+            return stop
+
+        # extending only, the task might hand its claim on to a queued task meanwhile, see get_objects
+        def renew():
+            while not stop.wait(expiration / 3):
+                try:
+                    if not self.renew(task_id, expiration, extend_only=True):
+                        return
+                except Exception as e:
+                    logger.warning(f"Could not renew the claim of {task_id}: {e}")
+
+        Thread(target=renew, name=f"claim-{task_id}", daemon=True).start()
+        return stop
+
+
+    def count_progress(self, task_id: str, parts: int, expiration: int = 3600) -> int:
+        """
+        Count one more finished part of a task split into parts, e.g. shards run as subtasks, announcing the progress
+        :param task_id: Id of the task the part belongs to
+        :param parts: Total number of parts
+        :return: Number of parts finished
+        """
+        key = f"progress:{task_id}"
+
+        pipe = self.redis_client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, expiration)
+        done = pipe.execute()[0]
+
+        self.publish(task_id, "PROGRESS", {"progress": done / parts, "partsDone": done, "parts": parts})
+        return done
+
+
+    def queue_depths(self) -> dict[str, int]:
+        """
+        :return: Tasks waiting per celery queue, not counting those prefetched by workers
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        for queue in QUEUES:
+            for p in PRIORITY_STEPS:
+                pipe.llen(f"{queue}:{p}" if p else queue)
+
+        lengths = pipe.execute()
+        n = len(PRIORITY_STEPS)
+        return {queue: sum(lengths[i * n:(i + 1) * n]) for i, queue in enumerate(QUEUES)}
+
@@ -0,0 +1,151 @@
+"""
+Prometheus metrics, and stage timings of tasks correlated by celery task id and video.
+Workers and webservers run several processes, so when PROMETHEUS_MULTIPROC_DIR is set (see backend-entrypoint.sh),
+every process writes its metrics there and scrapes aggregate over all of them.
+"""
+import os
+import logging
+from time import perf_counter
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, \
+    generate_latest, multiprocess, start_http_server
+
+
+logger = logging.getLogger("veridash")
+
+# from a few milliseconds of db work to tens of minutes of transcription
+BUCKETS = (0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, float("inf"))
+
+STAGE_SECONDS = Histogram("veridash_stage_seconds", "Time spent in a stage of a task", ["task", "stage"],
+                          buckets=BUCKETS)
+STAGE_ERRORS = Counter("veridash_stage_errors", "Stages that raised", ["task", "stage"])
+TASK_SECONDS = Histogram("veridash_task_seconds", "Worker task run time", ["task", "state"], buckets=BUCKETS)
+STORAGE_BYTES = Counter("veridash_storage_bytes", "Bytes moved to and from object storage", ["direction"])
+LOCK_WAIT_SECONDS = Histogram("veridash_lock_wait_seconds", "Time waited for locks and semaphores", ["lock"],
+                              buckets=BUCKETS)
+MODEL_CACHE_EVENTS = Counter("veridash_model_cache_events", "Models served from the cache, loaded and evicted",
+                             ["model", "event"])
+MODEL_LOAD_SECONDS = Counter("veridash_model_load_seconds", "Time spent loading models", ["model"])
+LOCAL_CACHE_EVENTS = Counter("veridash_local_cache_events", "Local file cache hits, misses and evictions", ["event"])
+LOCAL_CACHE_EVICTED_BYTES = Counter("veridash_local_cache_evicted_bytes", "Bytes evicted from the local file cache")
+
+JOB_SECONDS = Histogram("veridash_job_seconds", "Time from a job being requested until its result is sent",
+                        ["job", "state"], buckets=BUCKETS)
+CONNECTIONS = Gauge("veridash_websocket_connections", "Open websocket connections", multiprocess_mode="livesum")
+QUEUE_DEPTH = Gauge("veridash_queue_depth", "Tasks waiting in a celery queue", ["queue"], multiprocess_mode="max")
+EVENT_LOOP_LAG = Histogram("veridash_event_loop_lag_seconds", "How late periodic wakeups of the event loop fire",
+                           buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, float("inf")))
+
+
+@dataclass
+class TaskTrace:
+    task: str
+    task_id: str
+    video: str | None
+    start: float = field(default_factory=perf_counter)
+    # (stage, seconds since the task started, duration), in the order stages finished
+    spans: list[tuple[str, float, float]] = field(default_factory=list)
+
+
+_trace: ContextVar[TaskTrace | None] = ContextVar("veridash_trace", default=None)
+
+
+def begin_task(task: str, task_id: str, video: str | None) -> TaskTrace:
+    """
+    Start collecting the stages of a task run in this thread
+    :param task: Short task name, used as a label
+    """
+    trace = TaskTrace(task, task_id, video)
+    _trace.set(trace)
+    return trace
+
+
+def end_task(state: str) -> TaskTrace | None:
+    """
+    :return: The trace of the task run in this thread, logged as one line
+    """
+    trace = _trace.get()
+    if trace is None:
+        return None
+    _trace.set(None)
+
+    elapsed = perf_counter() - trace.start
+    TASK_SECONDS.labels(trace.task, state).observe(elapsed)
+
+    spans = ", ".join(f"{name} {seconds:.2f}s" for name, _, seconds in trace.spans)
+    logger.info(f"{trace.task} {trace.task_id} video={trace.video} {state} in {elapsed:.2f}s: {spans or 'no stages'}")
+
+    return trace
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a stage, attributed to the task running in this thread, if any
+    :param name: Stage label, keep these few
+    """
+    trace = _trace.get()
+    task = trace.task if trace else "none"
+
+    start = perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(task, name).inc()
+        raise
+    finally:
+        elapsed = perf_counter() - start
+        STAGE_SECONDS.labels(task, name).observe(elapsed)
+
+        if trace is not None:
+            trace.spans.append((name, start - trace.start, elapsed))
+
+
+def traced(name: str):
+    """
+    Decorator timing every call as a stage
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def registry() -> CollectorRegistry:
+    """
+    :return: Registry over all processes writing to PROMETHEUS_MULTIPROC_DIR, or this process only if unset
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+
+    reg = CollectorRegistry()
+    multiprocess.MultiProcessCollector(reg)
+    return reg
+
+
+def render() -> tuple[bytes, str]:
+    """
+    :return: Exposition body and its content type
+    """
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def serve(port: int):
+    """
+    Expose metrics over http from a background thread, e.g. in the celery main process
+    """
+    start_http_server(port, registry=registry())
+
+
+def process_exited(pid: int):
+    """
+    Drop live gauges of an exited process
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
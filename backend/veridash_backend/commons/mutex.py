@@ -1,9 +1,137 @@
-from time import sleep
+import logging
+from uuid import uuid4
+from time import monotonic
+from threading import Thread, Event, Lock
 from contextlib import contextmanager
 from redis import Redis
+from veridash_backend.commons.metrics import stage, LOCK_WAIT_SECONDS
 from veridash_backend.commons.settings import Settings
 
 
+logger = logging.getLogger("veridash")
+
+# deletes the lock only if ARGV[1] still owns it, waking one waiter
+UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+
+redis.call('DEL', KEYS[1])
+redis.call('RPUSH', KEYS[2], 1)
+redis.call('PEXPIRE', KEYS[2], 10000)
+return 1
+"""
+
+# KEYS: holders (token -> units), leases (token -> expiry), queue (token -> order), waiting (token -> expiry), fence
+# ARGV: token, units, capacity, lease ms, wake key prefix, order, waiter ttl ms
+# enqueues ARGV[1] if needed, and returns a fencing token if it was granted the units, else 0
+SEMAPHORE_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+-- forget holders and waiters that stopped renewing, e.g. crashed workers
+for _, x in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('HDEL', KEYS[1], x)
+    redis.call('ZREM', KEYS[2], x)
+end
+for _, x in ipairs(redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', now)) do
+    redis.call('ZREM', KEYS[3], x)
+    redis.call('ZREM', KEYS[4], x)
+end
+
+redis.call('ZADD', KEYS[3], 'NX', ARGV[6], ARGV[1])
+redis.call('ZADD', KEYS[4], now + tonumber(ARGV[7]), ARGV[1])
+
+-- strictly in queue order, so large requests are not starved by small ones
+if redis.call('ZRANGE', KEYS[3], 0, 0)[1] ~= ARGV[1] then
+    return 0
+end
+
+local used = 0
+for _, x in ipairs(redis.call('HVALS', KEYS[1])) do
+    used = used + tonumber(x)
+end
+if used + tonumber(ARGV[2]) > tonumber(ARGV[3]) then
+    return 0
+end
+
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[4]), ARGV[1])
+
+-- there might be capacity left for the next in line
+local head = redis.call('ZRANGE', KEYS[3], 0, 0)[1]
+if head then
+    redis.call('RPUSH', ARGV[5] .. head, 1)
+    redis.call('PEXPIRE', ARGV[5] .. head, ARGV[7])
+end
+
+return redis.call('INCR', KEYS[5])
+"""
+
+# KEYS: holders, leases, queue, waiting
+# ARGV: token, wake key prefix, waiter ttl ms
+# gives up the units held, or the place in the queue, and wakes the next in line
+SEMAPHORE_RELEASE_SCRIPT = """
+local held = redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('DEL', ARGV[2] .. ARGV[1])
+
+local head = redis.call('ZRANGE', KEYS[3], 0, 0)[1]
+if head then
+    redis.call('RPUSH', ARGV[2] .. head, 1)
+    redis.call('PEXPIRE', ARGV[2] .. head, ARGV[3])
+end
+return held
+"""
+
+# KEYS: holders, leases
+# ARGV: token, lease ms
+# returns 0 if the lease was already lost
+SEMAPHORE_RENEW_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), ARGV[1])
+return 1
+"""
+
+# waiters refresh their place in the queue at least this often, or lose it
+WAITER_TTL_MS = 10_000
+
+
+class LeaseLost(RuntimeError):
+    pass
+
+
+class Lease:
+    """
+    Units held on a semaphore. The fencing token increases with every grant, so anything guarded by the
+    semaphore can reject a holder whose lease has expired in the meantime.
+    """
+    def __init__(self, name: str, token: str, fence: int):
+        self.name = name
+        self.token = token
+        self.fence = fence
+        # set if renewing failed, the units might have been handed to someone else
+        self.lost = Event()
+
+
+    def check(self):
+        """
+        Call between units of work done under the lease, e.g. batches on the gpu
+        :raises LeaseLost: If the units might have been handed to someone else
+        """
+        if self.lost.is_set():
+            raise LeaseLost(f"Lost lease on {self.name} (fence {self.fence})")
+
+
 class LockManager:
     """
     Redis-based helper class to ensure single access to resources
@@ -12,6 +140,14 @@ class LockManager:
         settings = Settings()
 
         self.redis_client = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+        self._unlock = self.redis_client.register_script(UNLOCK_SCRIPT)
+        self._sem_acquire = self.redis_client.register_script(SEMAPHORE_ACQUIRE_SCRIPT)
+        self._sem_release = self.redis_client.register_script(SEMAPHORE_RELEASE_SCRIPT)
+        self._sem_renew = self.redis_client.register_script(SEMAPHORE_RENEW_SCRIPT)
+
+        # semaphore name -> wait statistics of this process
+        self._wait_stats: dict[str, dict[str, float]] = {}
+        self._stats_lock = Lock()
 
 
     def acquire_lock(self, lock_name: str, data: str="TAKEN", expiration: int | None=3600) -> tuple[bool, str]:
@@ -24,14 +160,18 @@ class LockManager:
         x = self.redis_client.set(lock_name, data, nx=True, ex=expiration, get=True)
         if x is None:
             return (True, data)
-        return (False, str(x))
+        return (False, x.decode() if isinstance(x, bytes) else str(x))
 
 
-    def release_lock(self, lock_name: str):
+    def release_lock(self, lock_name: str, data: str | None = None):
         """
         :param lock_name: Unique lock identifier.
+        :param data: Lock data given when acquiring, the lock is only released if it still holds this
         """
-        self.redis_client.delete(lock_name)
+        if data is None:
+            self.redis_client.delete(lock_name)
+        else:
+            self._unlock(keys=[lock_name, f"{lock_name}:wake"], args=[data])
 
 
     @contextmanager
@@ -43,13 +183,111 @@ class LockManager:
         :param expiration: Lock expiration time in seconds (None to never expire).
         :return: literal True on ownership acquired
         """
+        # unique, so an expired owner never releases the lock of the next one
+        token = f"{data}:{uuid4()}"
+
+        # locks are named after what they protect, e.g. download:<object>, timings go by the kind
+        kind = lock_name.split(":")[0]
+
         owning = False
-        while not owning:
-            owning, _ = self.acquire_lock(lock_name, data, expiration)
-            sleep(0.1)
+        start = monotonic()
+        with stage(f"wait:{kind}"):
+            while True:
+                owning, _ = self.acquire_lock(lock_name, token, expiration)
+                if owning:
+                    break
+
+                # woken up on release, the timeout covers owners that expired instead
+                self.redis_client.blpop([f"{lock_name}:wake"], timeout=1)
+        self._record_wait(kind, monotonic() - start)
 
         try:
             yield owning
         finally:
-            self.release_lock(lock_name)
+            self.release_lock(lock_name, token)
+
+
+    @contextmanager
+    def semaphore(self, name: str, units: int = 1, capacity: int = 1, priority: int = 0, lease: int = 60,
+                  timeout: float | None = None):
+        """
+        Wait for units of a counting semaphore, e.g. megabytes of GPU memory, granted in priority then arrival order.
+        The lease is renewed in the background until the context exits, so it only expires if the process dies.
+        :param name: Unique semaphore identifier, e.g. gpu:<node>:<device>, timings go by the part before the first colon.
+        :param units: Units needed.
+        :param capacity: Total units available, all users of the semaphore should agree on it.
+        :param priority: Waiters with a higher priority are served first.
+        :param lease: Lease time in seconds, renewed every third of it.
+        :param timeout: Seconds to wait at most (None to wait forever).
+        :return: The Lease held, check it between units of work, as the work is not interrupted if it is lost
+        """
+        if units > capacity:
+            raise ValueError(f"Requested {units} units of {name}, which only has {capacity}")
+
+        keys = [f"semaphore:{name}:{x}" for x in ("holders", "leases", "queue", "waiting", "fence")]
+        wake = f"semaphore:{name}:wake:"
+        token = str(uuid4())
+        lease_ms = lease * 1000
+        kind = name.split(":")[0]
+
+        # scores are doubles, exact up to 2**53
+        order = -priority * 2**40 + self.redis_client.incr(f"semaphore:{name}:seq")
+
+        start = monotonic()
+        try:
+            with stage(f"wait:{kind}"):
+                while True:
+                    fence = self._sem_acquire(keys=keys, args=[token, units, capacity, lease_ms, wake, order,
+                                                               WAITER_TTL_MS])
+                    if fence:
+                        break
+
+                    if timeout is not None and monotonic() - start > timeout:
+                        raise TimeoutError(f"Timed out waiting for {units} units of {name}")
+
+                    # woken up when units are released, the timeout covers holders that expired instead
+                    self.redis_client.blpop([wake + token], timeout=1)
+        except BaseException:
+            self._sem_release(keys=keys[:4], args=[token, wake, WAITER_TTL_MS])
+            raise
+
+        self._record_wait(kind, monotonic() - start)
+        held = Lease(name, token, int(fence))
+
+        stop = Event()
+        def renew():
+            while not stop.wait(lease / 3):
+                if not self._sem_renew(keys=keys[:2], args=[token, lease_ms]):
+                    logger.error(f"Lost lease on {name} (fence {held.fence})")
+                    held.lost.set()
+                    return
+
+        renewer = Thread(target=renew, name=f"semaphore-{name}", daemon=True)
+        renewer.start()
+
+        try:
+            yield held
+        finally:
+            stop.set()
+            renewer.join()
+            self._sem_release(keys=keys[:4], args=[token, wake, WAITER_TTL_MS])
+
+
+    def wait_stats(self) -> dict[str, dict[str, float]]:
+        """
+        :return: Per semaphore and kind of lock in this process: acquisitions, total and max wait in seconds
+        """
+        with self._stats_lock:
+            return {k: dict(v) for k, v in self._wait_stats.items()}
+
+
+    def _record_wait(self, name: str, waited: float):
+        with self._stats_lock:
+            stats = self._wait_stats.setdefault(name, {"acquired": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0})
+            stats["acquired"] += 1
+            stats["wait_seconds"] += waited
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+        LOCK_WAIT_SECONDS.labels(name).observe(waited)
 
+        if waited > 1:
+            logger.info(f"Waited {waited:.1f}s for {name}")
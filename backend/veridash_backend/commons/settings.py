@@ -1,4 +1,5 @@
 import os
+import socket
 import logging
 from dotenv import load_dotenv
 
@@ -8,6 +9,8 @@ class Settings:
         load_dotenv()
 
         self.TEMP_STORAGE_DIR = Settings.get_env_or_error("TEMP_STORAGE_DIR")
+        # budget for downloaded objects and artefacts derived from them, 0 disables the budget
+        self.LOCAL_CACHE_MB = int(Settings.get_env_or_default("LOCAL_CACHE_MB", "20480"))
 
         try:
             self.OPENAI_ORG = Settings.get_env_or_error("OPENAI_ORG")
@@ -18,7 +21,20 @@ class Settings:
             logging.warning("No OpenAI credentials configured. Features will be limited")
             self.HAS_OPENAI = False
 
+        # e.g. a local stub of the OpenAI API, None for the real one
+        self.OPENAI_BASE_URL = Settings.get_env_or_default("OPENAI_BASE_URL", "") or None
+        self.TRANSLATION_MODEL = Settings.get_env_or_default("TRANSLATION_MODEL", "gpt-4o")
+        # input tokens per translation request, and requests in flight per task
+        self.TRANSLATION_CHUNK_TOKENS = int(Settings.get_env_or_default("TRANSLATION_CHUNK_TOKENS", "2000"))
+        self.TRANSLATION_CONCURRENCY = int(Settings.get_env_or_default("TRANSLATION_CONCURRENCY", "4"))
+
         self.POSTGRES_CONN_STR = Settings.get_env_or_error("POSTGRES_CONN_STR")
+        # connections per process, every worker child and webserver process has its own pool, so the totals over
+        # all of them (e.g. 16 io + nproc cpu + 2 gpu worker children, 8 webservers) must stay within max_connections
+        self.POSTGRES_POOL_MIN = int(Settings.get_env_or_default("POSTGRES_POOL_MIN", "1"))
+        self.POSTGRES_POOL_MAX = int(Settings.get_env_or_default("POSTGRES_POOL_MAX", "2"))
+        # the webserver handles many messages per process at once
+        self.POSTGRES_WEBSERVER_POOL_MAX = int(Settings.get_env_or_default("POSTGRES_WEBSERVER_POOL_MAX", "4"))
 
         self.REDIS_HOST = Settings.get_env_or_error("REDIS_HOST")
         self.REDIS_PORT = int(Settings.get_env_or_error("REDIS_PORT"))
@@ -30,6 +46,86 @@ class Settings:
         self.MINIO_USER = Settings.get_env_or_error("MINIO_USER")
         self.MINIO_PASS = Settings.get_env_or_error("MINIO_PASS")
         self.MINIO_BUCKET = Settings.get_env_or_error("MINIO_BUCKET")
+        self.STORAGE_UPLOAD_CONCURRENCY = int(Settings.get_env_or_default("STORAGE_UPLOAD_CONCURRENCY", "16"))
+        # seconds, S3 allows at most 7 days
+        self.PRESIGNED_URL_EXPIRY = int(Settings.get_env_or_default("PRESIGNED_URL_EXPIRY", "604800"))
+        self.FILE_EXISTS_CACHE_SECONDS = int(Settings.get_env_or_default("FILE_EXISTS_CACHE_SECONDS", "30"))
+        # stalled reads while probing over a presigned url give up after this, falling back to a download
+        self.PROBE_TIMEOUT_SECONDS = int(Settings.get_env_or_default("PROBE_TIMEOUT_SECONDS", "30"))
+
+        # identical requests attach to a running job until it finishes, or until its worker stopped renewing
+        # the claim for this long (e.g. killed), queued jobs keep their claim for the queued time
+        self.JOB_CLAIM_TTL_SECONDS = int(Settings.get_env_or_default("JOB_CLAIM_TTL_SECONDS", "60"))
+        self.JOB_QUEUED_TTL_SECONDS = int(Settings.get_env_or_default("JOB_QUEUED_TTL_SECONDS", "3600"))
+
+        # threads the webserver runs blocking client calls (storage, celery) on, per process
+        self.WEBSERVER_BLOCKING_THREADS = int(Settings.get_env_or_default("WEBSERVER_BLOCKING_THREADS", "32"))
+        # messages handled concurrently per websocket, further messages are left unread until one finishes
+        self.WEBSOCKET_MAX_INFLIGHT = int(Settings.get_env_or_default("WEBSOCKET_MAX_INFLIGHT", "4"))
+        self.EVENT_LOOP_LAG_WARN_MS = int(Settings.get_env_or_default("EVENT_LOOP_LAG_WARN_MS", "100"))
+        # prometheus metrics of the celery workers are served here, 0 disables (the webserver serves /metrics)
+        self.WORKER_METRICS_PORT = int(Settings.get_env_or_default("WORKER_METRICS_PORT", "9808"))
+
+        self.WHISPER_MODEL = Settings.get_env_or_default("WHISPER_MODEL", "medium")
+        self.YOLO_WEIGHTS = Settings.get_env_or_default("YOLO_WEIGHTS", "../weights/yolov8x-worldv2.pt")
+        # per worker process, 0 disables the budget
+        self.MODEL_CACHE_RAM_MB = int(Settings.get_env_or_default("MODEL_CACHE_RAM_MB", "8192"))
+        self.MODEL_CACHE_VRAM_MB = int(Settings.get_env_or_default("MODEL_CACHE_VRAM_MB", "4096"))
+
+        # processes on one machine share its gpus (and local files), so they must agree on this, e.g. containers
+        self.NODE_NAME = Settings.get_env_or_default("NODE_NAME", "") or socket.gethostname()
+        # comma separated gpus the processes of a worker are spread over, e.g. "0,1", empty to use the visible ones
+        self.GPU_DEVICES = Settings.get_env_or_default("GPU_DEVICES", "")
+        # every gpu is shared as a semaphore counting megabytes of it. resident models hold what their weights take
+        # (*_GPU_MB) until evicted, and tasks wait until their working memory (*_WORK_MB) fits. it must hold the
+        # MODEL_CACHE_VRAM_MB of every process on the gpu plus the largest working memory, or tasks wait on each
+        # other's resident models forever
+        self.GPU_MEMORY_MB = int(Settings.get_env_or_default("GPU_MEMORY_MB", "8192"))
+        self.WHISPER_GPU_MB = int(Settings.get_env_or_default("WHISPER_GPU_MB", "3072"))
+        self.YOLO_GPU_MB = int(Settings.get_env_or_default("YOLO_GPU_MB", "512"))
+        self.EMBEDDER_GPU_MB = int(Settings.get_env_or_default("EMBEDDER_GPU_MB", "128"))
+        self.WHISPER_WORK_MB = int(Settings.get_env_or_default("WHISPER_WORK_MB", "2048"))
+        self.YOLO_WORK_MB = int(Settings.get_env_or_default("YOLO_WORK_MB", "2560"))
+        self.EMBEDDER_WORK_MB = int(Settings.get_env_or_default("EMBEDDER_WORK_MB", "896"))
+
+        self.EMBEDDING_BATCH_SIZE = int(Settings.get_env_or_default("EMBEDDING_BATCH_SIZE", "64"))
+        # results of a similarity search, and candidates the hnsw index considers for them (more is slower, but better).
+        # users whose images are too few among the candidates get an exact search over their images instead
+        self.SIMILAR_RESULTS = int(Settings.get_env_or_default("SIMILAR_RESULTS", "20"))
+        self.SIMILAR_EF_SEARCH = int(Settings.get_env_or_default("SIMILAR_EF_SEARCH", "100"))
+
+        # audio is transcribed, and partial results published, window by window
+        self.TRANSCRIPTION_CHUNK_SECONDS = float(Settings.get_env_or_default("TRANSCRIPTION_CHUNK_SECONDS", "30"))
+
+        self.DETECTION_BATCH_SIZE = int(Settings.get_env_or_default("DETECTION_BATCH_SIZE", "16"))
+        # videos with more keyframes than this are detected in shards of this many, in parallel
+        self.DETECTION_SHARD_FRAMES = int(Settings.get_env_or_default("DETECTION_SHARD_FRAMES", "200"))
+
+        # videos are fingerprinted by the perceptual hashes of up to this many keyframes
+        self.FINGERPRINT_FRAMES = int(Settings.get_env_or_default("FINGERPRINT_FRAMES", "64"))
+        # keyframe hash distance at which frames look alike (at most 3, see fingerprint.py), and fraction and number of
+        # frames that must, for a near-duplicate of the same owner. their lengths may differ by a fraction too
+        self.NEAR_DUPLICATE_DISTANCE = int(Settings.get_env_or_default("NEAR_DUPLICATE_DISTANCE", "3"))
+        self.NEAR_DUPLICATE_MIN_SCORE = float(Settings.get_env_or_default("NEAR_DUPLICATE_MIN_SCORE", "0.6"))
+        self.NEAR_DUPLICATE_MIN_FRAMES = int(Settings.get_env_or_default("NEAR_DUPLICATE_MIN_FRAMES", "5"))
+        self.NEAR_DUPLICATE_DURATION_TOLERANCE = float(
+            Settings.get_env_or_default("NEAR_DUPLICATE_DURATION_TOLERANCE", "0.05"))
+
+        # megapixels stitching registers frames, finds seams and composes the panorama at (-1 for full resolution).
+        # only registration differs from OpenCV's defaults (0.6), and gains little (see benchmarks/stitching.py).
+        # composing below full resolution is faster, but lowers the quality of the panorama
+        self.STITCH_REGISTRATION_MPX = float(Settings.get_env_or_default("STITCH_REGISTRATION_MPX", "0.3"))
+        self.STITCH_SEAM_MPX = float(Settings.get_env_or_default("STITCH_SEAM_MPX", "0.1"))
+        self.STITCH_COMPOSE_MPX = float(Settings.get_env_or_default("STITCH_COMPOSE_MPX", "-1"))
+
+        # "scene" samples keyframes on scene changes, "fixed" at KEYFRAME_MAX_FPS
+        self.KEYFRAME_SAMPLING = Settings.get_env_or_default("KEYFRAME_SAMPLING", "scene")
+        # keyframes are taken at least every 1/KEYFRAME_MIN_FPS seconds, 0 takes them on scene changes only
+        self.KEYFRAME_MIN_FPS = float(Settings.get_env_or_default("KEYFRAME_MIN_FPS", "0.1"))
+        self.KEYFRAME_MAX_FPS = float(Settings.get_env_or_default("KEYFRAME_MAX_FPS", "1"))
+        self.KEYFRAME_SCENE_THRESHOLD = float(Settings.get_env_or_default("KEYFRAME_SCENE_THRESHOLD", "0.3"))
+        # max perceptual hash distance (0-64) at which consecutive keyframes count as duplicates, -1 disables
+        self.KEYFRAME_DEDUP_DISTANCE = int(Settings.get_env_or_default("KEYFRAME_DEDUP_DISTANCE", "5"))
 
 
     @classmethod
@@ -40,3 +136,12 @@ class Settings:
 
         return x
 
+
+    @classmethod
+    def get_env_or_default(cls, name: str, default: str) -> str:
+        x = os.getenv(name)
+        if x is None:
+            return default
+
+        return x
+
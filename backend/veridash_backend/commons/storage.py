@@ -1,5 +1,15 @@
 import os
+import certifi
+import urllib3
+from io import BytesIO
+from datetime import timedelta
+from contextlib import contextmanager
+from typing import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from minio import Minio
+from minio.error import S3Error
+from veridash_backend.commons.cache import LocalCache, ExpiringCache
+from veridash_backend.commons.metrics import stage, STORAGE_BYTES
 from veridash_backend.commons.settings import Settings
 
 
@@ -7,11 +17,30 @@ class StorageManager:
     def __init__(self):
         self.settings = Settings()
 
+        # same as the minio defaults, but with enough pooled connections for concurrent uploads to reuse them
+        timeout = timedelta(minutes=5).seconds
+        http_client = urllib3.PoolManager(
+            timeout=urllib3.Timeout(connect=timeout, read=timeout),
+            maxsize=max(10, self.settings.STORAGE_UPLOAD_CONCURRENCY),
+            cert_reqs="CERT_REQUIRED",
+            ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+            retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        )
+
         self._client = Minio(self.settings.MINIO_HOST,
             access_key=self.settings.MINIO_USER,
             secret_key=self.settings.MINIO_PASS,
             secure=self.settings.MINIO_SECURE,
+            http_client=http_client,
         )
+        self._upload_pool = ThreadPoolExecutor(max_workers=self.settings.STORAGE_UPLOAD_CONCURRENCY)
+
+        self.cache = LocalCache(os.path.join(self.settings.TEMP_STORAGE_DIR, "cache"),
+                                self.settings.LOCAL_CACHE_MB * 2**20)
+
+        self._url_expiry = timedelta(seconds=self.settings.PRESIGNED_URL_EXPIRY)
+        self._download_urls = ExpiringCache()
+        self._existing = ExpiringCache()
 
         assert self._client.bucket_exists(self.settings.MINIO_BUCKET), \
             f"{self.settings.MINIO_BUCKET} bucket does not exist"
@@ -22,31 +51,97 @@ class StorageManager:
 
 
     def get_object_download_url(self, object_name: str) -> str | None:
-        return self._client.get_presigned_url("GET", self.settings.MINIO_BUCKET, object_name)
+        """
+        Presigned download url, reused while more than half of its validity remains
+        """
+        url = self._download_urls.get(object_name)
+        if url is None:
+            url = self._client.get_presigned_url("GET", self.settings.MINIO_BUCKET, object_name,
+                                                 expires=self._url_expiry)
+            self._download_urls.put(object_name, url, self._url_expiry.total_seconds() / 2)
+
+        return url
 
 
     def file_exists(self, object_name: str) -> bool:
-        return len(list(self._client.list_objects(self.settings.MINIO_BUCKET, prefix=object_name))) == 1
+        """
+        Check existence with a single stat, remembering objects found for a short while
+        """
+        if self._existing.get(object_name):
+            return True
+
+        try:
+            self._client.stat_object(self.settings.MINIO_BUCKET, object_name)
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchObject"):
+                return False
+            raise
 
+        self._existing.put(object_name, True, self.settings.FILE_EXISTS_CACHE_SECONDS)
+        return True
 
-    def download_file(self, object_name: str, local_filename: str | None = None) -> str:
+
+    @contextmanager
+    def local_copy(self, object_name: str, on_chunk: Callable[[bytes], None] | None = None) -> Iterator[str]:
         """
-        Download object, short circuit if already in filesystem
+        Get a local copy of an object from the cache, downloading it on a miss.
+        The file is pinned in the cache until the context exits.
         :param object_name: Name of the file in the veridash bucket
-        :param local_filename: Optional local location to put/check for the file. Defaults to /tmp/[object_name]
+        :param on_chunk: Called with the bytes as they are downloaded, in order, e.g. to hash them. Not called on a hit
         :returns: Local file path
         """
-        if not local_filename:
-            local_filename = os.path.join(self.settings.TEMP_STORAGE_DIR, object_name)
+        with self.cache.get(object_name, lambda p: self._download(object_name, p, on_chunk)) as local_filename:
+            yield local_filename
+
+
+    def is_cached(self, object_name: str) -> bool:
+        """
+        Whether a local copy exists, which might still be evicted before it is used
+        """
+        return os.path.exists(self.cache.path(object_name))
 
-        if not os.path.exists(local_filename):
-            self._client.fget_object(self.settings.MINIO_BUCKET, object_name, local_filename)
 
-        return local_filename
+    def _download(self, object_name: str, local_filename: str, on_chunk: Callable[[bytes], None] | None = None):
+        with stage("download"):
+            response = self._client.get_object(self.settings.MINIO_BUCKET, object_name)
+            try:
+                with open(local_filename, "wb") as f:
+                    for chunk in response.stream(1_000_000):
+                        f.write(chunk)
+                        STORAGE_BYTES.labels("download").inc(len(chunk))
 
+                        if on_chunk is not None:
+                            on_chunk(chunk)
+            finally:
+                response.close()
+                response.release_conn()
 
-    def upload_file(self, object_name: str, local_filename: str):
-        self._client.fput_object(self.settings.MINIO_BUCKET, object_name, local_filename)
+
+    def upload_bytes(self, object_name: str, data: bytes, content_type: str = "application/octet-stream"):
+        self._client.put_object(self.settings.MINIO_BUCKET, object_name, BytesIO(data), len(data),
+                                content_type=content_type)
+        STORAGE_BYTES.labels("upload").inc(len(data))
+
+
+    def upload_many(self, objects: list[tuple[str, bytes | str]], content_type: str = "application/octet-stream") -> list[str]:
+        """
+        Upload objects concurrently over pooled connections
+        :param objects: Tuples of (object name, data), where data is either bytes or a local file path
+        :param content_type: Content type of all the objects
+        :returns: Presigned download urls, in the same order as objects
+        """
+        def upload(obj: tuple[str, bytes | str]) -> str:
+            object_name, data = obj
+            if isinstance(data, str):
+                with open(data, "rb") as f:
+                    data = f.read()
+
+            self.upload_bytes(object_name, data, content_type)
+            return self.get_object_download_url(object_name)
+
+        # timed as a whole, the upload threads are not part of the task's trace
+        with stage("upload"):
+            return list(self._upload_pool.map(upload, objects))
 
 
 if __name__ == "__main__":
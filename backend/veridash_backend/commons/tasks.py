@@ -0,0 +1,59 @@
+"""
+The celery app and task signatures, referring to tasks by name only.
+Importing this does not import the worker, so the webserver never loads the models or the libraries behind them.
+"""
+from kombu import Queue
+from celery import Celery
+from veridash_backend.commons.jobs import QUEUES, PRIORITY_STEPS
+from veridash_backend.commons.settings import Settings
+
+
+settings = Settings()
+
+app = Celery("worker", broker=settings.REDIS_CONN_STR, backend=settings.REDIS_CONN_STR,
+             broker_connection_retry_on_startup=True, result_expires=3600)
+
+# names the tasks are registered under, by veridash_backend.worker.app
+METADATA = "veridash_backend.worker.app.get_metadata"
+COORDINATES = "veridash_backend.worker.app.get_coordinates"
+TRANSCRIPTION = "veridash_backend.worker.app.get_transcription"
+KEYFRAMES = "veridash_backend.worker.app.get_keyframes"
+OBJECTS = "veridash_backend.worker.app.get_objects"
+STITCH = "veridash_backend.worker.app.get_stitch"
+# parts of get_objects on long videos
+DETECT_SHARD = "veridash_backend.worker.app.detect_shard"
+MERGE_DETECTIONS = "veridash_backend.worker.app.merge_detections"
+DETECTION_FAILED = "veridash_backend.worker.app.detection_failed"
+
+# io: probing and light lookups, cpu: decoding and stitching, gpu: model inference.
+# workers are started per queue (see backend-entrypoint.sh), so quick tasks never wait behind the gpu
+app.conf.task_queues = tuple(Queue(x) for x in QUEUES)
+app.conf.task_default_queue = "cpu"
+# 0 is served first
+app.conf.task_routes = {
+    METADATA: {"queue": "io", "priority": 0},
+    COORDINATES: {"queue": "io", "priority": 0},
+    KEYFRAMES: {"queue": "cpu", "priority": 3},
+    STITCH: {"queue": "cpu", "priority": 5},
+    OBJECTS: {"queue": "gpu", "priority": 3},
+    DETECT_SHARD: {"queue": "gpu", "priority": 3},
+    MERGE_DETECTIONS: {"queue": "io", "priority": 0},
+    DETECTION_FAILED: {"queue": "io", "priority": 0},
+    TRANSCRIPTION: {"queue": "gpu", "priority": 5},
+}
+app.conf.task_default_priority = 5
+app.conf.broker_transport_options = {
+    "priority_steps": PRIORITY_STEPS,
+    "sep": ":",
+    "queue_order_strategy": "priority",
+}
+# long tasks, so a worker never holds on to tasks an idle worker could start (overridden for io workers)
+app.conf.worker_prefetch_multiplier = 1
+
+# called with the video name, followed by any task specific arguments
+get_metadata = app.signature(METADATA)
+get_coordinates = app.signature(COORDINATES)
+get_transcription = app.signature(TRANSCRIPTION)
+get_keyframes = app.signature(KEYFRAMES)
+get_objects = app.signature(OBJECTS)
+get_stitch = app.signature(STITCH)
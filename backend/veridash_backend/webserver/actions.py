@@ -1,17 +1,69 @@
+import json
+import asyncio
+import hashlib
+from uuid import uuid4
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from celery import Signature
 from werkzeug.utils import secure_filename
-from veridash_backend.commons.db import Database
+from veridash_backend.commons.db import AsyncDatabase
+from veridash_backend.commons.jobs import JobTracker, job_key
+from veridash_backend.commons.settings import Settings
 from veridash_backend.commons.storage import StorageManager
-from veridash_backend.worker.app import get_metadata, get_transcription, get_coordinates, get_keyframes, get_objects, \
-    get_stitch
+from veridash_backend.commons.tasks import get_metadata, get_transcription, get_coordinates, get_keyframes, \
+    get_objects, get_stitch
 
 
-db = Database()
+settings = Settings()
+db = AsyncDatabase()
 storage = StorageManager()
+jobs = JobTracker()
+
+# minio, celery and redis clients block, so their calls run here instead of on the event loop
+executor = ThreadPoolExecutor(max_workers=settings.WEBSERVER_BLOCKING_THREADS, thread_name_prefix="blocking")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(fn, *args, **kwargs))
 
 
 class Handler:
     @classmethod
-    def handle_message(cls, user_id: int, data: dict) -> dict | tuple | None:
+    async def start_job(cls, task: Signature, video_id: str, message_type: str, owner_id: int,
+                        params: list | None = None, content_hash: str | None = None) -> str:
+        """
+        Start a job, or attach to an identical one that is already running.
+        Jobs are identical when the video content, job type and parameters match.
+        :param task: Signature of the celery task computing the job, called with the video id followed by params
+        :param video_id: Object name of the video
+        :param message_type: Job type
+        :param owner_id: Owner of the video
+        :param params: Additional task arguments
+        :param content_hash: Hash of the video verified by a worker, jobs on the same bytes are shared across owners.
+                             None to share only the owner's jobs on this video, as client-supplied hashes prove nothing
+        :return: Id of the task computing the job
+        """
+        params = params or []
+        content_id = content_hash or f"{owner_id}:{video_id}"
+        params_digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+        task_id = str(uuid4())
+        owner = await run_blocking(jobs.claim, f"{content_id}:{message_type}:{params_digest}", task_id,
+                                   settings.JOB_QUEUED_TTL_SECONDS)
+        if owner != task_id:
+            return owner
+
+        try:
+            await run_blocking(task.apply_async, (video_id, *params), task_id=task_id)
+        except Exception:
+            await run_blocking(jobs.release, task_id)
+            raise
+
+        return task_id
+
+
+    @classmethod
+    async def handle_message(cls, user_id: int, data: dict) -> dict | tuple | None:
         if "messageType" not in data:
             raise KeyError("Expected messageType in data")
 
@@ -21,6 +73,9 @@ class Handler:
         if "sourceKeyFrames" not in data and data["messageType"] == "stitching":
             raise KeyError("Expected sourceKeyFrames in data")
 
+        if "imageId" not in data and data["messageType"] == "similar":
+            raise KeyError("Expected imageId in data")
+
         # handle source message
         if data["messageType"] == "source":
             file_name, file_hash = data["filename"].rsplit(':', maxsplit=1)
@@ -28,9 +83,14 @@ class Handler:
             if len(file_hash) != 64:
                 file_hash = None
 
-            obj_name = db.provision_object_name(user_id, file_name, file_hash)
-            upload_url = storage.get_object_upload_url(obj_name)
-            download_url = storage.get_object_download_url(obj_name)
+            # byte-identical content already uploaded is reused, along with everything computed from it
+            blob_name = await db.find_verified_blob(file_hash) if file_hash else None
+            if blob_name is not None and not await run_blocking(storage.file_exists, blob_name):
+                blob_name = None
+
+            obj_name = await db.provision_object_name(user_id, file_name, file_hash, blob_name)
+            upload_url = await run_blocking(storage.get_object_upload_url, obj_name) if blob_name is None else None
+            download_url = await run_blocking(storage.get_object_download_url, blob_name or obj_name)
 
             return {
                 "messageType": data["messageType"],
@@ -40,39 +100,87 @@ class Handler:
             }
 
         # if the video does not belong to the user, or is not uploaded, something is wrong
-        if not db.video_belongs_to_user(user_id, data["videoId"]) or not storage.file_exists(data["videoId"]):
+        video = await db.get_user_video(user_id, data["videoId"])
+        if video is None or not await run_blocking(storage.file_exists, video[0]):
             raise ValueError("The provided videoId does not belong to an uploaded video")
+        # only once verified, see start_job
+        _, content_hash = video
 
         # handle non-cacheable messages
         match data["messageType"]:
-            case "keyframes":  # TODO: add: , "objectdetection":
-                if data["messageType"] == "keyframes":
-                    img_names = db.get_images_by_video_name(data["videoId"])
-                else:
-                    img_names = db.get_detections_by_video_name(data["videoId"])
+            case "keyframes":
+                keyframes = await db.get_keyframes_by_video_name(data["videoId"])
+                urls = await run_blocking(lambda: [storage.get_object_download_url(n) for n, _ in keyframes])
 
                 presigned_urls = []
-                for n in img_names:
-                    u = storage.get_object_download_url(n)
+                timestamps = []
+                image_ids = []
+                for u, (n, ts) in zip(urls, keyframes):
                     if u is None:
                         continue
 
                     presigned_urls.append(u)
+                    timestamps.append(ts)
+                    image_ids.append(n)
 
                 if len(presigned_urls) != 0:
                     return {
                         "messageType": data["messageType"],
                         "videoId": data["videoId"],
                         "urls": presigned_urls,
+                        "timestamps": timestamps,
+                        "imageIds": image_ids,
+                    }
+            case "objectdetection":
+                # also when nothing was found, detection ran to completion
+                detections = await db.get_detections_by_video_name(data["videoId"])
+
+                if detections is not None:
+                    urls = await run_blocking(lambda: [storage.get_object_download_url(x[0]) for x in detections])
+                    return {
+                        "messageType": data["messageType"],
+                        "videoId": data["videoId"],
+                        "urls": urls,
+                        "keyFrameNumbers": [x[1] for x in detections],
+                        "classNames": [x[2] for x in detections],
+                        "confidences": [x[3] for x in detections],
+                        "imageIds": [x[0] for x in detections],
                     }
+            case "similar":
+                # frames like this one (or objects like this crop) across all of the user's videos
+                similar = await db.find_similar_images(user_id, data["imageId"], settings.SIMILAR_RESULTS,
+                                                       settings.SIMILAR_EF_SEARCH)
+                if similar is None:
+                    raise ValueError("The provided imageId does not belong to an embedded image")
+
+                urls = await run_blocking(lambda: [storage.get_object_download_url(x[0]) for x in similar])
+                return {
+                    "messageType": data["messageType"],
+                    "videoId": data["videoId"],
+                    "imageId": data["imageId"],
+                    "urls": urls,
+                    "imageIds": [x[0] for x in similar],
+                    "videoIds": [x[1] for x in similar],
+                    "frameNumbers": [x[2] for x in similar],
+                    "distances": [x[3] for x in similar],
+                }
             case "stitching":
-                # NOTE: might be cached, would require lookup based on identical source frames
-                # computing it every time for now...
-                task_id: str = get_stitch.apply_async((data["videoId"], data["sourceKeyFrames"])).id # ignore the error on this line
+                # identical stitches are cached per content and source frames, and shared while in flight
+                params = [sorted(data["sourceKeyFrames"])]
+                cached_result = await db.get_cached_results(data["videoId"], "stitching", job_key(params))
+                if cached_result and "objectName" in cached_result:
+                    url = await run_blocking(storage.get_object_download_url, cached_result["objectName"])
+                    return {
+                        "messageType": data["messageType"],
+                        "videoId": data["videoId"],
+                        **cached_result,
+                        "url": url,
+                    }
+
+                task_id = await cls.start_job(get_stitch, data["videoId"], "stitching", user_id, params, content_hash)
 
- 
         # Return cached results if exists
-        cached_result = db.get_cached_results(data["videoId"], data["messageType"])
+        cached_result = await db.get_cached_results(data["videoId"], data["messageType"])
         # NOTE: object detection too unstable at the moment
         if cached_result and data["messageType"] not in ("objectdetection", "stitching"):
             return {
@@ -84,15 +192,15 @@ class Handler:
         # might be cached
         match data["messageType"]:
             case "metadata":
-                task_id: str = get_metadata.apply_async((data["videoId"], )).id  # ignore the error on this line
+                task_id = await cls.start_job(get_metadata, data["videoId"], data["messageType"], user_id, content_hash=content_hash)
             case "transcription":
-                task_id: str = get_transcription.apply_async((data["videoId"], )).id  # ignore the error on this line
+                task_id = await cls.start_job(get_transcription, data["videoId"], data["messageType"], user_id, content_hash=content_hash)
             case "map":
-                task_id: str = get_coordinates.apply_async((data["videoId"], )).id # ignore the error on this line
-            case "keyframes":  # NOTE: this should never be served from cache
-                task_id: str = get_keyframes.apply_async((data["videoId"], )).id # ignore the error on this line
-            case "objectdetection":  # NOTE: this should never be served from cache
-                task_id: str = get_objects.apply_async((data["videoId"], )).id # ignore the error on this line
+                task_id = await cls.start_job(get_coordinates, data["videoId"], data["messageType"], user_id, content_hash=content_hash)
+            case "keyframes":  # NOTE: served from images above when present
+                task_id = await cls.start_job(get_keyframes, data["videoId"], data["messageType"], user_id, content_hash=content_hash)
+            case "objectdetection":  # NOTE: served from detected_objects above when present
+                task_id = await cls.start_job(get_objects, data["videoId"], data["messageType"], user_id, content_hash=content_hash)
             case "stitching":
                 pass
             case _:
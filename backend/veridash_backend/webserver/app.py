@@ -2,26 +2,48 @@ import uuid
 import json
 import logging
 import asyncio
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from celery.result import AsyncResult
-from .actions import Handler
-from veridash_backend.commons.db import Database
-from veridash_backend.worker.app import get_objects
+from time import monotonic
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Response
+from celery import states
+from .actions import Handler, db, executor, jobs, run_blocking
+from .monitor import LoopLagMonitor
+from .dispatcher import JobDispatcher
+from veridash_backend.commons import metrics
+from veridash_backend.commons.settings import Settings
 
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger("veridash")
 
 
-db = Database()
-app = FastAPI()
+settings = Settings()
+dispatcher = JobDispatcher()
+lag_monitor = LoopLagMonitor(warn_threshold=settings.EVENT_LOOP_LAG_WARN_MS / 1000)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.open()
+    await dispatcher.start()
+    await lag_monitor.start()
+    yield
+    await lag_monitor.stop()
+    await dispatcher.stop()
+    await db.close()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: dict[str, WebSocket] = {}
-        # connection id -> {message type -> (task id, video id)}
-        self.active_tasks: dict[str, dict[str, tuple[str, str]]] = {}
+        # connection id -> {task id -> (message type, video id, monotonic time requested)}
+        self.active_tasks: dict[str, dict[str, tuple[str, str, float]]] = {}
+        # connection id -> job updates pushed by the dispatcher
+        self.job_updates: dict[str, asyncio.Queue] = {}
 
 
     async def connect(self, websocket: WebSocket):
@@ -30,6 +52,8 @@ class ConnectionManager:
         client_id = str(uuid.uuid4())
         self.active_connections[client_id] = websocket
         self.active_tasks[client_id] = {}
+        self.job_updates[client_id] = asyncio.Queue()
+        metrics.CONNECTIONS.inc()
 
         logger.debug(f"Connection with {client_id} established")
 
@@ -39,6 +63,11 @@ class ConnectionManager:
     def disconnect(self, client_id: str):
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+            metrics.CONNECTIONS.dec()
+
+        queue = self.job_updates.pop(client_id, None)
+        for task_id in self.active_tasks.pop(client_id, {}):
+            dispatcher.unsubscribe(task_id, queue)
 
 
     async def send_message(self, message: str, client_id: str):
@@ -47,87 +76,131 @@ class ConnectionManager:
             await websocket.send_text(message)
 
 
-    async def receive_message(self, websocket: WebSocket, client_id: str):
-        while True:
-            res = None
-
-            data = await websocket.receive_json()
-            logger.debug(f"Message received from {client_id}: {data}")
-
-            try:
-                res = Handler.handle_message(1, data)
-            except KeyError as e:
-                # likely no messageType present
-                err = json.dumps({"error": str(e)})
-                await self.send_message(err, client_id)
-            except (ValueError, NotImplementedError) as e:
-                err = json.dumps({"messageType": data["messageType"], "videoId": data["videoId"], "error": str(e)})
-                await self.send_message(err, client_id)
-
-            if res is None:
-                continue
+    async def track_job(self, client_id: str, task_id: str, message_type: str, video_id: str,
+                        requested: float | None = None):
+        self.active_tasks[client_id][task_id] = (message_type, video_id, requested or monotonic())
+        await dispatcher.subscribe(task_id, self.job_updates[client_id])
 
-            if isinstance(res, tuple):
-                # job handling
-                task_id, message_type, video_id = res
-                self.active_tasks[client_id][message_type] = (task_id, video_id)
-            elif isinstance(res, dict):
-                # we've got a message to pass to the user
-                await self.send_message(json.dumps(res), client_id)
+
+    async def receive_message(self, websocket: WebSocket, client_id: str):
+        # messages are handled concurrently, but once too many are in flight the socket is left unread,
+        # pushing back on the client instead of piling up work
+        inflight = asyncio.Semaphore(settings.WEBSOCKET_MAX_INFLIGHT)
+        handlers: set[asyncio.Task] = set()
+
+        def done(t: asyncio.Task):
+            handlers.discard(t)
+            inflight.release()
+
+        try:
+            while True:
+                data = await websocket.receive_json()
+                logger.debug(f"Message received from {client_id}: {data}")
+
+                await inflight.acquire()
+                t = asyncio.create_task(self.handle_message(client_id, data))
+                handlers.add(t)
+                t.add_done_callback(done)
+        finally:
+            for t in handlers:
+                t.cancel()
+
+
+    async def handle_message(self, client_id: str, data: dict):
+        res = None
+        requested = monotonic()
+
+        try:
+            res = await Handler.handle_message(1, data)
+        except KeyError as e:
+            # likely no messageType present
+            err = json.dumps({"error": str(e)})
+            await self.send_message(err, client_id)
+        except (ValueError, NotImplementedError) as e:
+            err = json.dumps({"messageType": data["messageType"], "videoId": data["videoId"], "error": str(e)})
+            await self.send_message(err, client_id)
+        except Exception as e:
+            logger.exception(f"Failed handling message from {client_id}")
+            err = json.dumps({"messageType": data.get("messageType"), "videoId": data.get("videoId"),
+                              "error": str(e)})
+            await self.send_message(err, client_id)
+
+        if res is None or client_id not in self.active_connections:
+            return
+
+        if isinstance(res, tuple):
+            # job handling
+            task_id, message_type, video_id = res
+            await self.track_job(client_id, task_id, message_type, video_id, requested)
+        elif isinstance(res, dict):
+            # we've got a message to pass to the user
+            await self.send_message(json.dumps(res), client_id)
 
 
     async def handle_job_updates(self, websocket: WebSocket, client_id: str):
+        updates = self.job_updates[client_id]
+
         while True:
-            deletions = []
-            additions = []
+            task_id, state, result = await updates.get()
+            if task_id not in self.active_tasks[client_id]:
+                continue
 
-            for message_type, (task_id, video_id) in self.active_tasks[client_id].items():
-                result = AsyncResult(task_id)
-                if not result.ready():
-                    continue
+            if state not in states.READY_STATES:
+                # partial results, e.g. the segments transcribed so far
+                message_type, video_id, _ = self.active_tasks[client_id][task_id]
+                if result is not None:
+                    await websocket.send_json({"messageType": message_type, "videoId": video_id, **result})
+                continue
 
-                if result.status == "SUCCESS":
-                    if "error" not in result.result and message_type not in ("keyframes", "objectdetection", "stitching"):
-                        db.store_job_result(video_id, message_type, result.result)
+            message_type, video_id, requested = self.active_tasks[client_id].pop(task_id)
+            metrics.JOB_SECONDS.labels(message_type, state).observe(monotonic() - requested)
 
-                    await websocket.send_json({"messageType": message_type, "videoId": video_id, **result.result})
+            if state == states.SUCCESS:
+                await websocket.send_json({"messageType": message_type, "videoId": video_id, **result})
 
-                    match message_type:
-                        case "transcription":
-                            pass  # TODO: rerun map task
-                        case "keyframes":
-                            new_id: str = get_objects.apply_async((video_id, )).id # ignore the error on this line
-                            new_triple = ("objectdetection", new_id, video_id)
-                            additions.append(new_triple)
-                        case "objectdetection":
-                            pass  # TODO: rerun osm
-                elif result.status == "FAILED":
-                    await websocket.send_json({"messageType": message_type, "videoId": video_id, "error": str(result.result)})
+                match message_type:
+                    case "transcription":
+                        pass  # TODO: rerun map task
+                    case "keyframes":
+                        # as if the client asked, so ownership is checked and stored detections are served
+                        await self.handle_message(client_id, {"messageType": "objectdetection", "videoId": video_id})
+                    case "objectdetection":
+                        pass  # TODO: rerun osm
+            elif state == states.FAILURE:
+                await websocket.send_json({"messageType": message_type, "videoId": video_id, "error": str(result)})
 
-                result.forget()
-                deletions.append(message_type)
 
-            for d in deletions:
-                del self.active_tasks[client_id][d]
+manager = ConnectionManager()
 
-            for message_type, task_id, video_id in additions:
-                self.active_tasks[client_id][message_type] = (task_id, video_id)
 
-            await asyncio.sleep(0.25)
+@app.get("/health")
+async def health():
+    return {"connections": len(manager.active_connections), "eventLoopLag": lag_monitor.stats()}
 
 
-manager = ConnectionManager()
+@app.get("/metrics")
+async def prometheus_metrics():
+    for queue, depth in (await run_blocking(jobs.queue_depths)).items():
+        metrics.QUEUE_DEPTH.labels(queue).set(depth)
+
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     client_id = await manager.connect(websocket)
+    tasks = [
+        asyncio.create_task(manager.receive_message(websocket, client_id)),
+        asyncio.create_task(manager.handle_job_updates(websocket, client_id)),
+    ]
+
     try:
-        await asyncio.gather(
-                manager.receive_message(websocket, client_id),
-                manager.handle_job_updates(websocket, client_id),
-        )
+        await asyncio.gather(*tasks)
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
         logger.debug(f"Connection with {client_id} closed")
+    finally:
+        for t in tasks:
+            t.cancel()
 
+        manager.disconnect(client_id)
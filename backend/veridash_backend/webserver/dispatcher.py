@@ -0,0 +1,117 @@
+import json
+import asyncio
+import logging
+from redis.asyncio import Redis
+from redis.exceptions import ConnectionError, TimeoutError
+from celery import states
+from celery.result import AsyncResult
+from veridash_backend.commons.jobs import JOB_CHANNEL
+from veridash_backend.commons.tasks import app
+from veridash_backend.commons.settings import Settings
+
+
+logger = logging.getLogger("veridash")
+
+
+class JobDispatcher:
+    """
+    Listens for job updates once per process, and fans them out to the queues subscribed to each task.
+    Queues receive tuples of (task id, state, payload), where payload is the task result once the task is ready.
+    """
+    def __init__(self):
+        settings = Settings()
+
+        self.redis_client = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+
+        # task id -> queues of connections waiting for it
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._listener: asyncio.Task | None = None
+
+
+    async def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+        await self.redis_client.aclose()
+
+
+    async def subscribe(self, task_id: str, queue: asyncio.Queue):
+        self._subscribers.setdefault(task_id, set()).add(queue)
+
+        # the task might have finished before we subscribed
+        if await asyncio.to_thread(lambda: AsyncResult(task_id, app=app).ready()):
+            await self._deliver(task_id, states.SUCCESS, None)
+
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(task_id)
+        if queues is None:
+            return
+
+        queues.discard(queue)
+        if len(queues) == 0:
+            del self._subscribers[task_id]
+
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(JOB_CHANNEL)
+
+                # updates might have been missed while (re)connecting
+                for task_id in list(self._subscribers):
+                    if await asyncio.to_thread(lambda: AsyncResult(task_id, app=app).ready()):
+                        await self._deliver(task_id, states.SUCCESS, None)
+
+                async for message in pubsub.listen():
+                    await self._handle(message)
+            except (ConnectionError, TimeoutError) as e:
+                logger.warning(f"Lost job update subscription, reconnecting: {e}")
+                await asyncio.sleep(1)
+            except Exception:
+                # without a listener no job result reaches any websocket again
+                logger.exception("Job update listener failed, restarting it")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+    async def _handle(self, message: dict):
+        """
+        Deliver one job update, a bad one is logged and dropped without stopping the listener
+        """
+        try:
+            update = json.loads(message["data"])
+            if update["taskId"] in self._subscribers:
+                await self._deliver(update["taskId"], update["state"], update["data"])
+        except Exception:
+            logger.exception(f"Dropped job update {message.get('data')!r:.200}")
+
+
+    async def _deliver(self, task_id: str, state: str, data: dict | None):
+        if state not in states.READY_STATES:
+            for q in self._subscribers.get(task_id, ()):
+                q.put_nowait((task_id, state, data))
+            return
+
+        # claim the subscribers before awaiting, so a result is only delivered once
+        queues = self._subscribers.pop(task_id, None)
+        if not queues:
+            return
+
+        # results are shared by every process subscribed to the task, and left to expire
+        def fetch():
+            result = AsyncResult(task_id, app=app)
+            return (result.status, result.result)
+
+        status, result = await asyncio.to_thread(fetch)
+        for q in queues:
+            q.put_nowait((task_id, status, result))
+
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from veridash_backend.commons.metrics import EVENT_LOOP_LAG
+
+
+logger = logging.getLogger("veridash")
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag as how late a periodic wakeup fires. Anything blocking the loop shows up here,
+    as every websocket on the process is stalled for as long.
+    """
+    def __init__(self, interval: float = 0.25, warn_threshold: float = 0.1):
+        """
+        :param interval: Seconds between wakeups
+        :param warn_threshold: Lag in seconds above which a warning is logged
+        """
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task: asyncio.Task | None = None
+
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+    def stats(self) -> dict[str, float]:
+        """
+        :return: Last and maximum observed lag in seconds, the maximum is reset on every call
+        """
+        res = {"last": self.last_lag, "max": self.max_lag}
+        self.max_lag = self.last_lag
+
+        return res
+
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+
+            self.last_lag = max(0.0, loop.time() - expected)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            EVENT_LOOP_LAG.observe(self.last_lag)
+
+            if self.last_lag > self.warn_threshold:
+                logger.warning(f"Event loop lagged {self.last_lag * 1000:.0f} ms")
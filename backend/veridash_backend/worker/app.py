@@ -1,85 +1,330 @@
 import os
-import gc
-import cv2
-import torch
+import base64
 import ffmpeg
-import whisper
-import numpy as np
-from PIL import Image
+import hashlib
 from uuid import uuid4
-from celery import Celery
-from veridash_backend.worker.translation import Translator
+from time import perf_counter
+from threading import Lock, Event
+from typing import Iterator, TYPE_CHECKING
+from contextlib import contextmanager, nullcontext, ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from celery import Task, chord, states
+from billiard.process import current_process
+from celery.signals import task_prerun, task_postrun, worker_init, worker_process_init, worker_process_shutdown
+from celery.utils.log import get_task_logger
+from veridash_backend.worker.models import ModelCache
+from veridash_backend.worker.media import MediaArtefacts, FrameSampling, probe_url
 from veridash_backend.commons.storage import StorageManager
-from veridash_backend.commons.mutex import LockManager
-from veridash_backend.commons.db import Database
+from veridash_backend.commons.mutex import LockManager, Lease
+from veridash_backend.commons.jobs import JobTracker, job_key
+from veridash_backend.commons.db import Database, new_object_name
+from veridash_backend.commons import metrics, tasks
+from veridash_backend.commons.metrics import stage
 from veridash_backend.commons.settings import Settings
+from veridash_backend.commons.tasks import app
 
-from ultralytics import YOLO
+# NOTE: torch, whisper, ultralytics, openai, cv2 and numpy are imported where used,
+# so processes only load what their tasks need, e.g. the io worker none of them
+if TYPE_CHECKING:
+    import numpy as np
 
 settings = Settings()
+logger = get_task_logger(__name__)
 
-app = Celery("worker", broker=settings.REDIS_CONN_STR, backend=settings.REDIS_CONN_STR,
-             broker_connection_retry_on_startup=True)
 storage = StorageManager()
 locks = LockManager()
+jobs = JobTracker()
 db = Database()
 
+sampling = FrameSampling(settings.KEYFRAME_SAMPLING, settings.KEYFRAME_MIN_FPS, settings.KEYFRAME_MAX_FPS,
+                         settings.KEYFRAME_SCENE_THRESHOLD, settings.KEYFRAME_DEDUP_DISTANCE)
 
-def grab_video_locally(video_name: str):
+def gpu_device() -> str:
+    """
+    :return: Id of the gpu this process runs its models on, the first one visible to it
+    """
+    return (os.getenv("CUDA_VISIBLE_DEVICES") or "0").split(",")[0]
+
+
+def gpu_semaphore() -> str:
+    return f"gpu:{settings.NODE_NAME}:{gpu_device()}"
+
+
+def model_memory(units: int):
+    """
+    Hold megabytes of this process' gpu for a resident model, until it is evicted. Nothing is held without a gpu.
+    """
+    import torch
+
+    if not torch.cuda.is_available():
+        return nullcontext()
+    return locks.semaphore(gpu_semaphore(), units, settings.GPU_MEMORY_MB)
+
+
+# models stay resident in each worker process between tasks, with their gpu memory leased meanwhile
+models = ModelCache(settings.MODEL_CACHE_RAM_MB * 2**20, settings.MODEL_CACHE_VRAM_MB * 2**20, model_memory)
+
+
+def load_whisper():
+    import whisper
+    return whisper.load_model(settings.WHISPER_MODEL)
+
+
+def load_yolo():
+    from ultralytics import YOLO
+    return YOLO(settings.YOLO_WEIGHTS)
+
+
+def load_embedder():
+    from veridash_backend.worker.embedding import load_embedder
+    return load_embedder()
+
+
+models.register("whisper", load_whisper, settings.WHISPER_GPU_MB)
+models.register("yolo", load_yolo, settings.YOLO_GPU_MB)
+models.register("embedder", load_embedder, settings.EMBEDDER_GPU_MB)
+
+# task id -> set once the task finished, stopping the renewal of its claim
+claims: dict[str, Event] = {}
+
+
+@worker_init.connect
+def serve_metrics(**kwargs):
+    # in the main process, child processes write to PROMETHEUS_MULTIPROC_DIR
+    if settings.WORKER_METRICS_PORT != 0:
+        metrics.serve(settings.WORKER_METRICS_PORT)
+
+
+@worker_process_init.connect
+def pin_gpu(**kwargs):
+    # before anything initialises cuda, so every library sees the one gpu. each gpu has its own semaphore,
+    # so shards of a detection run on all gpus of the machine at once
+    devices = [x.strip() for x in settings.GPU_DEVICES.split(",") if x.strip()]
+    if len(devices) != 0:
+        os.environ["CUDA_VISIBLE_DEVICES"] = devices[getattr(current_process(), "index", 0) % len(devices)]
+
+
+@worker_process_shutdown.connect
+def forget_process_metrics(pid: int | None = None, **kwargs):
+    metrics.process_exited(pid or os.getpid())
+
+
+@task_prerun.connect
+def trace_job(task_id: str | None = None, task: Task | None = None, args: tuple = (), **kwargs):
+    if task_id is None or task is None:
+        return
+
+    # chord callbacks get the results of the header first
+    video = args[0] if len(args) != 0 and isinstance(args[0], str) else None
+    metrics.begin_task(task.name.rsplit(".", 1)[-1], task_id, video)
+
+    claims[task_id] = jobs.keep_alive(task_id, settings.JOB_CLAIM_TTL_SECONDS)
+
+
+@task_postrun.connect
+def announce_finished_job(task_id: str | None = None, task: Task | None = None, args: tuple = (),
+                          retval=None, state: str | None = None, **kwargs):
+    if task_id is None:
+        return
+
+    metrics.end_task(state or "UNKNOWN")
+
+    stop = claims.pop(task_id, None)
+    if stop is not None:
+        stop.set()
+
+    # e.g. replaced by the shards of get_objects, whose merge finishes under the same task id
+    if state not in states.READY_STATES:
+        return
+
+    # results are persisted here, so they are kept even when nobody is listening
+    cached_as = getattr(task, "cached_as", None)
+    if state == states.SUCCESS and cached_as and isinstance(retval, dict) and "error" not in retval:
+        db.store_job_result(args[0], cached_as, retval, job_key(list(args[1:])))
+
+    jobs.release(task_id)
+
+    # the result is stored by the time postrun fires, so the webservers can fetch it right away
+    jobs.publish(task_id, state)
+
+
+@contextmanager
+def gpu_memory(units: int) -> Iterator[Lease]:
+    """
+    Hold megabytes of working memory on this process' gpu, to prevent OOM-errors. Take the models first,
+    they hold their own memory, see model_memory.
+    """
+    with locks.semaphore(gpu_semaphore(), units, settings.GPU_MEMORY_MB) as lease:
+        yield lease
+
+
+@contextmanager
+def grab_video_locally(video_name: str) -> Iterator[str]:
+    # byte-identical uploads share one object in storage
+    blob_name = db.get_blob_name(video_name) or video_name
+
+    # looked up before downloading, so a download hashes the bytes as they arrive instead of reading the file again
+    hasher = None if db.has_verified_hash(video_name) else hashlib.sha256()
+    downloaded = False
+
+    def on_chunk(chunk: bytes):
+        nonlocal downloaded
+        downloaded = True
+        hasher.update(chunk)
+
+    # the cache is per machine (NODE_NAME), and so is the lock, only held while downloading.
     # somewhat arbitrary 10 minute expected max download time
-    with locks.wait_for_lock(f"download:{video_name}", expiration=600):
-        local_name = storage.download_file(video_name)
+    lock = nullcontext() if storage.is_cached(blob_name) else \
+        locks.wait_for_lock(f"download:{settings.NODE_NAME}:{blob_name}", expiration=600)
+
+    with ExitStack() as stack:
+        with lock:
+            local_name = stack.enter_context(storage.local_copy(blob_name, on_chunk if hasher else None))
+
+        if hasher is not None and downloaded:
+            db.set_video_hash(video_name, hasher.hexdigest())
+        elif hasher is not None:
+            # downloaded by another process, or for another video sharing the blob
+            db.add_video_hash_if_not_exists(video_name, local_name)
+
+        yield local_name
+
 
-    db.add_video_hash_if_not_exists(video_name, local_name)
-    return local_name
+@contextmanager
+def grab_media(video_name: str) -> Iterator[MediaArtefacts]:
+    # probe, frames and audio are shared between tasks, so each video is only decoded once
+    with grab_video_locally(video_name) as local_name, \
+            storage.cache.get(f"{os.path.basename(local_name)}.ingest", os.makedirs) as root:
+        yield MediaArtefacts(local_name, root, sampling)
 
 
-@app.task(bind=True)
+def probe_video(video_name: str) -> dict:
+    """
+    Probe a video, reading only the byte ranges needed from storage, unless it is on disk already
+    """
+    blob_name = db.get_blob_name(video_name) or video_name
+
+    res = None
+    if not storage.is_cached(blob_name):
+        try:
+            res = probe_url(storage.get_object_download_url(blob_name), settings.PROBE_TIMEOUT_SECONDS)
+        except ffmpeg.Error as e:
+            stderr = e.stderr.decode(errors="replace").strip() if e.stderr else ""
+            logger.warning(f"Could not probe {video_name} over its url, downloading it instead: {stderr[-500:]}")
+
+    if res is None:
+        with grab_media(video_name) as media:
+            res = media.probe()
+
+    # ffprobe names the file it read, i.e. a presigned url holding credentials, or a path on this machine
+    if "format" in res:
+        res["format"]["filename"] = blob_name
+
+    return res
+
+
+def find_near_duplicate(video_name: str, media: MediaArtefacts) -> str | None:
+    """
+    Fingerprint the video by its keyframes, once
+    :returns: Object name of an earlier upload of the same footage, whose results are shared with this one
+    """
+    duration = media.probe().get("format", {}).get("duration")
+    duplicate_of = db.add_video_fingerprint(video_name, [x["phash"] for x in media.frame_info()],
+                                            float(duration) if duration else None,
+                                            settings.FINGERPRINT_FRAMES, settings.NEAR_DUPLICATE_DISTANCE,
+                                            settings.NEAR_DUPLICATE_MIN_SCORE, settings.NEAR_DUPLICATE_MIN_FRAMES,
+                                            settings.NEAR_DUPLICATE_DURATION_TOLERANCE)
+    if duplicate_of is not None:
+        logger.info(f"{video_name} is a near-duplicate of {duplicate_of}")
+
+    return duplicate_of
+
+
+@app.task(bind=True, name=tasks.METADATA, cached_as="metadata")
 def get_metadata(self, video_name: str):
-    local_name = grab_video_locally(video_name)
-    return ffmpeg.probe(local_name)
+    return probe_video(video_name)
 
 
-@app.task(bind=True)
+@app.task(bind=True, name=tasks.TRANSCRIPTION, cached_as="transcription")
 def get_transcription(self, video_name: str):
-    local_name = grab_video_locally(video_name)
-
-    # to prevent OOM-errors, we wait for gpu
-    with locks.wait_for_lock("gpu", expiration=180):
-        model = whisper.load_model("medium")
-        res = model.transcribe(local_name)
+    with grab_media(video_name) as media:
+        audio = media.audio()
 
-        del model
-        gc.collect();
-        if torch.cuda.device_count() != 0:
-            torch.cuda.empty_cache()
+        # the same footage might have been transcribed already, e.g. before being re-encoded
+        if find_near_duplicate(video_name, media) is not None:
+            cached = db.get_cached_results(video_name, "transcription")
+            if cached is not None:
+                return cached
 
-    res["segments"] = [x for x in res["segments"] if x["no_speech_prob"] < 0.7]
-    for x in res["segments"]:
-        x.pop("tokens")
+    from veridash_backend.worker.translation import Translator
+    from veridash_backend.worker.transcription import transcribe_chunks
 
-    if res["language"] != "en" and type(res["text"]) == str and res["text"].strip():
+    try:
+        translator = Translator(db)
+    except EnvironmentError:
+        translator = None
+
+    # segments are announced as they are transcribed, and again once translated. only the segments that changed
+    # are sent, dashboards put them in place by offset, as segment ids are their index
+    segments: list[dict] = []
+    language = None
+    progress = 0.0
+    lock = Lock()
+
+    def announce(offset: int, chunk: list[dict]):
+        with lock:
+            jobs.publish(self.request.id, "PROGRESS", {
+                "progress": progress,
+                "transcription": {"language": language, "offset": offset, "segments": chunk},
+            })
+
+    def translate(chunk: list[dict]):
         try:
-            t = Translator()
-            translations = t.translate_sentences([x["text"] for x in res["segments"]])
-
-            for x, y in zip(res["segments"], translations):
-                x["text_en"] = y
-        except EnvironmentError:
-            pass
+            translations = translator.translate_sentences([x["text"] for x in chunk], language)
+        except Exception as e:
+            logger.warning(f"Could not translate {len(chunk)} segments: {e}")
+            return
+
+        with lock:
+            for x, y in zip(chunk, translations):
+                if y is not None:
+                    x["text_en"] = y
+        announce(chunk[0]["id"], chunk)
+
+    # translations run while the gpu carries on with the next chunk
+    with ThreadPoolExecutor(max_workers=2) as translations:
+        with stage("model_load"):
+            model = models.get("whisper")
+
+        with gpu_memory(settings.WHISPER_WORK_MB) as lease:
+            with stage("inference"):
+                for p, lang, chunk in transcribe_chunks(model, audio, settings.TRANSCRIPTION_CHUNK_SECONDS,
+                                                        check=lease.check):
+                    with lock:
+                        progress, language = p, lang
+                        offset = len(segments)
+                        segments.extend(chunk)
+                    announce(offset, chunk)
+
+                    if translator is not None and lang != "en" and any(x["text"].strip() for x in chunk):
+                        translations.submit(translate, chunk)
 
     return {
-        "transcription": res,
+        "transcription": {
+            "text": "".join(x["text"] for x in segments),
+            "segments": segments,
+            "language": language,
+        },
     }
 
 
-@app.task(bind=True)
+@app.task(bind=True, name=tasks.COORDINATES, cached_as="map")
 def get_coordinates(self, video_name: str):
     # TODO: use transcript named entity recognition and geocoding
     # TODO: use osm tags
 
-    local_name = grab_video_locally(video_name)
-    metadata = ffmpeg.probe(local_name)
+    # the probe is the metadata result, only probed again if that is not stored yet
+    metadata = db.get_cached_results(video_name, "metadata") or probe_video(video_name)
 
     has_tags = ("format" in metadata and type(metadata["format"]) == dict and
                 "tags" in metadata["format"] and type(metadata["format"]["tags"]) == dict)
@@ -111,121 +356,244 @@ def get_coordinates(self, video_name: str):
     }
 
 
-@app.task(bind=True)
+@app.task(bind=True, name=tasks.KEYFRAMES)
 def get_keyframes(self, video_name: str):
-    local_name = grab_video_locally(video_name)
+    import cv2
+    import numpy as np
+    from veridash_backend.worker.embedding import embed_images, EMBEDDING_DIM
+
+    with grab_media(video_name) as media:
+        if find_near_duplicate(video_name, media) is not None:
+            keyframes = db.get_keyframes_by_video_name(video_name)
+            if len(keyframes) != 0:
+                return {
+                    "urls": [storage.get_object_download_url(x[0]) for x in keyframes],
+                    "timestamps": [x[1] for x in keyframes],
+                    "imageIds": [x[0] for x in keyframes],
+                }
+
+        images = media.frames()
+        timestamps = [x["timestamp"] for x in media.frame_info()]
+
+        import torch
+
+        # searchable later on, see find_similar_images. the embedder runs on the gpu when there is one
+        batch = settings.EMBEDDING_BATCH_SIZE
+        with stage("model_load"):
+            embedder = models.get("embedder")
+
+        with gpu_memory(settings.EMBEDDER_WORK_MB) if torch.cuda.is_available() else nullcontext() as lease:
+            with stage("embedding"):
+                # full resolution frames are read a batch at a time, as they take megabytes each.
+                # frames that cannot be read are left out of the keyframes
+                readable, embedded = [], [np.zeros((0, EMBEDDING_DIM), dtype=np.float16)]
+                for i in range(0, len(images), batch):
+                    frames = []
+                    for j, path in enumerate(images[i:i+batch], i):
+                        img = cv2.imread(path)
+                        if img is None:
+                            logger.warning(f"Skipping unreadable keyframe {path} of {video_name}")
+                            continue
+                        frames.append(img)
+                        readable.append(j)
+
+                    embedded.append(embed_images(embedder, frames, batch, check=lease.check if lease else None))
+                embeddings = np.concatenate(embedded)
+
+        images = [images[j] for j in readable]
+        timestamps = [timestamps[j] for j in readable]
+        img_obj_names = db.add_video_keyframes(video_name, images, timestamps, embeddings)
+
+        download_urls = storage.upload_many(list(zip(img_obj_names, images)), "image/jpeg")
+
+    return {
+        "urls": download_urls,
+        "timestamps": timestamps,
+        "imageIds": img_obj_names,
+    }
 
-    out_folder = os.path.join(settings.TEMP_STORAGE_DIR, f"{video_name}-frames")
-    os.makedirs(out_folder, exist_ok=True)
 
-    # sample 1 frame per second
-    ffmpeg \
-        .input(local_name) \
-        .filter('fps', fps=1) \
-        .output(os.path.join(out_folder, "frame_%04d.jpg"), format='image2', vcodec='mjpeg') \
-        .run()
+def detect_frames(img_names: list[str]) -> tuple[list, "np.ndarray"]:
+    """
+    Detect objects in keyframes, holding gpu memory meanwhile
+    :param img_names: Object names of the keyframes
+    :returns: Detections, with frame numbers relative to img_names, and an embedding of every crop
+    """
+    import cv2
+    import numpy as np
+    from veridash_backend.worker.detection import detect_objects
+    from veridash_backend.worker.embedding import embed_images
 
-    images = os.listdir(out_folder)
+    with ExitStack() as stack:
+        img_files = [stack.enter_context(storage.local_copy(x)) for x in img_names]
 
-    img_obj_names = db.add_video_keyframes(video_name, images)
+        with stage("model_load"):
+            obj_det_model = models.get("yolo")
+            embedder = models.get("embedder")
 
-    download_urls = []
-    for obj, local in zip(img_obj_names, images):
-        local_path = os.path.join(out_folder, local)
+        # the crops are embedded under the same lease
+        with gpu_memory(settings.YOLO_WORK_MB + settings.EMBEDDER_WORK_MB) as lease:
+            start = perf_counter()
+            with stage("inference"):
+                detections = list(detect_objects(obj_det_model, img_files, settings.DETECTION_BATCH_SIZE,
+                                                 check=lease.check))
+            elapsed = perf_counter() - start
 
-        storage.upload_file(obj, local_path)
-        download_urls.append(storage.get_object_download_url(obj))
+            with stage("embedding"):
+                crops = [cv2.imdecode(np.frombuffer(x.image, np.uint8), cv2.IMREAD_COLOR) for x in detections]
+                embeddings = embed_images(embedder, crops, settings.EMBEDDING_BATCH_SIZE,
+                                          check=lease.check)
 
-        os.remove(local_path)
+    logger.info(f"Detected {len(detections)} objects in {len(img_files)} frames "
+                f"({len(img_files) / max(elapsed, 1e-9):.1f} frames/s)")
 
-    os.rmdir(out_folder)
+    return detections, embeddings
 
+
+def detections_response(names: list[str], urls: list[str], rows: list[tuple]) -> dict:
+    """
+    :param rows: Tuples of (keyframe number, class id, class name, confidence, box), as stored
+    """
     return {
-        "urls": download_urls,
+        "urls": urls,
+        "keyFrameNumbers": [x[0] for x in rows],
+        "classNames": [x[2] for x in rows],
+        "confidences": [x[3] for x in rows],
+        "imageIds": names,
     }
 
 
-@app.task(bind=True)
+@app.task(bind=True, name=tasks.OBJECTS)
 def get_objects(self, video_name: str):
-    out_folder = os.path.join(settings.TEMP_STORAGE_DIR, f"{video_name}-objects")
-    os.makedirs(out_folder, exist_ok=True)
-
-    img_names = db.get_images_by_video_name(video_name)
-    if len(img_names) == 0:
+    keyframes = db.get_keyframe_run(video_name)
+    if keyframes is None:
         return {
             "error": "Missing required dependency: keyframes",
         }
+    keyframe_run, img_names = keyframes
+
+    # detections over the same footage are shared, including near-duplicates, as are runs that found nothing
+    detections = db.get_detections_by_video_name(video_name)
+    if detections is not None:
+        return {
+            "urls": [storage.get_object_download_url(x[0]) for x in detections],
+            "keyFrameNumbers": [x[1] for x in detections],
+            "classNames": [x[2] for x in detections],
+            "confidences": [x[3] for x in detections],
+            "imageIds": [x[0] for x in detections],
+        }
 
-    img_files = [storage.download_file(x) for x in img_names]
+    # long videos are split into frame ranges detected in parallel by any gpu worker, the merge inherits this
+    # task's id, so whoever waits for this task gets the merged result
+    shard = settings.DETECTION_SHARD_FRAMES
+    if len(img_names) > shard:
+        ranges = [(i, min(i + shard, len(img_names))) for i in range(0, len(img_names), shard)]
+        logger.info(f"Detecting objects in {len(img_names)} frames of {video_name} in {len(ranges)} shards")
 
-    classes = ["car", "tank", "plane", "person"]
-    index_mapping = {index: item for index, item in enumerate(classes)}
+        # queued again, nobody renews the claim until the merge starts
+        jobs.renew(self.request.id, settings.JOB_QUEUED_TTL_SECONDS)
 
-    object_filenames = []
-    object_frame_ixs = []
-    with locks.wait_for_lock("gpu", expiration=180):
-        obj_det_model = YOLO("../weights/yolov8x-worldv2.pt")
+        merge = merge_detections.s(video_name, keyframe_run).on_error(detection_failed.si(self.request.id))
+        return self.replace(chord(
+            [detect_shard.s(video_name, img_names[a:b], a, self.request.id, len(ranges)) for a, b in ranges],
+            merge,
+        ))
 
-        for frame_ix, filename in enumerate(img_files):
-            im = Image.open(filename)
-            results = obj_det_model.predict(im, conf=0.35)
-            boxes = results[0].boxes.xyxy.tolist()
-            im = np.array(im)
-            im = cv2.cvtColor(im, cv2.COLOR_RGB2BGR)
+    detections, embeddings = detect_frames(img_names)
+    rows = [(x.frame_number, x.class_id, x.class_name, x.confidence, x.box) for x in detections]
 
-            for i, box in enumerate(boxes):
-                x1, y1, x2, y2 = box
-                ultralytics_crop_object = im[int(y1):int(y2), int(x1):int(x2)]
-                # obj_name = index_mapping[results[0].boxes[i].cls.cpu().tolist()[0]]
-                object_filenames.append(os.path.join(out_folder, f"{frame_ix}-object-{i}.jpg"))
-                object_frame_ixs.append(frame_ix)
-                cv2.imwrite(object_filenames[-1], ultralytics_crop_object)
+    img_obj_names = db.add_detected_objects(video_name, keyframe_run, rows, embeddings)
+    download_urls = storage.upload_many([(obj, det.image) for obj, det in zip(img_obj_names, detections)], "image/jpeg")
 
-        del obj_det_model
-        gc.collect()
-        if torch.cuda.device_count() != 0:
-            torch.cuda.empty_cache()
+    return detections_response(img_obj_names, download_urls, rows)
 
-    img_obj_names = db.add_detected_objects(video_name, object_filenames)
 
-    download_urls = []
-    for obj, local in zip(img_obj_names, object_filenames):
-        storage.upload_file(obj, local)
-        download_urls.append(storage.get_object_download_url(obj))
+@app.task(bind=True, name=tasks.DETECT_SHARD)
+def detect_shard(self, video_name: str, img_names: list[str], start: int, parent_id: str, shards: int):
+    """
+    Detect objects in some keyframes of a video, uploading the crops. Nothing is stored, see merge_detections.
+    :param img_names: Object names of the keyframes, of one keyframe run
+    :param start: Number of keyframes of the run before these
+    :param parent_id: Task the shard is part of, progress is announced for it
+    :param shards: Number of shards the task is split in
+    """
+    import numpy as np
 
-        os.remove(local)
+    detections, embeddings = detect_frames(img_names)
 
-    os.rmdir(out_folder)
+    # named here, as they are uploaded before being stored
+    names = [new_object_name(".jpg") for _ in detections]
+    storage.upload_many([(obj, det.image) for obj, det in zip(names, detections)], "image/jpeg")
 
-    return {
-        "urls": download_urls,
-        "keyFrameNumbers": list(map(lambda x: x+1, object_frame_ixs)),
-    }
+    jobs.count_progress(parent_id, shards)
+
+    return [{
+        "objectName": name,
+        "keyFrameNumber": x.frame_number + start,
+        "classId": x.class_id,
+        "className": x.class_name,
+        "confidence": x.confidence,
+        "box": list(x.box),
+        # float16, base64 encoded, as results pass through redis
+        "embedding": base64.b64encode(emb.astype(np.float16).tobytes()).decode(),
+    } for name, x, emb in zip(names, detections, embeddings)]
+
+
+@app.task(bind=True, name=tasks.MERGE_DETECTIONS)
+def merge_detections(self, shards: list[list[dict]], video_name: str, keyframe_run: int):
+    """
+    Store the detections of every shard at once, in frame order, as chord callback of detect_shard
+    """
+    import numpy as np
+
+    detections = [x for shard in shards for x in shard]
+    detections.sort(key=lambda x: x["keyFrameNumber"])
+
+    rows = [(x["keyFrameNumber"], x["classId"], x["className"], x["confidence"], tuple(x["box"])) for x in detections]
+    embeddings = [np.frombuffer(base64.b64decode(x["embedding"]), np.float16) for x in detections]
+    names = db.add_detected_objects(video_name, keyframe_run, rows, embeddings, [x["objectName"] for x in detections])
+
+    return detections_response(names, [storage.get_object_download_url(x) for x in names], rows)
 
 
-@app.task(bind=True)
+@app.task(bind=True, name=tasks.DETECTION_FAILED)
+def detection_failed(self, parent_id: str):
+    """
+    Error callback of a sharded detection, whose merge never runs, so it is announced from here
+    """
+    jobs.release(parent_id)
+    jobs.publish(parent_id, states.FAILURE)
+
+
+@app.task(bind=True, name=tasks.STITCH, cached_as="stitching")
 def get_stitch(self, video_name: str, source_key_frames: list[int]):
-    # download the files we need
+    import cv2
+
     img_names = db.get_images_by_video_name(video_name)
     filtered_img_names = [x for i, x in enumerate(img_names) if i+1 in source_key_frames]
-    img_files = [storage.download_file(x) for x in filtered_img_names]
-
-    if len(img_files) == 0:
+    if len(filtered_img_names) == 0:
         return {
             "error": "Could not find requested source frames",
         }
 
-    # read images
+    # read images, from the local cache when present
     images = []
-    for f in img_files:
-        img = cv2.imread(f)
+    for x in filtered_img_names:
+        with storage.local_copy(x) as f:
+            img = cv2.imread(f)
         images.append(img)
 
-
-    # stitch
+    # stitch, registering and finding seams on downscaled images, and composing at the configured resolution
     try:
         stitcher = cv2.Stitcher_create()  # NOTE: this is very intentional, it is not supposed to be Stitcher()
-        (status, stitched) = stitcher.stitch(images)
+        stitcher.setRegistrationResol(settings.STITCH_REGISTRATION_MPX)
+        stitcher.setSeamEstimationResol(settings.STITCH_SEAM_MPX)
+        stitcher.setCompositingResol(settings.STITCH_COMPOSE_MPX)
+
+        start = perf_counter()
+        with stage("stitch"):
+            (status, stitched) = stitcher.stitch(images)
+        logger.info(f"Stitched {len(images)} frames in {perf_counter() - start:.1f}s")
     except Exception as e:
         return {
             "error": f"Exception raised during stitching: {e}",
@@ -236,19 +604,20 @@ def get_stitch(self, video_name: str, source_key_frames: list[int]):
             "error": f"Stitching error: {status}",
         }
 
-    stitch_name = f"stitch-{str(uuid4())}.jpg"
-    cv2.imwrite(stitch_name, stitched)
-
-    # upload file and remove locally
-    storage.upload_file(stitch_name, stitch_name)
-    pre_url = storage.get_object_download_url(stitch_name)
+    # encoded in memory, nothing is written to disk
+    ok, buf = cv2.imencode(".jpg", stitched)
+    if not ok:
+        return {
+            "error": "Could not encode stitched image",
+        }
 
-    os.remove(stitch_name)
-    for f in img_files:
-        os.remove(f)
+    stitch_name = f"stitch-{str(uuid4())}.jpg"
+    with stage("upload"):
+        storage.upload_bytes(stitch_name, buf.tobytes(), "image/jpeg")
 
     return {
-        "url": pre_url,
+        "url": storage.get_object_download_url(stitch_name),
+        # cached results outlive presigned urls, the url is signed again from this
+        "objectName": stitch_name,
         "sourceKeyFrames": source_key_frames,
     }
-
@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+from queue import Queue, Full, Empty
+from threading import Thread, Event
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+
+
+@dataclass
+class Detection:
+    # 1-based keyframe number the object was found in
+    frame_number: int
+    class_id: int
+    class_name: str
+    confidence: float
+    box: tuple[float, float, float, float]
+    # jpeg encoded crop
+    image: bytes
+
+
+def read_frames(filenames: list[str], max_pending: int = 32) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Decode images on a background thread, so decoding overlaps with inference.
+    The thread stops once the iterator is closed, also when the consumer stops early, e.g. on a lost lease.
+    :param filenames: Local image paths, in frame order
+    :param max_pending: Max decoded frames waiting to be consumed
+    :return: Iterator of (frame index, BGR image)
+    """
+    q: Queue = Queue(maxsize=max_pending)
+    stop = Event()
+    done = object()
+
+    def put(x) -> bool:
+        # never blocks for good on a consumer that is gone
+        while not stop.is_set():
+            try:
+                q.put(x, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def decode():
+        try:
+            for i, f in enumerate(filenames):
+                if stop.is_set():
+                    return
+
+                im = cv2.imread(f)
+                if im is None:
+                    continue
+
+                if not put((i, im)):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    decoder = Thread(target=decode, name="read-frames", daemon=True)
+    decoder.start()
+
+    try:
+        while True:
+            x = q.get()
+            if x is done:
+                return
+            if isinstance(x, Exception):
+                raise x
+
+            yield x
+    finally:
+        stop.set()
+        # frees the frames still pending, and unblocks a put in progress
+        while decoder.is_alive():
+            try:
+                while True:
+                    q.get_nowait()
+            except Empty:
+                pass
+            decoder.join(0.1)
+
+
+def detect_objects(model: Any, filenames: list[str], batch_size: int = 16, conf: float = 0.35,
+                   check: Callable[[], None] | None = None) -> Iterator[Detection]:
+    """
+    Run batched object detection over a sequence of frames.
+    :param model: Ultralytics YOLO model
+    :param filenames: Local image paths, in frame order
+    :param batch_size: Number of frames passed to the model at a time
+    :param conf: Minimum confidence of kept detections
+    :param check: Called before and after every batch, raising to stop, e.g. Lease.check
+    :return: Iterator of detections, in frame order
+    """
+    batch: list[tuple[int, np.ndarray]] = []
+
+    # closed right away when detection stops early, rather than once the exception is collected
+    with closing(read_frames(filenames, max_pending=2 * batch_size)) as frames:
+        for frame in frames:
+            batch.append(frame)
+            if len(batch) == batch_size:
+                yield from _detect_batch(model, batch, conf, check)
+                batch = []
+
+    if len(batch) != 0:
+        yield from _detect_batch(model, batch, conf, check)
+
+
+def _detect_batch(model: Any, batch: list[tuple[int, np.ndarray]], conf: float,
+                  check: Callable[[], None] | None) -> Iterator[Detection]:
+    if check is not None:
+        check()
+    results = model.predict([im for _, im in batch], conf=conf, verbose=False)
+    if check is not None:
+        check()
+
+    for (frame_ix, im), res in zip(batch, results):
+        boxes = res.boxes
+        for box, cls, c in zip(boxes.xyxy.tolist(), boxes.cls.tolist(), boxes.conf.tolist()):
+            x1, y1, x2, y2 = box
+            crop = im[int(y1):int(y2), int(x1):int(x2)]
+            if crop.size == 0:
+                continue
+
+            ok, buf = cv2.imencode(".jpg", crop)
+            if not ok:
+                continue
+
+            yield Detection(frame_ix + 1, int(cls), res.names[int(cls)], float(c), (x1, y1, x2, y2), buf.tobytes())
+
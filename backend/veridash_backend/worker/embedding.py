@@ -0,0 +1,65 @@
+import cv2
+import torch
+import numpy as np
+from typing import Callable
+from torchvision.models import resnet18, ResNet18_Weights
+
+
+EMBEDDING_DIM = 512
+
+# ImageNet statistics the weights were trained with
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def load_embedder(device: str | None = None) -> torch.nn.Module:
+    """
+    :param device: Torch device, defaults to the gpu when present
+    :return: ResNet-18 returning the pooled features before its classifier
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+
+    model = resnet18(weights=ResNet18_Weights.DEFAULT)
+    model.fc = torch.nn.Identity()
+
+    return model.eval().to(device)
+
+
+def embed_images(model: torch.nn.Module, images: list[np.ndarray], batch_size: int = 64,
+                 check: Callable[[], None] | None = None) -> np.ndarray:
+    """
+    :param model: Model from load_embedder
+    :param images: BGR images of any size, a None image (e.g. unreadable) raises ValueError
+    :param batch_size: Images per forward pass
+    :param check: Called before and after every batch, raising to stop, e.g. Lease.check
+    :return: L2-normalised float16 embeddings, one row per image, compared by cosine distance
+    """
+    device = next(model.parameters()).device
+
+    out = []
+    for i in range(0, len(images), batch_size):
+        batch = torch.from_numpy(np.stack([_preprocess(x) for x in images[i:i+batch_size]])).to(device)
+
+        if check is not None:
+            check()
+        with torch.inference_mode():
+            features = torch.nn.functional.normalize(model(batch), dim=1)
+        if check is not None:
+            check()
+
+        out.append(features.cpu().numpy().astype(np.float16))
+
+    if len(out) == 0:
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float16)
+
+    return np.concatenate(out)
+
+
+def _preprocess(image: np.ndarray) -> np.ndarray:
+    if image is None:
+        raise ValueError("Cannot embed a missing image, e.g. a file cv2.imread could not read")
+
+    small = cv2.resize(image, (224, 224), interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB).astype(np.float32) / 255
+
+    return ((rgb - MEAN) / STD).transpose(2, 0, 1)
@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import fcntl
+import shutil
+import ffmpeg
+from uuid import uuid4
+from typing import TYPE_CHECKING
+from dataclasses import dataclass
+from veridash_backend.commons.metrics import stage
+
+# NOTE: cv2 and numpy are imported where used, probing needs neither
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# whisper expects 16 kHz mono audio
+SAMPLE_RATE = 16000
+
+
+@dataclass
+class FrameSampling:
+    # "fixed" samples at max_fps, "scene" samples on scene changes
+    mode: str = "scene"
+    # sample at least this often, even without scene changes (0 to only sample on scene changes)
+    min_fps: float = 0.1
+    # never sample more often than this
+    max_fps: float = 1.0
+    # ffmpeg scene score (0-1) counting as a scene change
+    scene_threshold: float = 0.3
+    # frames within this perceptual hash hamming distance of the previous kept frame are dropped (-1 disables)
+    dedup_distance: int = 5
+
+    def __post_init__(self):
+        if self.max_fps <= 0 or self.min_fps < 0:
+            raise ValueError(f"Keyframes need a max fps above 0 and a min fps of at least 0, "
+                             f"not {self.max_fps} and {self.min_fps}")
+
+
+class MediaArtefacts:
+    """
+    Worker-local artefacts derived from a video: the probe result, sampled frames and a 16 kHz mono PCM track.
+    The video is probed once and decoded once, the tasks needing any of these read them from here.
+    """
+    def __init__(self, local_name: str, root: str, sampling: FrameSampling | None = None):
+        """
+        :param local_name: Local path of the video
+        :param root: Directory the artefacts are stored in
+        :param sampling: How keyframes are sampled during decode
+        """
+        self.source = local_name
+        self.sampling = sampling or FrameSampling()
+        self.root = root
+
+        self.probe_path = os.path.join(self.root, "probe.json")
+        self.frames_dir = os.path.join(self.root, "frames")
+        self.frames_path = os.path.join(self.root, "frames.json")
+        self.audio_path = os.path.join(self.root, "audio.pcm")
+        # written last, marks a complete decode
+        self.decoded_path = os.path.join(self.root, "decoded")
+
+        os.makedirs(self.root, exist_ok=True)
+
+
+    def probe(self) -> dict:
+        if os.path.exists(self.probe_path):
+            with open(self.probe_path) as f:
+                return json.load(f)
+
+        with stage("probe"):
+            res = ffmpeg.probe(self.source)
+
+        tmp_path = f"{self.probe_path}.{uuid4()}"
+        with open(tmp_path, "w") as f:
+            json.dump(res, f)
+        os.replace(tmp_path, self.probe_path)
+
+        return res
+
+
+    def decode(self):
+        """
+        Decode the video once, writing both sampled frames and the PCM track. Short circuits if already done.
+        """
+        if os.path.exists(self.decoded_path):
+            return
+
+        # one decode per video on this machine, other processes wait for it
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.decoded_path):
+                return
+
+            streams = self.probe().get("streams", [])
+            has_video = any(x.get("codec_type") == "video" for x in streams)
+            has_audio = any(x.get("codec_type") == "audio" for x in streams)
+
+            shutil.rmtree(self.frames_dir, ignore_errors=True)
+            os.makedirs(self.frames_dir)
+
+            inp = ffmpeg.input(self.source)
+            outputs = []
+            if has_video:
+                # showinfo logs the timestamp of every frame written, whether or not a filter attached metadata
+                outputs.append(self._sample_frames(inp.video)
+                    .filter('showinfo')
+                    .output(os.path.join(self.frames_dir, "frame_%06d.jpg"), format='image2', vcodec='mjpeg',
+                            fps_mode='vfr'))
+            if has_audio:
+                outputs.append(inp.audio
+                    .output(self.audio_path, format='s16le', acodec='pcm_s16le', ac=1, ar=SAMPLE_RATE))
+
+            log = b""
+            if len(outputs) != 0:
+                with stage("decode"):
+                    _, log = ffmpeg.merge_outputs(*outputs).overwrite_output().run(capture_stderr=True)
+
+            frames = self._dedup_frames(log.decode(errors="replace")) if has_video else []
+            with open(self.frames_path, "w") as f:
+                json.dump(frames, f)
+
+            open(self.decoded_path, "w").close()
+
+
+    def frames(self) -> list[str]:
+        """
+        :return: Local paths of the sampled frames, in frame order
+        """
+        return [os.path.join(self.frames_dir, x["file"]) for x in self.frame_info()]
+
+
+    def frame_info(self) -> list[dict]:
+        """
+        :return: Per sampled frame: file name, timestamp in seconds and 64-bit perceptual hash, in frame order
+        """
+        self.decode()
+        with open(self.frames_path) as f:
+            return json.load(f)
+
+
+    def audio(self) -> "np.ndarray":
+        """
+        :return: Mono float32 samples at SAMPLE_RATE in [-1, 1], empty if the video has no audio
+        """
+        import numpy as np
+
+        self.decode()
+        if not os.path.exists(self.audio_path):
+            return np.zeros(0, dtype=np.float32)
+
+        return np.fromfile(self.audio_path, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+    def _sample_frames(self, stream):
+        s = self.sampling
+        if s.mode == "fixed":
+            return stream.filter('fps', fps=s.max_fps)
+
+        # take the first frame, then a frame on every scene change (at most max_fps),
+        # and otherwise one at least every 1/min_fps seconds
+        gap = "t-prev_selected_t"
+        expr = f"isnan(prev_selected_t)+gt(scene,{s.scene_threshold})*gte({gap},{1 / s.max_fps})"
+        if s.min_fps > 0:
+            expr += f"+gte({gap},{1 / s.min_fps})"
+        return stream.filter('select', expr)
+
+
+    def _dedup_frames(self, log: str) -> list[dict]:
+        """
+        :param log: ffmpeg output of the decode, holding the showinfo line of every frame written
+        """
+        import cv2
+
+        # showinfo numbers frames from 0, the image2 muxer from 1
+        timestamps = {}
+        for n, t in re.findall(r"\bn:\s*(\d+)\s+pts:\s*\S+\s+pts_time:(\S+)", log):
+            try:
+                timestamps[int(n) + 1] = float(t)
+            except ValueError:
+                timestamps[int(n) + 1] = None
+
+        files = sorted(os.listdir(self.frames_dir))
+        if len(files) != len(timestamps):
+            raise RuntimeError(f"Decoded {len(files)} frames of {self.source}, but ffmpeg logged {len(timestamps)}")
+
+        frames = []
+        last_hash = None
+        for name in files:
+            im = cv2.imread(os.path.join(self.frames_dir, name))
+            if im is None:
+                continue
+
+            h = perceptual_hash(im)
+            if last_hash is not None and hamming_distance(h, last_hash) <= self.sampling.dedup_distance:
+                os.remove(os.path.join(self.frames_dir, name))
+                continue
+
+            frames.append({
+                "file": name,
+                "timestamp": timestamps[int(re.search(r"(\d+)", name).group(1))],
+                "phash": h,
+            })
+            last_hash = h
+
+        return frames
+
+
+def probe_url(url: str, timeout: float = 30.0) -> dict:
+    """
+    Probe a video over http(s), e.g. a presigned url. ffprobe reads the headers with range requests,
+    seeking to wherever the container keeps its index (e.g. a trailing moov atom), without fetching the rest.
+    :param timeout: Seconds a read may stall before giving up
+    :raises ffmpeg.Error: If the probe fails
+    """
+    with stage("probe"):
+        return ffmpeg.probe(url, rw_timeout=int(timeout * 10**6))
+
+
+def perceptual_hash(image: "np.ndarray") -> int:
+    """
+    64-bit DCT perceptual hash, robust to re-encoding and rescaling.
+    :param image: BGR or grayscale image
+    """
+    import cv2
+    import numpy as np
+
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+
+    # the DC term only carries overall brightness
+    bits = low > np.median(low[1:])
+    return int(sum(1 << i for i, b in enumerate(bits) if b))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
@@ -0,0 +1,196 @@
+import gc
+import logging
+from time import perf_counter
+from threading import RLock
+from collections import OrderedDict
+from contextlib import ExitStack, AbstractContextManager
+from typing import Any, Callable
+from veridash_backend.commons.metrics import MODEL_CACHE_EVENTS, MODEL_LOAD_SECONDS
+
+
+logger = logging.getLogger("veridash")
+
+
+class ModelCache:
+    """
+    Per-process registry keeping loaded models warm across tasks.
+    Models are loaded lazily on first use, and evicted least recently used first
+    when the resident models exceed the RAM or VRAM budget.
+    Models taking device memory lease it for as long as they are resident, so tasks only lease their working memory.
+    """
+    def __init__(self, ram_budget: int = 0, vram_budget: int = 0,
+                 device_lease: Callable[[int], AbstractContextManager] | None = None):
+        """
+        :param ram_budget: Max bytes of model weights kept in host memory (0 for no limit).
+        :param vram_budget: Max bytes of model weights kept in device memory (0 for no limit).
+        :param device_lease: Called with megabytes of device memory, returns a context holding them (e.g. a gpu
+                             semaphore), entered before loading a model and exited once it is evicted. None to never lease.
+        """
+        self.ram_budget = ram_budget
+        self.vram_budget = vram_budget
+        self.device_lease = device_lease
+
+        self._loaders: dict[str, Callable[[], Any]] = {}
+        self._device_mb: dict[str, int] = {}
+        self._models: OrderedDict[str, Any] = OrderedDict()
+        # model name -> the device memory it holds, and the lease on it (None where the context yields nothing)
+        self._leases: dict[str, tuple[ExitStack, Any]] = {}
+        self._lock = RLock()
+
+        self._stats: dict[str, dict[str, float]] = {}
+
+
+    def register(self, name: str, loader: Callable[[], Any], device_mb: int = 0):
+        """
+        :param name: Unique model identifier.
+        :param loader: Called without arguments to construct the model on a cache miss.
+        :param device_mb: Megabytes of device memory the model takes while resident (0 if it is never on a device).
+        """
+        self._loaders[name] = loader
+        self._device_mb[name] = device_mb
+        self._stats[name] = {"hits": 0, "loads": 0, "evictions": 0, "load_seconds": 0.0}
+
+
+    def get(self, name: str) -> Any:
+        """
+        Get a model, loading it if it is not resident.
+        :param name: Model identifier given to register.
+        :return: The model object returned by the loader
+        """
+        with self._lock:
+            stats = self._stats[name]
+
+            # the memory it was loaded into might have been handed to someone else meanwhile
+            lease = self._leases.get(name, (None, None))[1]
+            if name in self._models and lease is not None and lease.lost.is_set():
+                logger.warning(f"Model {name} lost its lease on device memory, reloading it")
+                self.evict(name)
+
+            if name in self._models:
+                self._models.move_to_end(name)
+                stats["hits"] += 1
+                MODEL_CACHE_EVENTS.labels(name, "hit").inc()
+                logger.debug(f"Model {name} served from cache ({stats['hits']} hits, {stats['loads']} loads)")
+                return self._models[name]
+
+            units = self._device_mb[name] if self.device_lease is not None else 0
+            if units != 0:
+                # room is made within the budget first, as other models keep their device memory leased
+                self._enforce_budget(keep=None, extra_vram=units * 2**20)
+                stack = ExitStack()
+                self._leases[name] = (stack, stack.enter_context(self.device_lease(units)))
+
+            start = perf_counter()
+            try:
+                model = self._loaders[name]()
+            except BaseException:
+                self._release(name)
+                raise
+            elapsed = perf_counter() - start
+
+            stats["loads"] += 1
+            stats["load_seconds"] += elapsed
+            MODEL_CACHE_EVENTS.labels(name, "load").inc()
+            MODEL_LOAD_SECONDS.labels(name).inc(elapsed)
+            logger.info(f"Loaded model {name} in {elapsed:.2f}s ({stats['hits']} hits, {stats['loads']} loads)")
+
+            self._models[name] = model
+            self._enforce_budget(keep=name)
+
+            return model
+
+
+    def evict(self, name: str):
+        with self._lock:
+            if name not in self._models:
+                return
+
+            del self._models[name]
+            self._stats[name]["evictions"] += 1
+            MODEL_CACHE_EVENTS.labels(name, "eviction").inc()
+            logger.info(f"Evicted model {name}")
+
+            import torch
+
+            gc.collect()
+            if torch.cuda.device_count() != 0:
+                torch.cuda.empty_cache()
+
+            # only once the memory is actually freed
+            self._release(name)
+
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._models):
+                self.evict(name)
+
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        :return: Per model counters: hits, loads, evictions and total load_seconds
+        """
+        with self._lock:
+            return {k: dict(v) for k, v in self._stats.items()}
+
+
+    def _release(self, name: str):
+        stack, _ = self._leases.pop(name, (None, None))
+        if stack is not None:
+            stack.close()
+
+
+    def _enforce_budget(self, keep: str | None, extra_vram: int = 0):
+        """
+        :param keep: Model that is never evicted
+        :param extra_vram: Bytes of device memory to make room for
+        """
+        # footprints are measured on every check, as models might move between devices after loading.
+        # leased models count at least what they lease
+        while True:
+            ram, vram = 0, extra_vram
+            for name, model in self._models.items():
+                r, v = ModelCache.footprint(model)
+                ram += r
+                vram += max(v, self._device_mb[name] * 2**20 if name in self._leases else 0)
+
+            over_ram = self.ram_budget != 0 and ram > self.ram_budget
+            over_vram = self.vram_budget != 0 and vram > self.vram_budget
+            if not over_ram and not over_vram:
+                return
+
+            victims = [x for x in self._models if x != keep]
+            if len(victims) == 0:
+                if keep is not None:
+                    logger.warning(f"Model {keep} alone exceeds the model cache budget")
+                return
+
+            self.evict(victims[0])
+
+
+    @classmethod
+    def footprint(cls, model: Any) -> tuple[int, int]:
+        """
+        Estimate the memory held by a model's parameters and buffers.
+        :param model: A torch module, or a wrapper exposing one as .model (e.g. ultralytics YOLO)
+        :return: Tuple of bytes in host memory and bytes in device memory
+        """
+        import torch
+
+        module = model
+        while not isinstance(module, torch.nn.Module) and hasattr(module, "model"):
+            module = module.model
+
+        if not isinstance(module, torch.nn.Module):
+            return (0, 0)
+
+        ram, vram = 0, 0
+        for t in list(module.parameters()) + list(module.buffers()):
+            size = t.numel() * t.element_size()
+            if t.device.type == "cpu":
+                ram += size
+            else:
+                vram += size
+
+        return (ram, vram)
+
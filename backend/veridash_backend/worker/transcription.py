@@ -0,0 +1,79 @@
+import numpy as np
+from typing import Callable, Iterator
+from veridash_backend.worker.media import SAMPLE_RATE
+
+
+def split_points(audio: np.ndarray, chunk_seconds: float, search_seconds: float = 5.0) -> list[int]:
+    """
+    Chunk boundaries roughly every chunk_seconds, placed at the quietest moment before each, so words are rarely cut.
+    :param audio: Mono samples at SAMPLE_RATE
+    :param chunk_seconds: Maximum chunk length
+    :param search_seconds: How far before the maximum length to look for silence
+    :return: Sample offsets where chunks end, the last being len(audio)
+    """
+    chunk = int(chunk_seconds * SAMPLE_RATE)
+    search = min(int(search_seconds * SAMPLE_RATE), chunk // 2)
+    window = SAMPLE_RATE // 10
+
+    points = []
+    start = 0
+    while len(audio) - start > chunk:
+        lo = start + chunk - search
+        energy = np.cumsum(np.concatenate([[0.0], audio[lo:start + chunk].astype(np.float64) ** 2]))
+
+        # energy of every 100 ms window
+        windowed = energy[window:] - energy[:-window]
+        start = lo + int(np.argmin(windowed)) + window // 2
+        points.append(start)
+
+    points.append(len(audio))
+    return points
+
+
+def transcribe_chunks(model, audio: np.ndarray, chunk_seconds: float = 30.0, no_speech_threshold: float = 0.7,
+                      check: Callable[[], None] | None = None) -> Iterator[tuple[float, str, list[dict]]]:
+    """
+    Transcribe audio window by window, in order. The language is detected on the first window with speech and kept
+    for the rest, as videos often open with music or silence. Each window is prompted with the previous text.
+    :param model: Loaded whisper model
+    :param audio: Mono float32 samples at SAMPLE_RATE
+    :param chunk_seconds: Approximate window length
+    :param no_speech_threshold: Segments more likely than this to be silence are dropped
+    :param check: Called before and after every window, raising to stop, e.g. Lease.check
+    :return: Per window: fraction of the audio done, language, and segments with timestamps relative to the whole audio
+    """
+    # kept once detected on a window with speech
+    language = None
+    prompt = None
+    next_id = 0
+
+    start = 0
+    for end in split_points(audio, chunk_seconds):
+        if check is not None:
+            check()
+        res = model.transcribe(audio[start:end], language=language, initial_prompt=prompt)
+        if check is not None:
+            check()
+
+        offset = start / SAMPLE_RATE
+        segments = []
+        for x in res["segments"]:
+            if x["no_speech_prob"] >= no_speech_threshold:
+                continue
+
+            x.pop("tokens", None)
+            x["id"] = next_id
+            x["seek"] += int(offset * 100)  # in 10 ms mel frames
+            x["start"] += offset
+            x["end"] += offset
+
+            segments.append(x)
+            next_id += 1
+
+        if len(segments) != 0:
+            language = language or res["language"]
+            # the tail of the text so far, whisper only uses the last 224 tokens anyway
+            prompt = "".join(x["text"] for x in segments)[-500:]
+
+        yield (end / max(len(audio), 1), language or res["language"], segments)
+        start = end
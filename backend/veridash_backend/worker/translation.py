@@ -1,9 +1,25 @@
+import json
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
+from veridash_backend.commons.db import Database
 from veridash_backend.commons.settings import Settings
 
 
+logger = logging.getLogger("veridash")
+
+SYSTEM_PROMPT = """You translate transcribed speech to English.
+The input is a JSON object {"segments": [{"id": <int>, "text": <string>}, ...]}.
+Respond with a JSON object {"translations": [{"id": <int>, "text": <string>}, ...]} holding exactly one translation \
+per input segment, with the same ids. Never merge or split segments."""
+
+
 class Translator:
-    def __init__(self):
+    def __init__(self, db: Database | None = None):
+        """
+        :param db: Where translations are cached, no caching if None
+        """
         s = Settings()
 
         if not s.HAS_OPENAI:
@@ -13,20 +29,101 @@ class Translator:
             organization=s.OPENAI_ORG,
             project=s.OPENAI_PROJECT,
             api_key=s.OPENAI_API_KEY,
+            base_url=s.OPENAI_BASE_URL,
         )
+        self.model = s.TRANSLATION_MODEL
+        self.chunk_tokens = s.TRANSLATION_CHUNK_TOKENS
+        self.concurrency = s.TRANSLATION_CONCURRENCY
+        self.db = db
+
+
+    def translate_sentences(self, sentences: list[str], language: str | None = None) -> list[str | None]:
+        """
+        :param sentences: Sentences to translate, e.g. transcript segments
+        :param language: Source language, part of the cache key
+        :return: English translations in the same order, None where the model gave none
+        """
+        language = language or "auto"
+        hashes = [hashlib.sha256(x.encode()).hexdigest() for x in sentences]
+
+        translated = self.db.get_translations(list(set(hashes)), language) if self.db else {}
+
+        # repeated sentences are only translated once
+        missing = {}
+        for h, x in zip(hashes, sentences):
+            if h not in translated and x.strip():
+                missing[h] = x
+
+        if len(missing) != 0:
+            new = self._translate(list(missing.values()))
+            new = {h: y for h, y in zip(missing, new) if y is not None}
+
+            if self.db and len(new) != 0:
+                self.db.add_translations(new, language)
+            translated.update(new)
+
+        logger.debug(f"Translated {len(missing)} of {len(sentences)} sentences, the rest were cached or empty")
+        return [translated.get(h, x if not x.strip() else None) for h, x in zip(hashes, sentences)]
 
 
-    def translate_sentences(self, sentences: list[str]) -> list[str]:
-        s = '\n'.join(sentences)
+    def _translate(self, sentences: list[str]) -> list[str | None]:
+        chunks = self._chunk(sentences)
 
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(self._translate_chunk, chunks))
+
+        out = []
+        for chunk, res in zip(chunks, results):
+            out.extend(res.get(i) for i, _ in chunk)
+
+        return out
+
+
+    def _chunk(self, sentences: list[str]) -> list[list[tuple[int, str]]]:
+        """
+        Split into chunks of (id, sentence) within the token budget, ids being positions in sentences
+        """
+        chunks = [[]]
+        tokens = 0
+        for i, x in enumerate(sentences):
+            # roughly 4 characters per token, plus the json around it
+            n = len(x) // 4 + 10
+            if tokens + n > self.chunk_tokens and len(chunks[-1]) != 0:
+                chunks.append([])
+                tokens = 0
+
+            chunks[-1].append((i, x))
+            tokens += n
+
+        return chunks
+
+
+    def _translate_chunk(self, chunk: list[tuple[int, str]], retry: bool = True) -> dict[int, str]:
         completion = self.client.chat.completions.create(
-            model="gpt-4o",
+            model=self.model,
+            response_format={"type": "json_object"},
             messages=[
-                {"role": "system", "content": "Please translate each newline-separated sentence to English, returning a similarly newline-separated output."},
-                {"role": "user", "content": s},
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": json.dumps({"segments": [{"id": i, "text": x} for i, x in chunk]})},
             ],
         )
 
-        content = completion.choices[0].message.content
-        return [] if not content else content.split('\n')
+        res = {}
+        try:
+            content = json.loads(completion.choices[0].message.content or "{}")
+            for x in content.get("translations", []):
+                if isinstance(x, dict) and isinstance(x.get("text"), str):
+                    res[int(x["id"])] = x["text"]
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"Malformed translation response: {e}")
+
+        # only ids we asked for are accepted, anything left out is asked for once more
+        ids = {i for i, _ in chunk}
+        res = {i: x for i, x in res.items() if i in ids}
+
+        left = [(i, x) for i, x in chunk if i not in res]
+        if retry and len(left) != 0:
+            logger.warning(f"Translation left out {len(left)} of {len(chunk)} segments, retrying those")
+            res.update(self._translate_chunk(left, retry=False))
 
+        return res
@@ -50,7 +50,7 @@ export default function Keyframes({ videoId, frameNo }: { videoId: string | unde
         />
       }
 
-      <p className="mb-2">Keyframes (1 frame per second)</p>
+      <p className="mb-2">Keyframes</p>
 
       <div className="h-[28vh] flex items-center justify-center">
         <img
@@ -66,7 +66,10 @@ export default function Keyframes({ videoId, frameNo }: { videoId: string | unde
           Previous
         </button>
 
-        <span className="py-2 px-4">{frameNumber} / {d.urls.length}</span>
+        <span className="py-2 px-4">
+          {frameNumber} / {d.urls.length}
+          {d.timestamps?.[frameNumber - 1] != null ? ` (${d.timestamps[frameNumber - 1]!.toFixed(1)}s)` : ""}
+        </span>
 
         <button
           onClick={() => { if (frameNumber < d.urls.length) setFrameNumber(frameNumber + 1); }}
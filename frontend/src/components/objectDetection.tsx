@@ -1,20 +1,22 @@
 import { useState, useEffect } from "react";
-import useBackend, { BackendError, ObjDetectResponse } from "@/useBackend";
+import useBackend, { BackendError, ObjDetectProgress, ObjDetectResponse } from "@/useBackend";
 
 export default function ObjectDetection({ videoId, onUpdateKeyFrame: handleKeyFrameUpdate }: { videoId: string | undefined, onUpdateKeyFrame: any }) {
-  const data = useBackend<ObjDetectResponse | BackendError>(videoId, "objectdetection");
+  const data = useBackend<ObjDetectResponse | ObjDetectProgress | BackendError>(videoId, "objectdetection");
   const [frameNumber, setFrameNumber] = useState<number>(1);
+  const progress = data as ObjDetectProgress;
+  const inProgress = progress?.progress !== undefined;
 
   useEffect(() => {
-    if (data && (data as ObjDetectResponse)?.keyFrameNumbers) {
+    if (data && !inProgress && (data as ObjDetectResponse)?.keyFrameNumbers) {
       const d = data as ObjDetectResponse;
       handleKeyFrameUpdate(d.keyFrameNumbers[frameNumber - 1]);
     }
   }, [data, frameNumber])
 
-  if (!data || (data as BackendError)?.error) {
+  if (!data || inProgress || (data as BackendError)?.error) {
     // NOTE: error should really not be meaning loading...
-    const isLoading = (!data || (data as BackendError)?.error) && videoId;
+    const isLoading = (!data || inProgress || (data as BackendError)?.error) && videoId;
 
     return (
       <div>
@@ -33,8 +35,12 @@ export default function ObjectDetection({ videoId, onUpdateKeyFrame: handleKeyFr
                 </div>
                 <div></div>
               </div>
-              <p>This typically takes the longest time</p>
-              <p>(Should be done in a couple of minutes)</p>
+              {inProgress ? (
+                <p>Detecting objects... {Math.round(progress.progress * 100)}% ({progress.partsDone} of {progress.parts} parts)</p>
+              ) : (<>
+                <p>This typically takes the longest time</p>
+                <p>(Should be done in a couple of minutes)</p>
+              </>)}
             </div>) : ''
         }
       </div>
@@ -50,9 +50,15 @@ export default function VideoSource({
     if (!data)
       return;
 
+    const uploadUrl = (data as SourceResponse).uploadUrl;
+    if (uploadUrl === null) {
+      handleFinishedUpload(data!.videoId, undefined);
+      return;
+    }
+
     setLoading(true);
     (async () => {
-      const res = await fetch((data as SourceResponse).uploadUrl, {
+      const res = await fetch(uploadUrl, {
         method: "PUT",
         body: file![0],
         headers: {
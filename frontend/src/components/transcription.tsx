@@ -1,4 +1,5 @@
-import useBackend, { TranscriptionResponse } from "@/useBackend";
+import { useState, useEffect } from "react";
+import useBackend, { BackendProgress, Segment, TranscriptionProgress, TranscriptionResponse } from "@/useBackend";
 import ISO6391 from 'iso-639-1';
 
 export default function Transcription({ videoId, onScrub: handleScrub }: {
@@ -9,11 +10,34 @@ export default function Transcription({ videoId, onScrub: handleScrub }: {
     return new Date(seconds * 1000).toISOString().slice(11, 19);
   }
 
-  const data = useBackend<TranscriptionResponse>(videoId, "transcription");
+  const data = useBackend<TranscriptionResponse | TranscriptionProgress>(videoId, "transcription");
+  const progress = (data as BackendProgress)?.progress;
+  const inProgress = progress !== undefined;
 
-  if ((data as TranscriptionResponse)?.transcription.language) {
+  // progress only carries the segments that changed, put in place by offset
+  const [segments, setSegments] = useState<Segment[]>([]);
+
+  useEffect(() => {
+    setSegments([]);
+  }, [videoId]);
+
+  useEffect(() => {
+    if (!inProgress || !(data as TranscriptionProgress)?.transcription)
+      return;
+
+    const t = (data as TranscriptionProgress).transcription;
+    setSegments(prev => {
+      const next = [...prev];
+      t.segments.forEach((x, i) => { next[t.offset + i] = x; });
+      return next;
+    });
+  }, [data]);
+
+  if ((data as TranscriptionResponse)?.transcription?.language) {
     const d = data as TranscriptionResponse;
-    if (d.transcription.segments.length === 0 || (d.transcription.segments.length === 1 && d.transcription.segments[0].no_speech_prob > 0.7)) {
+    // results hold every segment
+    const shown = inProgress ? segments : d.transcription.segments;
+    if (!inProgress && (shown.length === 0 || (shown.length === 1 && shown[0].no_speech_prob > 0.7))) {
       return (
         <div>
           Transcription/Translation
@@ -25,9 +49,12 @@ export default function Transcription({ videoId, onScrub: handleScrub }: {
     return (
       <div className="h-full overflow-auto hover:overflow-scroll">
         <p className="mb-2">Transcription ({ISO6391.getName(d.transcription.language)} - {d.transcription.language}):</p>
+        {inProgress ? (
+          <p className="mb-2 text-gray-600 italic">Transcribing... {Math.round(progress * 100)}%</p>
+        ) : ""}
         {
-          d.transcription.segments
-            .filter(x => x.no_speech_prob < 0.7)
+          shown
+            .filter(x => x && x.no_speech_prob < 0.7)
             .map(x =>
               <p key={x.id} className="mb-2">
                 <span
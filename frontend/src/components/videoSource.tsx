@@ -79,10 +79,16 @@ export default function VideoSource({
   // --- upload once backend returns signed URL (unchanged) ---
   useEffect(() => {
     if (!data || !file) return;
+    const uploadUrl = (data as SourceResponse).uploadUrl;
+    if (uploadUrl === null) {
+      // identical content is already uploaded
+      handleFinishedUpload((data as SourceResponse).videoId, undefined);
+      return;
+    }
     setLoading(true);
     (async () => {
       try {
-        const res = await fetch((data as SourceResponse).uploadUrl, {
+        const res = await fetch(uploadUrl, {
           method: "PUT",
           body: file[0],
           headers: { "Content-Type": file[0].type },
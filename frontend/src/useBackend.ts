@@ -19,7 +19,8 @@ export interface BackendError extends BackendMessage {
 }
 
 export interface SourceResponse extends BackendMessage {
-  uploadUrl: string;
+  // null when identical content is already uploaded
+  uploadUrl: string | null;
   downloadUrl: string;
 }
 
@@ -37,7 +38,17 @@ export interface TranscriptionResponse extends BackendMessage {
   };
 }
 
-interface Segment {
+// published while transcribing, holding the segments transcribed or translated since the last one
+export interface TranscriptionProgress extends BackendProgress {
+  transcription: {
+    // index of the first segment
+    offset: number;
+    segments: Segment[];
+    language: string;
+  };
+}
+
+export interface Segment {
   id: number;
   seek: number;
 
@@ -59,11 +70,34 @@ export interface MapResponse extends BackendMessage {
 
 export interface KeyFramesResponse extends BackendMessage {
   urls: string[];
+  // seconds into the video, keyframes are sampled on scene changes
+  timestamps?: (number | null)[];
+  // usable as imageId in "similar" messages
+  imageIds?: string[];
+}
+
+// long videos are detected in parts, announced as they finish
+export interface ObjDetectProgress extends BackendProgress {
+  partsDone: number;
+  parts: number;
 }
 
 export interface ObjDetectResponse extends BackendMessage {
   urls: string[];
   keyFrameNumbers: number[];
+  classNames?: string[];
+  confidences?: number[];
+  imageIds?: string[];
+}
+
+// keyframes like a keyframe, or objects like an object, across all of the user's videos
+export interface SimilarResponse extends BackendMessage {
+  urls: string[];
+  imageIds: string[];
+  videoIds: string[];
+  frameNumbers: number[];
+  // cosine distance, closest first
+  distances: number[];
 }
 
 export interface StitchingResponse extends BackendMessage {
@@ -1,11 +1,24 @@
 #!/bin/bash
 
+# every process (uvicorn and celery workers) writes its metrics here, scrapes aggregate over them
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 if [ "$1" = "webserver" ]; then
 	uvicorn veridash_backend.webserver.app:app --host 0.0.0.0 --port 80 --workers 8
 elif [ "$1" = "worker" ]; then
-	celery -A veridash_backend.worker.app worker --concurrency=8 -E
+	# every queue in one worker, for single node setups
+	celery -A veridash_backend.worker.app worker -Q io,cpu,gpu --concurrency=8 -E
+elif [ "$1" = "worker-io" ]; then
+	celery -A veridash_backend.worker.app worker -Q io -n io@%h \
+		--concurrency=${WORKER_CONCURRENCY:-16} --prefetch-multiplier=4 -E
+elif [ "$1" = "worker-cpu" ]; then
+	celery -A veridash_backend.worker.app worker -Q cpu -n cpu@%h \
+		--concurrency=${WORKER_CONCURRENCY:-$(nproc)} --prefetch-multiplier=1 -E
+elif [ "$1" = "worker-gpu" ]; then
+	celery -A veridash_backend.worker.app worker -Q gpu -n gpu@%h \
+		--concurrency=${WORKER_CONCURRENCY:-2} --prefetch-multiplier=1 -E
 else
-	echo "No valid entrypoint command specified. Please use 'webserver' or 'worker'."
+	echo "No valid entrypoint command specified. Please use 'webserver', 'worker', 'worker-io', 'worker-cpu' or 'worker-gpu'."
 	exit 1
 fi
-